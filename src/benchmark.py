@@ -0,0 +1,280 @@
+"""
+Benchmarks the training, loading, scoring and generation speed of the language models.
+
+The benchmark runs on a fixture built from the smallest files of each corpus directory,
+inside a temporary workspace, so it never touches the real splits, counts or model files.
+Results are written as JSON, and can be compared with the results of an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import numpy as np
+from dataset_functions import (BASE_PATH, TRAINING_COUNTS_PATH, directories,
+                               generate_corpus_counts, generate_training_counts,
+                               model_perplexity, split_texts, splitting_datasets, write_counts)
+from vanilla import VanillaLM
+from laplace import LaplaceLM
+from unk import UnkLM
+from kneser_ney import KneserNeyLM
+from model_set import ModelSet
+from decoding import Decoder, generate_bulk
+
+MODEL_CLASSES = [VanillaLM, LaplaceLM, UnkLM, KneserNeyLM]
+
+def timed(function, repeat=1):
+    """ Runs a function repeat times and returns its fastest time and last result.
+
+    Parameters:
+    function (callable): The function to be timed, called without arguments.
+    repeat (int): The number of runs.
+
+    Returns:
+    tuple: The fastest run time in seconds and the function's result.
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def build_fixture(workspace, files_per_directory):
+    """ Builds a workspace mirroring the project layout around a subset of the corpus.
+
+    The workspace holds a data/corpus/Texts tree linking to the smallest files of each
+    corpus directory and an empty src/n_grams tree, so the relative paths used by the
+    project resolve inside the workspace once it is the working directory.
+
+    Parameters:
+    workspace (str): The directory to build the fixture in.
+    files_per_directory (int): The number of files taken per directory, 0 for all.
+
+    Returns:
+    int: The number of corpus files in the fixture.
+    """
+    number_of_files = 0
+    for directory in directories:
+        source = os.path.join(BASE_PATH, directory)
+        files = sorted((file for file in os.listdir(source) if file.endswith('.xml')),
+                       key=lambda file: (os.path.getsize(os.path.join(source, file)), file))
+        if files_per_directory:
+            files = files[:files_per_directory]
+
+        target = os.path.join(workspace, 'data', 'corpus', 'Texts', directory)
+        os.makedirs(target)
+        for file in files:
+            os.symlink(os.path.abspath(os.path.join(source, file)), os.path.join(target, file))
+        number_of_files += len(files)
+
+    for directory in ('corpus', 'unk', 'vanilla_laplace'):
+        os.makedirs(os.path.join(workspace, 'src', 'n_grams', directory))
+    return number_of_files
+
+def benchmark_counts(repeat):
+    """ Times the corpus split and the n-gram count generation.
+
+    Returns:
+    dict: The split, corpus count and training count times in seconds.
+    """
+    random.seed(42)
+    split_seconds, _ = timed(splitting_datasets)
+    corpus_seconds, _ = timed(generate_corpus_counts, repeat)
+    training_seconds, counts = timed(generate_training_counts, repeat)
+    write_counts(counts, TRAINING_COUNTS_PATH)
+    return {
+        'split_seconds': split_seconds,
+        'corpus_counts_seconds': corpus_seconds,
+        'training_counts_seconds': training_seconds,
+    }
+
+def benchmark_model(model_class, test_sentences, prompts, repeat, scoring_sentences,
+                    per_prompt=50):
+    """ Times building, loading, scoring and generation for one language model class.
+
+    Parameters:
+    model_class (type): The language model class.
+    test_sentences (list): The test sentences used for perplexity.
+    prompts (list): The phrases text generation starts from.
+    repeat (int): The number of runs of each timed step.
+    scoring_sentences (int): The number of sentences scored one at a time.
+    per_prompt (int): The number of sentences bulk generation generates per prompt.
+
+    Returns:
+    dict: The timings and throughputs of the model.
+    """
+    model_path = os.path.join(model_class.counts_directory, f'{model_class.__name__}.bin')
+    if os.path.exists(model_path):
+        os.remove(model_path)
+    build_seconds, _ = timed(model_class)
+    load_seconds, model = timed(model_class, repeat)
+    lazy_load_seconds, _ = timed(lambda: model_class(lazy=True), repeat)
+
+    def construct_tables():
+        model._generate_probabilities()
+        model._build_interpolation_table()
+        model._build_successor_index()
+    tables_seconds, _ = timed(construct_tables, repeat)
+
+    sample = test_sentences[:scoring_sentences]
+    scoring_seconds, _ = timed(lambda: [model.sentence_log_probability(sentence)
+                                        for sentence in sample], repeat)
+    perplexity_seconds, perplexities = timed(lambda: model_perplexity(model, test_sentences),
+                                             repeat)
+
+    generation = {}
+    for choice in ('1', '2', '3', '4'):
+        random.seed(0)
+        seconds, texts = timed(lambda: [model.text_generator(prompt, choice)
+                                        for prompt in prompts])
+        generated = (sum(len(text.split()) for text in texts)
+                     - sum(len(prompt.split()) + 1 for prompt in prompts))
+        generation[choice] = generated / seconds
+
+    bulk_generation = {}
+    for workers in sorted({1, min(4, os.cpu_count() or 1)}):
+        _, statistics = generate_bulk(Decoder(model, '4', seed=0), prompts, per_prompt, workers)
+        bulk_generation[f'{workers}_workers'] = {
+            'sentences_per_second': statistics['sentences_per_second'],
+            'average_length': statistics['average_length'],
+        }
+
+    return {
+        'build_seconds': build_seconds,
+        'load_seconds': load_seconds,
+        'lazy_load_seconds': lazy_load_seconds,
+        'probability_tables_seconds': tables_seconds,
+        'sentence_scoring_sentences_per_second': len(sample) / scoring_seconds,
+        'batch_perplexity_sentences_per_second': len(test_sentences) / perplexity_seconds,
+        'generation_tokens_per_second': generation,
+        'bulk_generation': bulk_generation,
+        'model_bytes': model.store.nbytes(),
+        'perplexities': [float(perplexity) for perplexity in perplexities],
+    }
+
+def benchmark_model_set(repeat, names=('vanilla', 'laplace', 'unk')):
+    """ Compares loading the models separately with loading them as one ModelSet.
+
+    Every table is memory-mapped, so the size of the model files mapped is the memory the
+    tables take once they are touched.
+
+    Parameters:
+    repeat (int): The number of runs of each timed step.
+    names (tuple): The names of the models in the set.
+
+    Returns:
+    dict: The load times and mapped model file sizes of both setups.
+    """
+    timed(lambda: ModelSet(names))
+    shared_seconds, model_set = timed(lambda: ModelSet(names), repeat)
+    separate_seconds, models = timed(lambda: [model.__class__() for model in model_set],
+                                     repeat)
+
+    shared_paths = {os.path.join(directory, 'counts.bin') for directory in model_set.stores}
+    shared_paths.update(model.model_path for model in model_set)
+    return {
+        'shared_load_seconds': shared_seconds,
+        'separate_load_seconds': separate_seconds,
+        'shared_model_file_bytes': sum(os.path.getsize(path) for path in shared_paths),
+        'separate_model_file_bytes': sum(os.path.getsize(model.model_path) for model in models),
+    }
+
+def run_benchmarks(files_per_directory=3, repeat=3, scoring_sentences=500, prompts=20):
+    """ Runs the whole benchmark suite on a corpus fixture in a temporary workspace.
+
+    Parameters:
+    files_per_directory (int): The number of corpus files taken per directory, 0 for all.
+    repeat (int): The number of runs of each timed step, the fastest being kept.
+    scoring_sentences (int): The number of sentences scored one at a time.
+    prompts (int): The number of phrases text generation starts from.
+
+    Returns:
+    dict: The environment, fixture description and results of every benchmark.
+    """
+    workspace = tempfile.mkdtemp(prefix='lm_benchmark_')
+    working_directory = os.getcwd()
+    try:
+        number_of_files = build_fixture(workspace, files_per_directory)
+        os.chdir(os.path.join(workspace, 'src'))
+
+        results = {'counts': benchmark_counts(repeat)}
+        test_sentences = split_texts('test')
+        phrases = [" ".join(sentence.split()[:2]) for sentence in test_sentences
+                   if sentence.split()][:prompts]
+        for model_class in MODEL_CLASSES:
+            results[model_class.__name__] = benchmark_model(model_class, test_sentences,
+                                                            phrases, repeat, scoring_sentences)
+        results['ModelSet'] = benchmark_model_set(repeat)
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(workspace)
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'fixture': {
+            'files_per_directory': files_per_directory,
+            'files': number_of_files,
+            'test_sentences': len(test_sentences),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+def flatten(results, prefix=''):
+    """ Flattens nested benchmark results into a {dotted.name: value} dictionary.
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+def compare(previous, current):
+    """ Prints every benchmark value next to its value in an earlier run.
+
+    Parameters:
+    previous (dict): The results of the earlier run.
+    current (dict): The results of this run.
+
+    Returns:
+        None
+    """
+    previous_values = flatten(previous['results'])
+    for name, value in flatten(current['results']).items():
+        if name in previous_values and previous_values[name] and np.isfinite(value):
+            print(f"{name}: {previous_values[name]:.6g} -> {value:.6g} "
+                  f"({value / previous_values[name]:.2f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files-per-directory', type=int, default=3,
+                        help="corpus files per directory in the fixture, 0 for the whole corpus")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scoring-sentences', type=int, default=500)
+    parser.add_argument('--prompts', type=int, default=20)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="results of an earlier run to compare with")
+    arguments = parser.parse_args()
+
+    benchmark = run_benchmarks(arguments.files_per_directory, arguments.repeat,
+                               arguments.scoring_sentences, arguments.prompts)
+    with open(arguments.output, 'w', encoding='utf-8') as fp:
+        json.dump(benchmark, fp, indent=4)
+
+    if arguments.compare:
+        with open(arguments.compare, 'r', encoding='utf-8') as fp:
+            compare(json.load(fp), benchmark)
+    else:
+        print(json.dumps(benchmark['results'], indent=4))
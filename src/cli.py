@@ -0,0 +1,200 @@
+"""
+Scores or completes sentences in bulk, reading one sentence per line from files or stdin
+and writing one JSON object per line to stdout.
+
+Input is read and processed in chunks of --chunk-size lines, each chunk scored with one
+batch call, or completed by a batched decoder, and written out before the next is read,
+so memory stays constant however large the input is and results can be piped straight
+into the next stage.
+
+Examples:
+    python cli.py score --model laplace --choice 3 sentences.txt > scores.jsonl
+    cat phrases.txt | python cli.py generate --model vanilla --choice 4 --seed 1 \
+        | python cli.py score --model vanilla --field sentence
+    python cli.py generate --model kneser_ney --mode beam --beam-width 8 phrases.txt
+    python cli.py generate --model kneser_ney --mode top_p --per-phrase 100 --workers 8 \
+        --seed 1 phrases.txt > augmented.jsonl
+"""
+import argparse
+import json
+import math
+import sys
+from itertools import islice
+from decoding import MODES, Decoder, generate_bulk, generation_pool
+from server import CHOICES, MODEL_CLASSES, finite_or_none, load_models
+
+def read_chunks(streams, chunk_size, field=None):
+    """ Yields the lines of several text streams in chunks, without their line endings.
+
+    Parameters:
+    streams (list): The open text streams, read one after the other.
+    chunk_size (int): The number of lines per chunk.
+    field (str): If given, every line is a JSON object, as written by an earlier stage,
+    and the value of this field is used instead of the line.
+
+    Yields:
+    list: The next chunk of lines.
+    """
+    for stream in streams:
+        lines = (line.rstrip('\r\n') for line in stream)
+        if field is not None:
+            lines = (json.loads(line)[field] for line in lines if line.strip())
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+def score_chunk(model, sentences, choice):
+    """ Scores a chunk of sentences with one batch call.
+
+    Parameters:
+    model (LanguageModel): The model scoring the sentences.
+    sentences (list): The sentences to be scored.
+    choice (str): '1' unigram, '2' bigram, '3' trigram, '4' linear interpolation, or
+    'all' for the four of them.
+
+    Returns:
+    list: One result dictionary per sentence, holding its log probability, perplexity
+    and number of scored words, the log probability and perplexity null where the
+    sentence has probability 0, as JSON cannot represent infinities.
+    """
+    log_probabilities, lengths = model.batch_log_probabilities(sentences)
+    results = []
+    for index, sentence in enumerate(sentences):
+        length = int(lengths[index])
+        scores = {}
+        for position, name in enumerate(CHOICES):
+            if choice not in ('all', name):
+                continue
+            log_probability = float(log_probabilities[position, index])
+            perplexity = finite_or_none(math.exp(-log_probability / length)) if length else None
+            scores[name] = {'log_probability': finite_or_none(log_probability),
+                            'perplexity': perplexity}
+
+        result = {'sentence': sentence, 'words': length}
+        if choice == 'all':
+            result['scores'] = scores
+        else:
+            result.update(scores[choice])
+        results.append(result)
+    return results
+
+def generate_chunk(decoder, phrases, per_phrase=1, workers=1, pool=None):
+    """ Completes a chunk of phrases, decoded together in shards, in parallel worker
+    processes if asked.
+
+    Parameters:
+    decoder (Decoder): The decoder completing the phrases.
+    phrases (list): The phrases to be completed.
+    per_phrase (int): The number of completions of each phrase.
+    workers (int): The number of worker processes.
+    pool (multiprocessing.pool.Pool): Worker processes kept open between chunks, opened
+    by decoding.generation_pool.
+
+    Returns:
+    list: One result dictionary per completion, holding the completed sentence with its
+    start and end markers as text, and without them as sentence.
+    """
+    sentences, _ = generate_bulk(decoder, phrases, per_phrase, workers, pool=pool)
+    completed = [phrase for phrase in phrases for _ in range(per_phrase)]
+    return [{'phrase': phrase, 'text': " ".join(words), 'sentence': " ".join(words[1:-1])}
+            for phrase, words in zip(completed, sentences)]
+
+def run(command, model, choice, streams, output, chunk_size=10000, field=None, decoder=None,
+        per_phrase=1, workers=1):
+    """ Processes the input streams chunk by chunk, writing a JSON line per sentence.
+
+    Parameters:
+    command (str): 'score' or 'generate'.
+    model (LanguageModel): The model used.
+    choice (str): The n-gram choice, or 'all' when scoring.
+    streams (list): The open input streams.
+    output (file): The stream the JSON lines are written to.
+    chunk_size (int): The number of lines processed at a time.
+    field (str): The field holding the sentence when the input is JSON lines.
+    decoder (Decoder): The decoder used for generation, by default one sampling with
+    the model and n-gram choice.
+    per_phrase (int): The number of completions generated for each phrase.
+    workers (int): The number of worker processes generating, opened once for the whole
+    run, so each loads the model once.
+
+    Returns:
+    int: The number of lines processed.
+    """
+    if command == 'generate' and decoder is None:
+        decoder = Decoder(model, choice)
+    pool = generation_pool(decoder, workers) if command == 'generate' and workers > 1 else None
+
+    processed = 0
+    try:
+        for chunk in read_chunks(streams, chunk_size, field):
+            if command == 'score':
+                results = score_chunk(model, chunk, choice)
+            else:
+                results = generate_chunk(decoder, chunk, per_phrase, workers, pool)
+
+            output.write("".join(json.dumps(result) + "\n" for result in results))
+            output.flush()
+            processed += len(chunk)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return processed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['score', 'generate'])
+    parser.add_argument('inputs', nargs='*', default=['-'],
+                        help="files with one sentence per line, '-' for stdin (the default)")
+    parser.add_argument('--model', choices=sorted(MODEL_CLASSES), default='vanilla')
+    parser.add_argument('--choice', choices=list(CHOICES) + ['all'], default='4',
+                        help="1 unigram, 2 bigram, 3 trigram, 4 linear interpolation, "
+                             "all for every order (scoring only)")
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--field',
+                        help="read JSON lines and use this field, e.g. sentence after generate")
+    parser.add_argument('--seed', type=int, help="random seed for generation")
+    parser.add_argument('--mode', choices=MODES, default='sample', help="decoding mode")
+    parser.add_argument('--beam-width', type=int, default=4)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--top-p', type=float, default=0.9)
+    parser.add_argument('--max-words', type=int, default=100,
+                        help="the most words generated per phrase")
+    parser.add_argument('--min-words', type=int, default=0,
+                        help="the fewest words generated per phrase before it may end")
+    parser.add_argument('--length-penalty', type=float, default=1.0,
+                        help="beam search divides log probabilities by length to this power")
+    parser.add_argument('--per-phrase', type=int, default=1,
+                        help="the number of completions generated for each phrase")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes generating, sharing the memory-mapped model")
+    parser.add_argument('--lazy', action='store_true',
+                        help="compute probabilities on demand instead of at startup")
+    arguments = parser.parse_intermixed_args()
+
+    if arguments.command == 'generate' and arguments.choice == 'all':
+        parser.error("generate needs a single n-gram choice")
+
+    language_model = load_models([arguments.model], arguments.lazy)[arguments.model]
+    text_decoder = None
+    if arguments.command == 'generate':
+        text_decoder = Decoder(language_model, arguments.choice, arguments.mode,
+                               arguments.beam_width, arguments.top_k, arguments.top_p,
+                               arguments.max_words, seed=arguments.seed,
+                               length_penalty=arguments.length_penalty,
+                               min_words=arguments.min_words)
+    input_streams = [sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+                     for path in arguments.inputs]
+    try:
+        run(arguments.command, language_model, arguments.choice, input_streams, sys.stdout,
+            arguments.chunk_size, arguments.field, text_decoder, arguments.per_phrase,
+            arguments.workers)
+    except BrokenPipeError:
+        # the reading end of the pipe closed early, as with head
+        sys.stderr.close()
+    finally:
+        for input_stream in input_streams:
+            if input_stream is not sys.stdin:
+                input_stream.close()
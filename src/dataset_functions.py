@@ -8,97 +8,482 @@ Date: [8th april 2024]
 import random
 import os
 import json
+import hashlib
+import shutil
 import xml.etree.ElementTree as ET
 from collections import defaultdict
+from functools import partial
+from multiprocessing import Pool
 import numpy as np
+from ngram_store import Vocabulary
+from sentence_store import ArrayWriter, SentenceStore, SentenceStoreWriter
 
 random.seed(42)
 
 directories = ['aca', 'dem', 'fic', 'news']
 BASE_PATH = '../data/corpus/Texts/'
+TRAINING_COUNTS_PATH = 'n_grams/vanilla_laplace'
+CORPUS_COUNTS_PATH = 'n_grams/corpus'
+SPLIT_PATH = '../data/split'
+MANIFEST_FILE = 'manifest.json'
 
-def generate_corpus_counts():
-    for number_of_words in range(1, 4):
-        n_gram_counts = defaultdict(int)
-
-        for directory in directories:
-            dir_path = os.path.join(BASE_PATH, directory)
-            for file in os.listdir(dir_path):
-                if file.endswith('.xml'):
-                    file_path = os.path.join(dir_path, file)
-                    tree = ET.parse(file_path)
-                    root = tree.getroot()
-                    for child in root:
-                        if child.tag != 'teiHeader':
-                            traverse_tree(child, number_of_words, n_gram_counts)
-
-        with open(f'n_grams/corpus/{number_of_words}_gram_counts.json',
-                  'w', encoding='utf-8') as fp:
-            json.dump(n_gram_counts, fp, indent=4)
+MAX_ORDER = 3
+
+split_cache = {}
 
-def traverse_tree(node, number_of_words, counts):
-    """ Recursively traverses the XML tree to find sentences and process their 
-    text for n-gram frequency calculation.
+def new_counts(max_order=MAX_ORDER):
+    """ Creates one empty count table per n-gram order.
 
     Parameters:
-    node (xml.etree.ElementTree.Element): The current node in the XML tree.
-    number_of_words (int): The number of words in the n-grams to be counted.
-    counts (collections.defaultdict): A dictionary to store the n-gram counts.
+    max_order (int): The highest n-gram order to be counted.
+
+    Returns:
+    list: A defaultdict per order, index 0 holding the unigram counts.
+    """
+    return [defaultdict(int) for _ in range(max_order)]
+
+def counts_path(directory, max_order=MAX_ORDER):
+    """ Returns the directory the counts up to max_order are kept in.
+
+    Counts of the default order are kept in the directory itself, and counts of any
+    other order in a sibling directory named after the order, so models of different
+    orders never overwrite each other's counts.
+
+    Parameters:
+    directory (str): The directory of the default order's counts.
+    max_order (int): The highest n-gram order counted.
+
+    Returns:
+    str: The directory of the counts.
+    """
+    if max_order == MAX_ORDER:
+        return directory
+    return f'{directory}_{max_order}gram'
+
+def generate_corpus_counts(max_order=MAX_ORDER, workers=1, incremental=False):
+    """ Counts the n-grams of every order up to max_order over the whole corpus,
+    streaming each corpus file once, and saves them to the n_grams/corpus directory.
+
+    With more than one worker the corpus files are counted in a process pool. The
+    partial tables are merged in file order, so the saved counts are identical to the
+    serial ones, key order included.
+
+    In incremental mode, only the files added or changed since the last run are
+    counted, and the counts of changed or deleted files are taken back out, see
+    update_counts. The first run, or a run without a manifest, counts everything. The
+    manifest and the per-file counts it relies on are only kept in incremental mode.
+
+    Parameters:
+    max_order (int): The highest n-gram order to be counted.
+    workers (int): The number of worker processes, 1 counting in this process.
+    incremental (bool): Whether to update the saved counts instead of recounting.
+
+    Returns:
+    list: The change of every n-gram count per order.
+    """
+    update = incremental and os.path.exists(os.path.join(CORPUS_COUNTS_PATH, MANIFEST_FILE))
+    return update_counts(list(iter_corpus_files()), CORPUS_COUNTS_PATH, max_order, workers,
+                         update, track_files=incremental)
+
+def update_counts(file_paths, directory, max_order=MAX_ORDER, workers=1, incremental=True,
+                  track_files=True):
+    """ Brings the n-gram counts saved in a directory up to date with a set of XML files.
+
+    The directory's manifest records the SHA-256 hash of every file counted so far, and
+    the counts of each file are kept under files/, named by its hash. Files whose hash
+    is unchanged are skipped. New and changed files are counted by count_file, in
+    parallel when there are several workers, and their counts added. The saved counts
+    of changed and deleted files are subtracted, and n-grams left with no count are
+    dropped.
+
+    Without a manifest the saved counts, if any, are kept as a base that the listed
+    files are added to, so further files can be counted on top of counts made in one
+    go, such as the training set counts.
+
+    Without track_files no manifest or per-file counts are kept, and any left by an
+    earlier update are removed, as they no longer match the saved counts.
+
+    Parameters:
+    file_paths (list): All the XML files the counts should cover, in order.
+    directory (str): The directory holding the counts and the manifest.
+    max_order (int): The highest n-gram order to be counted.
+    workers (int): The number of worker processes, 1 counting in this process.
+    incremental (bool): Whether to build on the saved counts, False counting from scratch.
+    track_files (bool): Whether to keep the manifest and the per-file counts that later
+    incremental updates rely on.
+
+    Returns:
+    list: The change of every n-gram count per order, the counts themselves when
+    counting from scratch.
+    """
+    manifest = {'max_order': max_order, 'files': {}}
+    if incremental:
+        manifest = load_manifest(directory) or manifest
+        if manifest['max_order'] != max_order:
+            raise ValueError(f"the counts in {directory} were made up to order "
+                             f"{manifest['max_order']}, not {max_order}")
+
+    hashes = {file_path: file_sha256(file_path) for file_path in file_paths}
+    counted = manifest['files']
+    stale = [file_path for file_path in file_paths if counted.get(file_path) != hashes[file_path]]
+    if incremental and not stale and counted.keys() <= hashes.keys():
+        return new_counts(max_order)
+
+    counts = load_counts(directory, max_order) if incremental else None
+    if counts is None:
+        counts = delta = new_counts(max_order)
+    else:
+        counts = [defaultdict(int, n_gram_counts) for n_gram_counts in counts]
+        delta = new_counts(max_order)
+
+    for file_path in counted:
+        if hashes.get(file_path) != counted[file_path]:
+            old_counts = load_file_counts(directory, counted[file_path])
+            merge_counts(delta, [{n_gram: -count for n_gram, count in n_gram_counts.items()}
+                                 for n_gram_counts in old_counts])
+
+    files_directory = os.path.join(directory, 'files') if track_files else None
+    if track_files:
+        os.makedirs(files_directory, exist_ok=True)
+    stale_files = [(file_path, hashes[file_path]) for file_path in stale]
+    if workers > 1 and len(stale) > 1:
+        with Pool(workers, initializer=load_split_cache) as pool:
+            file_counts = pool.imap(partial(count_file, max_order=max_order), stale_files)
+            add_file_counts(files_directory, stale, hashes, file_counts, delta)
+    else:
+        load_split_cache()
+        file_counts = (count_file(file, max_order) for file in stale_files)
+        add_file_counts(files_directory, stale, hashes, file_counts, delta)
+
+    if delta is not counts:
+        merge_counts(counts, delta)
+        for n_gram_counts in counts + delta:
+            for n_gram in [n_gram for n_gram, count in n_gram_counts.items() if count == 0]:
+                del n_gram_counts[n_gram]
+
+    write_counts(counts, directory)
+    if not track_files:
+        if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+            os.remove(os.path.join(directory, MANIFEST_FILE))
+        shutil.rmtree(os.path.join(directory, 'files'), ignore_errors=True)
+        return delta
+
+    counted = {file_path: hashes[file_path] for file_path in file_paths}
+    write_manifest(directory, {'max_order': max_order, 'files': counted})
+    for file_name in os.listdir(files_directory):
+        if file_name[:-len('.json')] not in counted.values():
+            os.remove(os.path.join(files_directory, file_name))
+    return delta
+
+def add_file_counts(files_directory, file_paths, hashes, file_counts, counts):
+    """ Saves the counts of each newly counted file and adds them to a running total.
+
+    Parameters:
+    files_directory (str): The directory of the per-file counts, None to save none.
+    file_paths (list): The counted files, in the order of file_counts.
+    hashes (dict): The hash of every file.
+    file_counts (iterable): The n-gram counts of each file.
+    counts (list): The running n-gram counts per order, updated in place.
 
     Returns:
         None
     """
-    for child in node:
-        if child.tag == 's':
-            handle_sentence(child, number_of_words, counts)
-        else:
-            traverse_tree(child, number_of_words, counts)
+    for file_path, n_gram_counts in zip(file_paths, file_counts):
+        if files_directory is not None:
+            with open(os.path.join(files_directory, f'{hashes[file_path]}.json'),
+                      'w', encoding='utf-8') as fp:
+                json.dump(n_gram_counts, fp)
+        merge_counts(counts, n_gram_counts)
+
+def load_file_counts(directory, file_hash):
+    """ Loads the saved counts of one counted file, given its hash.
+    """
+    with open(os.path.join(directory, 'files', f'{file_hash}.json'), 'r', encoding='utf-8') as fp:
+        return json.load(fp)
+
+def load_manifest(directory):
+    """ Loads the manifest of counted files of a counts directory, or None if there is none.
+    """
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as fp:
+        return json.load(fp)
+
+def write_manifest(directory, manifest):
+    """ Saves the manifest of counted files of a counts directory.
+    """
+    with open(os.path.join(directory, MANIFEST_FILE), 'w', encoding='utf-8') as fp:
+        json.dump(manifest, fp, indent=4)
 
-def handle_sentence(sentence_node, number_of_words, counts):
-    """ Processes each sentence to compute and update n-gram frequencies.
+def file_sha256(file_path, block_size=1 << 20):
+    """ Hashes a file's contents with SHA-256, reading it in blocks.
 
     Parameters:
-    sentence_node (xml.etree.ElementTree.Element): The current sentence node in the XML tree.
-    number_of_words (int): The number of words in the n-grams to be counted.
-    counts (collections.defaultdict): A dictionary to store the n-gram counts.
-    
+    file_path (str): The path of the file.
+    block_size (int): The number of bytes read at a time.
+
+    Returns:
+    str: The hexadecimal digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as fp:
+        for block in iter(partial(fp.read, block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_split_cache():
+    """ Loads the corpus sentence store saved by splitting_datasets into split_cache, with
+    the range of sentences of each split file keyed by the file's hash, in every process
+    counting corpus files. The cache is left empty if there is no split, or if its
+    manifest predates the file hashes.
+
     Returns:
         None
     """
-    text = retrieve_text(sentence_node)
-    if text.strip() != "":
-        text = ("<s> " * number_of_words) + text + (" </s>")
-        words = text.split()
-        for index in range(len(words) - number_of_words + 1):
-            if number_of_words == 1:
-                n_gram = words[index]
-            else:
-                n_gram = " ".join(words[index:index + number_of_words])
-            counts[n_gram] += 1
+    split_cache.clear()
+    if not split_exists():
+        return
+    with open(os.path.join(SPLIT_PATH, 'manifest.json'), 'r', encoding='utf-8') as fp:
+        files = json.load(fp)['files']
+    if not all('sha256' in file for file in files):
+        return
+
+    file_starts = np.cumsum([0] + [file['sentences'] for file in files]).tolist()
+    split_cache['store'] = SentenceStore.load(os.path.join(SPLIT_PATH, 'sentences'))
+    split_cache['ranges'] = {file['sha256']: (start, end) for file, start, end
+                             in zip(files, file_starts[:-1], file_starts[1:])}
+
+def count_file(file, max_order=MAX_ORDER):
+    """ Counts the n-grams of every order up to max_order in one XML file.
+
+    A file unchanged since the corpus was split is counted from its sentences in the
+    split sentence store loaded by load_split_cache, as the same tokens the XML would
+    give, without parsing it again. Other files are tokenized as by count_files.
+
+    Parameters:
+    file (tuple): The path of the XML file and its SHA-256 hash.
+    max_order (int): The highest n-gram order to be counted.
+
+    Returns:
+    list: A defaultdict of n-gram counts per order.
+    """
+    file_path, file_hash = file
+    if file_hash not in split_cache.get('ranges', {}):
+        return count_files([file_path], max_order)
+
+    store = split_cache['store']
+    ids, lengths = gather_sentences(store, np.arange(*split_cache['ranges'][file_hash]))
+    # the n-grams are named from the file's own words, not the whole corpus vocabulary
+    word_ids, ids = np.unique(ids, return_inverse=True)
+    words = [store.vocabulary.words[word_id] for word_id in word_ids.tolist()]
+    return count_id_sentences(ids, lengths, words, max_order)
+
+def count_files(file_paths, max_order=MAX_ORDER):
+    """ Counts the n-grams of every order up to max_order in the given XML files.
+
+    Parameters:
+    file_paths (list): The XML files to be counted, in order.
+    max_order (int): The highest n-gram order to be counted.
+
+    Returns:
+    list: A defaultdict of n-gram counts per order.
+    """
+    store = SentenceStore()
+    for file_path in file_paths:
+        tokenize_file(file_path, store)
+
+    offsets = np.asarray(store.offsets)
+    return count_id_sentences(np.asarray(store.tokens, dtype=np.int64), np.diff(offsets),
+                              store.vocabulary.words, max_order)
+
+def merge_counts(counts, partial_counts):
+    """ Adds partial n-gram counts into a running total, order by order.
+
+    Parameters:
+    counts (list): The running n-gram counts per order, updated in place.
+    partial_counts (list): The n-gram counts per order to be added.
+
+    Returns:
+        None
+    """
+    for n_gram_counts, partial_n_gram_counts in zip(counts, partial_counts):
+        for n_gram, count in partial_n_gram_counts.items():
+            n_gram_counts[n_gram] += count
+
+def generate_training_counts(max_order=MAX_ORDER):
+    """ Counts the n-grams of every order up to max_order in the training set
+    in a single streaming pass over its pre-tokenized sentences, splitting the
+    corpus first if that has not been done yet.
+
+    Parameters:
+    max_order (int): The highest n-gram order to be counted.
+
+    Returns:
+    list: A defaultdict of n-gram counts per order.
+    """
+    if not split_exists():
+        splitting_datasets()
+
+    store, indices = load_split('train')
+    ids, lengths = gather_sentences(store, indices)
+    return count_id_sentences(ids, lengths, store.vocabulary.words, max_order)
+
+def remap_unknown_counts(counts, threshold=2):
+    """ Derives <UNK> counts from already computed n-gram counts.
+
+    Every token whose unigram count is at most threshold is replaced by <UNK> in all
+    n-grams, merging the counts of n-grams that become identical. The n-grams of each
+    order are turned into an array of word ids, and the replacement is one remap table
+    indexed by those arrays, so the counts for any threshold come from the same base
+    counts without counting the training set again.
+
+    Parameters:
+    counts (list): The n-gram counts per order, index 0 holding the unigrams.
+    threshold (int): The highest count for which a token is treated as unknown.
+
+    Returns:
+    list: A defaultdict of remapped n-gram counts per order.
+    """
+    vocabulary = Vocabulary(counts[0])
+    n_gram_ids = [np.array([vocabulary.add(word) for n_gram in n_gram_counts
+                            for word in n_gram.split()], dtype=np.int64).reshape(-1, order)
+                  for order, n_gram_counts in enumerate(counts, start=1)]
+
+    unknown = np.zeros(len(vocabulary), dtype=bool)
+    unknown[:len(counts[0])] = np.fromiter(counts[0].values(), dtype=np.int64,
+                                           count=len(counts[0])) <= threshold
+    remap = np.where(unknown, len(vocabulary), np.arange(len(vocabulary)))
+    names = vocabulary.words + ["<UNK>"]
+    return [count_windows(remap[ids], names,
+                          np.fromiter(n_gram_counts.values(), dtype=np.int64, count=len(ids)))
+            for ids, n_gram_counts in zip(n_gram_ids, counts)]
+
+def update_training_counts(file_paths, max_order=MAX_ORDER, workers=1):
+    """ Adds the n-grams of further training files to the saved training set counts.
+
+    The files are tracked by the training counts' manifest, so only new or changed
+    files are counted on each call, and files left out of file_paths are taken back out.
+    The returned changes can be applied to already loaded models with
+    LanguageModel.apply_count_delta, which refreshes only the affected probabilities.
+
+    Parameters:
+    file_paths (list): Every extra training XML file, beyond the training set.
+    max_order (int): The highest n-gram order to be counted.
+    workers (int): The number of worker processes.
+
+    Returns:
+    list: The change of every n-gram count per order.
+    """
+    get_training_counts(max_order)
+    return update_counts(file_paths, counts_path(TRAINING_COUNTS_PATH, max_order), max_order,
+                         workers)
+
+def get_training_counts(max_order=MAX_ORDER):
+    """ Loads the training set n-gram counts, counting and saving them first
+    if they have not been generated yet.
+
+    Parameters:
+    max_order (int): The highest n-gram order needed.
+
+    Returns:
+    list: The n-gram counts per order.
+    """
+    directory = counts_path(TRAINING_COUNTS_PATH, max_order)
+    counts = load_counts(directory, max_order)
+    if counts is None:
+        counts = generate_training_counts(max_order)
+        write_counts(counts, directory)
+
+    return counts
+
+def load_counts(directory, max_order=MAX_ORDER):
+    """ Loads the {order}_gram_counts.json files of every order up to max_order.
+
+    Parameters:
+    directory (str): The directory holding the JSON files.
+    max_order (int): The highest n-gram order to be loaded.
+
+    Returns:
+    list: The n-gram counts per order, or None if any of the files is missing.
+    """
+    if not counts_exist(directory, max_order):
+        return None
+
+    counts = []
+    for path in counts_files(directory, max_order):
+        with open(path, 'r', encoding='utf-8') as fp:
+            counts.append(json.load(fp))
+    return counts
+
+def counts_files(directory, max_order=MAX_ORDER):
+    """ Returns the paths of the {order}_gram_counts.json files of every order up to max_order.
+    """
+    return [os.path.join(directory, f'{number_of_words}_gram_counts.json')
+            for number_of_words in range(1, max_order + 1)]
+
+def counts_exist(directory, max_order=MAX_ORDER):
+    """ Returns whether the counts of every order up to max_order are saved in a directory.
+    """
+    return all(os.path.exists(path) for path in counts_files(directory, max_order))
 
-def handle_sentence_unk(sentence_node, number_of_words, counts, unknown_tokens):
-    """ Processes each sentence to compute and update n-gram frequencies.
+def write_counts(counts, directory):
+    """ Saves each order's counts to {order}_gram_counts.json in the given directory,
+    creating it if needed.
 
     Parameters:
-    sentence_node (xml.etree.ElementTree.Element): The current sentence node in the XML tree.
-    number_of_words (int): The number of words in the n-grams to be counted.
-    counts (collections.defaultdict): A dictionary to store the n-gram counts.
-    
+    counts (list): The n-gram counts per order.
+    directory (str): The directory to write the JSON files to.
+
     Returns:
         None
     """
-    text = retrieve_text(sentence_node)
-    if text.strip() != "":
-        text = ("<s> " * number_of_words) + text + (" </s>")
-        words = text.split()
-        for index in range(len(words) - number_of_words + 1):
-            if words[index] in unknown_tokens:
-                words[index] = "<UNK>"
-            if number_of_words == 1:
-                n_gram = words[index]
-            else:
-                n_gram = " ".join(words[index:index + number_of_words])
-            counts[n_gram] += 1
+    os.makedirs(directory, exist_ok=True)
+    for number_of_words, n_gram_counts in enumerate(counts, start=1):
+        with open(os.path.join(directory, f'{number_of_words}_gram_counts.json'),
+                  'w', encoding='utf-8') as fp:
+            json.dump(n_gram_counts, fp, indent=4)
+
+def iter_corpus_files():
+    """ Yields the path of every XML file in the corpus directories.
+
+    Returns:
+    generator: The corpus file paths, directory by directory.
+    """
+    for directory in directories:
+        dir_path = os.path.join(BASE_PATH, directory)
+        for file in os.listdir(dir_path):
+            if file.endswith('.xml'):
+                yield os.path.join(dir_path, file)
+
+def iter_sentence_nodes(file_path):
+    """ Incrementally parses an XML file and yields its sentence nodes.
+
+    Every element outside a sentence is detached from its parent as soon as it
+    is closed, and each sentence once it has been consumed, so only the path to
+    the current sentence is kept in memory however large the file is.
+
+    Parameters:
+    file_path (str): The path of the XML file.
+
+    Returns:
+    generator: The <s> elements of the file, in document order.
+    """
+    parents = []
+    open_sentences = 0
+    for event, element in ET.iterparse(file_path, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            if element.tag == 's':
+                open_sentences += 1
+            continue
+
+        parents.pop()
+        if element.tag == 's':
+            open_sentences -= 1
+            yield element
+        if parents and open_sentences == 0:
+            parents[-1].remove(element)
 
 def retrieve_text(node):
     """ Extracts and concatenates text from XML nodes, adding start and end 
@@ -123,106 +508,274 @@ def retrieve_text(node):
                     text += retrieve_text(grandchild)
     return text
 
-def splitting_datasets():
-    train_file_path = '../data/training_set.xml'
-    test_file_path = '../data/test_set.xml'
-    # Splitting the corpus into train, validation, and test sets if not already created
-    train = []
-    test = []
+def count_id_sentences(ids, lengths, words, max_order=MAX_ORDER):
+    """ Counts the n-grams of every order up to max_order in sentences given as word ids.
 
-    for directory in directories:
-        dir_path = os.path.join(BASE_PATH, directory)
-        for file in os.listdir(dir_path):
-            if file.endswith('.xml'):
-                file_path = os.path.join(dir_path, file)
-                tree = ET.parse(file_path)
-                root = tree.getroot()
-                sentences = list(root.findall('.//s'))
-                split_and_append_elements(sentences, train, test)
+    Each order n pads every sentence with n start markers and one end marker, as the
+    models score it, and empty sentences are skipped. Every order is counted with
+    one vectorized pass: the padded sentences are laid out in one flat array, each
+    n-gram window is packed into a single integer key and the keys are counted with
+    np.unique. Words are only looked up to name the distinct n-grams at the end.
 
-    if os.path.exists(train_file_path):
-        os.remove(train_file_path)
-    if os.path.exists(test_file_path):
-        os.remove(test_file_path)
-    write_xml_from_elements(train, train_file_path)
-    write_xml_from_elements(test, test_file_path)
+    Parameters:
+    ids (numpy.ndarray): The word ids of every sentence, one after the other.
+    lengths (numpy.ndarray): The number of words of each sentence.
+    words (list): The word of each id.
+    max_order (int): The highest n-gram order to be counted.
 
-def split_and_append_elements(s_elements, training_set, test_set):
+    Returns:
+    list: A defaultdict of n-gram counts per order, keyed by space separated n-grams
+    in the order they first occur.
     """
-    Splits the given list of elements into train, test, and test sets,
-    and appends them to the respective global lists.
+    lengths = lengths[lengths > 0]
+    names = list(words) + ["<s>", "</s>"]
+    start_id, end_id = len(words), len(words) + 1
+    token_starts = np.cumsum(lengths) - lengths
+
+    counts = []
+    for order in range(1, max_order + 1):
+        padded_lengths = lengths + order + 1
+        sentence_starts = np.cumsum(padded_lengths) - padded_lengths
+        padded = np.full(int(padded_lengths.sum()), start_id, dtype=np.int64)
+        padded[sentence_starts + padded_lengths - 1] = end_id
+        padded[np.arange(len(ids)) + np.repeat(sentence_starts + order - token_starts,
+                                               lengths)] = ids
+
+        windows = lengths + 2
+        window_starts = (np.arange(int(windows.sum()))
+                         + np.repeat(sentence_starts - (np.cumsum(windows) - windows), windows))
+        columns = np.stack([padded[window_starts + offset] for offset in range(order)], axis=1)
+        counts.append(count_windows(columns, names))
+
+    return counts
+
+def count_windows(columns, names, weights=None):
+    """ Counts the distinct rows of an array of n-gram windows.
 
-    Args:
-        s_elements (list): The list of elements to be split.
-        training_set (list): The list to append the training set elements to.
-        test_set (list): The list to append the test set elements to.
-        test_set (list): The list to append the test set elements to.
+    Parameters:
+    columns (numpy.ndarray): A (number of windows, n) array of word ids.
+    names (list): The word of each id.
+    weights (numpy.ndarray): The count each window adds, 1 for all when None.
+
+    Returns:
+    defaultdict: The count of each n-gram, keyed by its space separated words in the
+    order the n-grams first occur.
+    """
+    order = columns.shape[1]
+    if len(names) ** order < 2 ** 63:
+        keys = np.zeros(len(columns), dtype=np.int64)
+        for column in range(order):
+            keys = keys * len(names) + columns[:, column]
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    else:
+        _, first, inverse = np.unique(columns, axis=0, return_index=True, return_inverse=True)
+
+    frequencies = np.zeros(len(first), dtype=np.int64)
+    np.add.at(frequencies, inverse.ravel(), 1 if weights is None else weights)
+
+    by_occurrence = np.argsort(first, kind='stable')
+    n_grams = columns[first[by_occurrence]].tolist()
+    return defaultdict(int, zip((" ".join(names[word_id] for word_id in n_gram)
+                                 for n_gram in n_grams),
+                                frequencies[by_occurrence].tolist()))
+
+def tokenize_file(file_path, store):
+    """ Adds the sentences of an XML file, tokenized by retrieve_text, to a sentence store.
+
+    Parameters:
+    file_path (str): The path of the XML file.
+    store (SentenceStore or SentenceStoreWriter): The store being built.
+
+    Returns:
+    int: The number of sentences added, empty ones included.
+    """
+    start = len(store)
+    for sentence_node in iter_sentence_nodes(file_path):
+        store.add(retrieve_text(sentence_node).split())
+    return len(store) - start
+
+def gather_sentences(store, indices):
+    """ Collects the word ids of some sentences of a store into one flat array.
+
+    Parameters:
+    store (SentenceStore): The sentence store.
+    indices (numpy.ndarray): The indices of the sentences, in the order wanted.
+
+    Returns:
+    tuple: The int64 word ids of the sentences, one after the other, and the number
+    of words of each sentence.
+    """
+    offsets = np.asarray(store.offsets)
+    indices = np.asarray(indices, dtype=np.int64)
+    starts = offsets[indices]
+    lengths = offsets[indices + 1] - starts
+    positions = (np.arange(int(lengths.sum()))
+                 + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths))
+    return np.asarray(store.tokens)[positions].astype(np.int64), lengths
+
+def map_sentences(ids, lengths, mapping):
+    """ Maps sentences given as store word ids to a model's ids, with a table made by
+    LanguageModel.vocabulary_map, dropping the words that have no token.
+
+    Returns:
+    tuple: The mapped ids and the new number of words of each sentence.
+    """
+    mapped = mapping[ids]
+    dropped = mapped == -2
+    if dropped.any():
+        sentence_ids = np.repeat(np.arange(len(lengths)), lengths)
+        lengths = lengths - np.bincount(sentence_ids[dropped], minlength=len(lengths))
+        mapped = mapped[~dropped]
+    return mapped, lengths
+
+def splitting_datasets():
+    """ Splits the sentences of every corpus file 80/20 into the training and test sets.
+
+    Each file is parsed once, its sentences tokenized into the corpus sentence store
+    as they stream past, and their split drawn per file. The split is saved as a
+    manifest of the corpus files with their sentence counts and hashes, and of the
+    (file, sentence offset) id of every training and test sentence, so training and
+    evaluation read their sentences from the store without parsing any XML again. The
+    store and the ids are written to disk file by file, so memory does not grow with
+    the size of the corpus beyond its vocabulary.
 
     Returns:
         None
     """
-    total_elements = len(s_elements)
-    train_size = int(total_elements * 0.8)
+    store = SentenceStoreWriter(os.path.join(SPLIT_PATH, 'sentences'))
+    files = []
+    split_ids = {name: ArrayWriter(os.path.join(SPLIT_PATH, f'{name}_ids.npy'), np.int32,
+                                   columns=2)
+                 for name in ('train', 'test')}
+    for file_index, file_path in enumerate(iter_corpus_files()):
+        total_elements = tokenize_file(file_path, store)
+        in_training = np.zeros(total_elements, dtype=bool)
+        in_training[list(split_sentence_ids(total_elements))] = True
+        for name, offsets in (('train', np.flatnonzero(in_training)),
+                              ('test', np.flatnonzero(~in_training))):
+            split_ids[name].append(np.column_stack((np.full(len(offsets), file_index), offsets)))
+        files.append({'path': file_path, 'sentences': total_elements,
+                      'sha256': file_sha256(file_path)})
+
+    store.close()
+    for ids in split_ids.values():
+        ids.close()
+    with open(os.path.join(SPLIT_PATH, 'manifest.json'), 'w', encoding='utf-8') as fp:
+        json.dump({'files': files}, fp, indent=4)
+
+def split_exists():
+    """ Returns whether the corpus has been split and its sentence store saved.
+    """
+    return (SentenceStore.exists(os.path.join(SPLIT_PATH, 'sentences'))
+            and all(os.path.exists(os.path.join(SPLIT_PATH, name))
+                    for name in ('manifest.json', 'train_ids.npy', 'test_ids.npy')))
 
-    random.shuffle(s_elements)
-    train_elements = s_elements[:train_size]
-    test_elements = s_elements[train_size:]
+def load_split(name):
+    """ Loads the corpus sentence store and the sentences of one side of the split.
 
-    training_set.extend(train_elements)
-    test_set.extend(test_elements)
+    Parameters:
+    name (str): 'train' or 'test'.
 
-def write_xml_from_elements(elements, path):
+    Returns:
+    tuple: The memory-mapped SentenceStore and the store index of each of the split's
+    sentences, in corpus order.
     """
-    Write XML file from a list of elements.
+    with open(os.path.join(SPLIT_PATH, 'manifest.json'), 'r', encoding='utf-8') as fp:
+        manifest = json.load(fp)
+    file_starts = np.cumsum([0] + [file['sentences'] for file in manifest['files']])
+    ids = np.load(os.path.join(SPLIT_PATH, f'{name}_ids.npy'))
+    return (SentenceStore.load(os.path.join(SPLIT_PATH, 'sentences')),
+            file_starts[ids[:, 0]] + ids[:, 1])
+
+def iter_split_sentences(name):
+    """ Streams the tokenized sentences of one side of the split, in corpus order.
+
+    Parameters:
+    name (str): 'train' or 'test'.
+
+    Returns:
+    generator: The words of each sentence, empty sentences included.
+    """
+    store, indices = load_split(name)
+    return store.iter_words(indices.tolist())
+
+def split_texts(name):
+    """ Returns the sentences of one side of the split as strings, as retrieve_text
+    gives them up to whitespace, for scoring with the language models.
+    """
+    return [" ".join(words) for words in iter_split_sentences(name)]
+
+def split_sentence_ids(total_elements):
+    """
+    Randomly selects 80% of a file's sentence positions for the training set.
 
     Args:
-        elements (list): List of XML elements to be included in the XML file.
-        path (str): Path to the output XML file.
+        total_elements (int): The number of sentences in the file.
 
     Returns:
-        None
+        set: The positions of the sentences that go to the training set, the
+        remaining positions going to the test set.
     """
-    root = ET.Element('root')
-    root.extend(elements)
-    tree = ET.ElementTree(root)
-    tree.write(path)
+    train_size = int(total_elements * 0.8)
+
+    sentence_ids = list(range(total_elements))
+    random.shuffle(sentence_ids)
+    return set(sentence_ids[:train_size])
 
 
 def model_perplexity(model, sentences):
-    total_uni_pp = 0
-    total_bi_pp = 0
-    total_tri_pp = 0
-    total_lin_pp = 0
+    """ Calculates the average per-sentence perplexity of a model under the unigram,
+    bigram, trigram and linear interpolation scores.
 
-    for sentence in sentences:
-        if len(sentence.split()) == 0:
-            continue
-        uni_prob = model.uni_sentence_probability(sentence)
-        bi_prob = model.bi_sentence_probability(sentence)
-        tri_prob = model.tri_sentence_probability(sentence)
-        lin_prob = model.sentence_probability(sentence)
+    Parameters:
+    model (LanguageModel): The model to be evaluated.
+    sentences (list): The sentences to be scored.
+
+    Returns:
+    tuple: The average unigram, bigram, trigram and linear interpolation perplexities.
+    """
+    average_uni_pp, average_bi_pp, average_tri_pp, average_lin_pp = (
+        perplexity_sums(model, sentences) / len(sentences))
 
-        if uni_prob == 0 or bi_prob == 0 or tri_prob == 0 or lin_prob == 0:
-            uni_prob = model.uni_sentence_probability(sentence)
-            bi_prob = model.bi_sentence_probability(sentence)
-            tri_prob = model.tri_sentence_probability(sentence)
-            lin_prob = model.sentence_probability(sentence)
+    return (average_uni_pp, average_bi_pp, average_tri_pp, average_lin_pp)
 
-        uni_pp = np.power(np.divide(1, uni_prob), (1 / len(sentence.split())))
-        total_uni_pp += uni_pp
+def perplexity_sums(model, sentences):
+    """ Sums the per-sentence unigram, bigram, trigram and linear interpolation
+    perplexities of a model over a list of sentences.
 
-        bi_pp = np.power(np.divide(1, bi_prob), (1 / len(sentence.split())))
-        total_bi_pp += bi_pp
+    The whole list is scored with one batch call, and each sentence's perplexity is
+    computed from its summed log probability, as exp(-log probability / number of
+    scored words), so long sentences neither underflow nor need rescoring. Sentences
+    without any words are skipped.
 
-        tri_pp = np.power(np.divide(1, tri_prob), (1 / len(sentence.split())))
-        total_tri_pp += tri_pp
+    Parameters:
+    model (LanguageModel): The model to be evaluated.
+    sentences (list): The sentences to be scored.
 
-        lin_pp = np.power(np.divide(1, lin_prob), (1 / len(sentence.split())))
-        total_lin_pp += lin_pp
+    Returns:
+    numpy.ndarray: The four perplexity sums.
+    """
+    log_probabilities, lengths = model.batch_log_probabilities(sentences)
+    return sum_perplexities(log_probabilities, lengths)
 
-    average_uni_pp = total_uni_pp / len(sentences)
-    average_bi_pp = total_bi_pp / len(sentences)
-    average_tri_pp = total_tri_pp / len(sentences)
-    average_lin_pp = total_lin_pp / len(sentences)
+def store_perplexity_sums(model, store, indices, mapping):
+    """ Sums the per-sentence perplexities of a model over sentences of a sentence
+    store, as perplexity_sums does, scoring their word ids without building strings.
 
-    return (average_uni_pp, average_bi_pp, average_tri_pp, average_lin_pp)
+    Parameters:
+    model (LanguageModel): The model to be evaluated.
+    store (SentenceStore): The sentence store.
+    indices (numpy.ndarray): The indices of the sentences to be scored.
+    mapping (numpy.ndarray): The model id of each store word, from vocabulary_map.
+
+    Returns:
+    numpy.ndarray: The four perplexity sums.
+    """
+    ids, lengths = map_sentences(*gather_sentences(store, indices), mapping)
+    return sum_perplexities(model.batch_log_probabilities_from_ids(ids, lengths), lengths)
+
+def sum_perplexities(log_probabilities, lengths):
+    """ Sums exp(-log probability / length) over the sentences that have any words.
+    """
+    scored = lengths > 0
+    return np.exp(-log_probabilities[:, scored] / lengths[scored]).sum(axis=1)
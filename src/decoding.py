@@ -0,0 +1,393 @@
+"""
+Implements the decoders completing phrases with a language model: ancestral sampling,
+greedy search, beam search, and top-k and nucleus (top-p) sampling, and bulk generation
+in parallel worker processes.
+"""
+import time
+from multiprocessing import Pool
+import numpy as np
+
+MODES = ('sample', 'greedy', 'beam', 'top_k', 'top_p')
+CHOICES = ('1', '2', '3', '4')
+
+worker_generation = {}
+
+def _group_ranks(groups):
+    """
+    Returns the position of every element within its run of equal, sorted group numbers.
+    """
+    starts = np.flatnonzero(np.diff(groups, prepend=-1))
+    lengths = np.diff(np.append(starts, len(groups)))
+    return np.arange(len(groups)) - np.repeat(starts, lengths)
+
+class Decoder:
+    """
+    Completes many phrases at once with a language model's successor distributions.
+
+    Every step extends all the unfinished phrases of a batch together: their successor
+    distributions come from one LanguageModel.batch_successors call, flattened and grouped
+    by phrase, and the next words are chosen with vectorized operations over the groups.
+    Sampling draws from the decoder's own seeded numpy Generator, so a decoder created
+    with the same seed completes the same phrases the same way.
+
+    The modes are:
+        sample: draws each word from the whole successor distribution.
+        greedy: picks the most probable successor.
+        beam: keeps the beam_width most probable completions of each phrase and returns
+            the most probable one, their log probabilities divided by their length to the
+            power length_penalty, so short completions are not favoured.
+        top_k: draws from the top_k most probable successors.
+        top_p: draws from the fewest most probable successors holding at least top_p of
+            the probability mass.
+
+    Attributes:
+        model (LanguageModel): The model completing the phrases.
+        choice (str): '1' unigram, '2' bigram, '3' trigram or '4' linear interpolation.
+        mode (str): The decoding mode, one of MODES.
+        beam_width (int): The completions kept per phrase by beam search.
+        top_k (int): The successors top-k sampling draws from.
+        top_p (float): The probability mass nucleus sampling draws from.
+        max_words (int): The most words generated per phrase.
+        batch_size (int): The most phrases decoded together.
+        rng (numpy.random.Generator): The random generator sampling draws from.
+        length_penalty (float): The exponent of the length beam search normalises scores by.
+        min_words (int): The fewest words generated per phrase before the sentence end
+            marker may be chosen.
+    """
+    def __init__(self, model, choice='4', mode='sample', beam_width=4, top_k=10, top_p=0.9,
+                 max_words=100, batch_size=256, seed=None, length_penalty=1.0, min_words=0):
+        """
+        Initializes the decoder.
+
+        Args:
+            model (LanguageModel): The model completing the phrases.
+            choice (str): '1' unigram, '2' bigram, '3' trigram or '4' linear interpolation.
+            mode (str): 'sample', 'greedy', 'beam', 'top_k' or 'top_p'.
+            beam_width (int): The completions kept per phrase by beam search.
+            top_k (int): The successors top-k sampling draws from.
+            top_p (float): The probability mass nucleus sampling draws from, in (0, 1].
+            max_words (int): The most words generated per phrase.
+            batch_size (int): The most phrases decoded together.
+            seed (int): The seed of the random generator, None for a fresh one.
+            length_penalty (float): The exponent of the length beam search normalises the
+                log probability of a completion by, 0 ranking by log probability alone.
+            min_words (int): The fewest words generated per phrase before the sentence end
+                marker may be chosen.
+        """
+        if choice not in CHOICES:
+            raise ValueError(f"unknown n-gram choice {choice!r}, expected one of {CHOICES}")
+        if mode not in MODES:
+            raise ValueError(f"unknown decoding mode {mode!r}, expected one of {MODES}")
+        if beam_width < 1 or top_k < 1 or not 0 < top_p <= 1:
+            raise ValueError("beam_width and top_k must be at least 1 and top_p in (0, 1], "
+                             f"got {beam_width}, {top_k} and {top_p}")
+        if length_penalty < 0 or min_words < 0:
+            raise ValueError("length_penalty and min_words cannot be negative, "
+                             f"got {length_penalty} and {min_words}")
+        self.model = model
+        self.choice = choice
+        self.mode = mode
+        self.beam_width = beam_width
+        self.top_k = top_k
+        self.top_p = top_p
+        self.max_words = max_words
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self.length_penalty = length_penalty
+        self.min_words = min_words
+
+    def decoding_arguments(self):
+        """
+        Returns the keyword arguments that rebuild an equivalent decoder for the same
+        model, without its seed, for example in a worker process.
+        """
+        return {'choice': self.choice, 'mode': self.mode, 'beam_width': self.beam_width,
+                'top_k': self.top_k, 'top_p': self.top_p, 'max_words': self.max_words,
+                'batch_size': self.batch_size, 'length_penalty': self.length_penalty,
+                'min_words': self.min_words}
+
+    def generate(self, phrases):
+        """
+        Completes phrases, each until the sentence end marker, max_words generated words or
+        a context without successors. An empty phrase is completed from the sentence start.
+
+        Args:
+            phrases (list): The phrases to be completed, as strings or lists of words.
+
+        Returns:
+            list: The words of each completed sentence, between start and end markers.
+        """
+        words = self.model.store.vocabulary.words
+        context_length = self.model.max_order - 1
+        completions = []
+        for start in range(0, len(phrases), self.batch_size):
+            batch = [phrase if isinstance(phrase, list) else self.model._tokenize(phrase)
+                     for phrase in phrases[start:start + self.batch_size]]
+            contexts = np.array([self.model._to_ids((["<s>"] * context_length
+                                                     + phrase)[-context_length:])
+                                 for phrase in batch], dtype=np.int64).reshape(-1, context_length)
+
+            decode = self._beam_search if self.mode == 'beam' else self._sample
+            for phrase, generated in zip(batch, decode(contexts)):
+                sentence = ["<s>"] + phrase + [words[word_id] for word_id in generated]
+                if sentence[-1] != "</s>":
+                    sentence.append("</s>")
+                completions.append(sentence)
+        return completions
+
+    def _sample(self, contexts):
+        """
+        Extends all the phrases one word at a time, choosing every word as the mode does.
+
+        Args:
+            contexts (numpy.ndarray): The ids of the last max_order - 1 words of each phrase.
+
+        Returns:
+            list: The ids of the words generated for each phrase.
+        """
+        end_id = self.model.store.vocabulary.get_id("</s>")
+        generated = [[] for _ in contexts]
+        active = np.arange(len(contexts))
+        for _ in range(self.max_words):
+            if len(active) == 0:
+                break
+
+            successors = self.model.batch_successors(contexts[active], self.choice)
+            lengths = np.array([len(generated[phrase]) for phrase in active.tolist()])
+            extended, word_ids = self._draw(*self._truncate(*self._hold_end(*successors,
+                                                                            lengths)))
+            extended = active[extended]
+            for phrase, word_id in zip(extended.tolist(), word_ids.tolist()):
+                generated[phrase].append(word_id)
+            contexts[extended] = np.column_stack((contexts[extended, 1:], word_ids))
+            active = extended[word_ids != end_id]
+        return generated
+
+    def _hold_end(self, contexts, word_ids, probabilities, lengths):
+        """
+        Drops the sentence end marker from the successors of the contexts whose phrase has
+        fewer than min_words generated words, renormalising their distributions.
+
+        Args:
+            contexts (numpy.ndarray): The context of every successor, grouped by context.
+            word_ids (numpy.ndarray): The word id of every successor.
+            probabilities (numpy.ndarray): The probability of every successor.
+            lengths (numpy.ndarray): The number of words generated for each context.
+
+        Returns:
+            tuple: The context, word id and probability of the successors kept.
+        """
+        if self.min_words == 0:
+            return contexts, word_ids, probabilities
+
+        end_id = self.model.store.vocabulary.get_id("</s>")
+        kept = (word_ids != end_id) | (lengths[contexts] >= self.min_words)
+        contexts, word_ids, probabilities = contexts[kept], word_ids[kept], probabilities[kept]
+        totals = np.bincount(contexts, weights=probabilities)
+        return contexts, word_ids, probabilities / totals[contexts]
+
+    def _truncate(self, contexts, word_ids, probabilities):
+        """
+        Keeps the successors the mode draws from, renormalised: all of them when sampling,
+        the most probable one for greedy search, the top_k most probable ones, or the
+        fewest most probable ones holding top_p of the mass.
+
+        Args:
+            contexts (numpy.ndarray): The context of every successor, grouped by context.
+            word_ids (numpy.ndarray): The word id of every successor.
+            probabilities (numpy.ndarray): The probability of every successor.
+
+        Returns:
+            tuple: The context, word id and probability of the successors kept.
+        """
+        if self.mode == 'sample':
+            return contexts, word_ids, probabilities
+
+        order = np.lexsort((-probabilities, contexts))
+        contexts, word_ids, probabilities = contexts[order], word_ids[order], probabilities[order]
+        ranks = _group_ranks(contexts)
+        if self.mode == 'greedy':
+            kept = ranks == 0
+        elif self.mode == 'top_k':
+            kept = ranks < self.top_k
+        else:
+            starts = np.flatnonzero(ranks == 0)
+            mass_before = np.cumsum(probabilities) - probabilities
+            mass_before -= np.repeat(mass_before[starts], np.diff(np.append(starts, len(ranks))))
+            kept = mass_before < self.top_p
+
+        contexts, word_ids, probabilities = contexts[kept], word_ids[kept], probabilities[kept]
+        totals = np.bincount(contexts, weights=probabilities)
+        return contexts, word_ids, probabilities / totals[contexts]
+
+    def _draw(self, contexts, word_ids, probabilities):
+        """
+        Draws one successor per context, with one binary search over the cumulative
+        probabilities of all the contexts.
+
+        Returns:
+            tuple: The contexts that have successors and the word id drawn for each.
+        """
+        firsts = np.flatnonzero(np.diff(contexts, prepend=-1))
+        if self.mode == 'greedy':
+            return contexts[firsts], word_ids[firsts]
+
+        lasts = np.append(firsts, len(contexts))[1:] - 1
+        cumulative = np.cumsum(probabilities)
+        mass_before = cumulative[firsts] - probabilities[firsts]
+        targets = mass_before + self.rng.random(len(firsts)) * (cumulative[lasts] - mass_before)
+        picks = np.minimum(np.searchsorted(cumulative, targets, side='right'), lasts)
+        return contexts[firsts], word_ids[picks]
+
+    def _beam_search(self, contexts):
+        """
+        Keeps the beam_width most probable completions of each phrase, extending them all
+        together, and returns the most probable completion of each phrase.
+
+        Completions are ranked by their log probability under the model divided by their
+        number of generated words to the power length_penalty, as every word can only
+        lower the log probability. A completion is finished by the sentence end marker or
+        a context without successors, and finished completions stay in the beam, competing
+        with the ones still growing.
+
+        Args:
+            contexts (numpy.ndarray): The ids of the last max_order - 1 words of each phrase.
+
+        Returns:
+            list: The ids of the words generated for each phrase.
+        """
+        end_id = self.model.store.vocabulary.get_id("</s>")
+        phrases = np.arange(len(contexts))
+        scores = np.zeros(len(contexts))
+        lengths = np.zeros(len(contexts), dtype=np.int64)
+        finished = np.zeros(len(contexts), dtype=bool)
+        generated = [[] for _ in contexts]
+        for _ in range(self.max_words):
+            growing = np.flatnonzero(~finished)
+            if len(growing) == 0:
+                break
+
+            successors = self.model.batch_successors(contexts[growing], self.choice)
+            extended, word_ids, probabilities = self._hold_end(*successors, lengths[growing])
+            finished[np.setdiff1d(growing, growing[extended])] = True
+
+            done = np.flatnonzero(finished)
+            parents = np.concatenate((done, growing[extended]))
+            word_ids = np.concatenate((np.full(len(done), -1), word_ids))
+            candidate_scores = np.concatenate((scores[done],
+                                               scores[growing[extended]] + np.log(probabilities)))
+            candidate_lengths = lengths[parents] + (word_ids >= 0)
+            order = np.lexsort((-self._normalised(candidate_scores, candidate_lengths),
+                                phrases[parents]))
+            kept = order[_group_ranks(phrases[parents][order]) < self.beam_width]
+
+            parents, word_ids = parents[kept], word_ids[kept]
+            phrases, scores = phrases[parents], candidate_scores[kept]
+            lengths = candidate_lengths[kept]
+            contexts, finished = contexts[parents], finished[parents] | (word_ids == end_id)
+            grown = word_ids >= 0
+            contexts[grown] = np.column_stack((contexts[grown, 1:], word_ids[grown]))
+            generated = [generated[parent] + [word_id] if word_id >= 0 else generated[parent]
+                         for parent, word_id in zip(parents.tolist(), word_ids.tolist())]
+
+        order = np.lexsort((-self._normalised(scores, lengths), phrases))
+        return [generated[best] for best in order[_group_ranks(phrases[order]) == 0]]
+
+    def _normalised(self, scores, lengths):
+        """
+        Divides the log probabilities of completions by their length to the power
+        length_penalty, a completion with no words keeping its score.
+        """
+        return scores / np.maximum(lengths, 1) ** self.length_penalty
+
+def generate_bulk(decoder, prompts, per_prompt=1, workers=1, shard_size=1000, pool=None):
+    """ Generates many sentences for a list of prompts and returns them, decoding shards of
+    the sentences in parallel worker processes.
+
+    Every worker opens the model once from its memory-mapped model file, so the workers
+    share its pages, and rebuilds the decoder from its decoding_arguments. Each shard is
+    decoded with its own seed, drawn from the decoder's random generator, so the sentences
+    of a seeded decoder do not depend on the number of workers. Callers generating in
+    several calls can open the workers once with generation_pool and pass them in.
+
+    Parameters:
+    decoder (Decoder): The decoder whose model, n-gram choice and settings are used.
+    prompts (list): The phrases to be completed.
+    per_prompt (int): The number of sentences generated for each prompt.
+    workers (int): The number of worker processes, 1 generating in this process.
+    shard_size (int): The number of sentences generated per task.
+    pool (multiprocessing.pool.Pool): Workers opened by generation_pool for the same
+    decoder, used instead of opening workers number of them.
+
+    Returns:
+    tuple: The words of every sentence, between start and end markers, the sentences of
+    each prompt following each other in the order of the prompts, and the statistics of
+    the run: the number of sentences, the seconds taken, the sentences per second and
+    the average number of words of a sentence.
+    """
+    start_time = time.perf_counter()
+    phrases = [prompt for prompt in prompts for _ in range(per_prompt)]
+    starts = range(0, len(phrases), shard_size)
+    seeds = decoder.rng.integers(2 ** 63, size=len(starts)).tolist()
+    tasks = [(phrases[start:start + shard_size], seed) for start, seed in zip(starts, seeds)]
+
+    if pool is not None:
+        results = pool.map(generate_shard, tasks)
+    elif workers > 1:
+        with generation_pool(decoder, workers) as pool:
+            results = pool.map(generate_shard, tasks)
+    else:
+        results = [Decoder(decoder.model, seed=seed, **decoder.decoding_arguments()
+                           ).generate(shard) for shard, seed in tasks]
+
+    sentences = [words for shard_sentences in results for words in shard_sentences]
+    elapsed = time.perf_counter() - start_time
+    statistics = {
+        'sentences': len(sentences),
+        'seconds': elapsed,
+        'sentences_per_second': len(sentences) / max(elapsed, 1e-9),
+        'average_length': (sum(len(words) - 2 for words in sentences) / len(sentences)
+                           if sentences else 0.0),
+    }
+    return sentences, statistics
+
+def generation_pool(decoder, workers):
+    """ Opens worker processes generating with a decoder's model and settings.
+
+    Parameters:
+    decoder (Decoder): The decoder whose model, n-gram choice and settings are used.
+    workers (int): The number of worker processes.
+
+    Returns:
+    multiprocessing.pool.Pool: The workers, to be passed to generate_bulk and terminated
+    by the caller, for example by using the pool as a context manager.
+    """
+    return Pool(workers, initializer=load_generation_worker,
+                initargs=(decoder.model.__class__, decoder.model.model_arguments(),
+                          decoder.decoding_arguments()))
+
+def load_generation_worker(model_class, model_arguments, decoding_arguments):
+    """ Pool initializer loading the model and the decoder settings of a worker process.
+
+    Parameters:
+    model_class (type): The class of the language model.
+    model_arguments (dict): The model's model_arguments.
+    decoding_arguments (dict): The decoder's decoding_arguments.
+
+    Returns:
+        None
+    """
+    worker_generation.update(model=model_class(**model_arguments), arguments=decoding_arguments)
+
+def generate_shard(task):
+    """ Completes one shard of phrases with a decoder seeded for the shard.
+
+    Parameters:
+    task (tuple): The phrases of the shard and its seed.
+
+    Returns:
+    list: The words of each completed sentence.
+    """
+    phrases, seed = task
+    return Decoder(worker_generation['model'], seed=seed,
+                   **worker_generation['arguments']).generate(phrases)
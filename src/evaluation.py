@@ -0,0 +1,168 @@
+"""
+Implements parallel perplexity evaluation of the language models, and the tuning of
+their linear interpolation weights on held-out sentences.
+"""
+import sys
+import time
+from multiprocessing import Pool
+import numpy as np
+from dataset_functions import (load_split, store_perplexity_sums, gather_sentences,
+                               map_sentences)
+
+worker_models = {}
+worker_split = {}
+
+def evaluate_perplexities(models, split='test', workers=1, shard_size=2000):
+    """ Calculates the average per-sentence perplexities of several models over one side
+    of the train/test split, scoring shards of its sentences in parallel worker processes.
+
+    The sentences are read as word ids from the memory-mapped sentence store, and each
+    model maps the store's vocabulary to its own ids once, so no sentence is turned back
+    into a string. Every worker opens each model once from its memory-mapped model file
+    and the sentence store from disk, so only the shard boundaries travel with a task,
+    and the partial perplexity sums are merged in task order, so the result does not
+    depend on the number of workers. The throughput is reported on stderr.
+
+    Parameters:
+    models (list): The trained language models to be evaluated.
+    split (str): 'test' or 'train'.
+    workers (int): The number of worker processes, 1 scoring in this process.
+    shard_size (int): The number of sentences scored per task.
+
+    Returns:
+    dict: The unigram, bigram, trigram and linear interpolation perplexities of each
+    model, keyed by the model's class name.
+    """
+    start_time = time.perf_counter()
+    store, indices = load_split(split)
+    names = [model.__class__.__name__ for model in models]
+    tasks = [(name, start, start + shard_size)
+             for name in names for start in range(0, len(indices), shard_size)]
+
+    if workers > 1:
+        with Pool(workers, initializer=load_worker,
+                  initargs=([(model.__class__, model.model_arguments()) for model in models],
+                            split)) as pool:
+            results = pool.map(score_shard, tasks)
+    else:
+        models_by_name = dict(zip(names, models))
+        mappings = {name: model.vocabulary_map(store.vocabulary.words)
+                    for name, model in models_by_name.items()}
+        results = [store_perplexity_sums(models_by_name[name], store, indices[start:end],
+                                         mappings[name])
+                   for name, start, end in tasks]
+
+    totals = {name: np.zeros(4) for name in names}
+    for (name, _, _), shard_sums in zip(tasks, results):
+        totals[name] += shard_sums
+
+    elapsed = time.perf_counter() - start_time
+    scored = len(indices) * len(models)
+    print(f"Scored {scored} sentences in {elapsed:.2f}s "
+          f"({scored / max(elapsed, 1e-9):.0f} sentences/s)", file=sys.stderr)
+
+    return {name: (total / len(indices)).tolist() for name, total in totals.items()}
+
+def load_worker(model_specs, split):
+    """ Pool initializer loading the models and the sentences of a worker process.
+
+    Parameters:
+    model_specs (list): The class and model_arguments of each model to be loaded.
+    split (str): The side of the split being evaluated.
+
+    Returns:
+        None
+    """
+    store, indices = load_split(split)
+    worker_split.update(store=store, indices=indices, mappings={})
+    for model_class, arguments in model_specs:
+        model = model_class(**arguments)
+        worker_models[model_class.__name__] = model
+        worker_split['mappings'][model_class.__name__] = model.vocabulary_map(
+            store.vocabulary.words)
+
+def score_shard(task):
+    """ Sums the perplexities of one model over one shard of the sentences.
+
+    Parameters:
+    task (tuple): The model's class name and the start and end of the shard.
+
+    Returns:
+    numpy.ndarray: The four perplexity sums of the shard.
+    """
+    name, start, end = task
+    return store_perplexity_sums(worker_models[name], worker_split['store'],
+                                 worker_split['indices'][start:end],
+                                 worker_split['mappings'][name])
+
+def held_out_probabilities(model, split='test', sentences=None):
+    """ Scores held-out sentences once under every order, for tune_interpolation_weights.
+
+    Weights tuned on the sentences perplexity is reported on flatter the model, so a
+    part of the split kept apart from the evaluation should be chosen.
+
+    Parameters:
+    model (LanguageModel): The model whose weights are tuned.
+    split (str): 'test' or 'train'.
+    sentences (slice): The sentences of the split to be scored, all of them by default.
+
+    Returns:
+    numpy.ndarray: A (max_order, number of words) array of the probability of every
+    held-out word under every order, from unigrams up.
+    """
+    store, indices = load_split(split)
+    if sentences is not None:
+        indices = indices[sentences]
+    ids, lengths = map_sentences(*gather_sentences(store, indices),
+                                 model.vocabulary_map(store.vocabulary.words))
+    return model.batch_token_probabilities_from_ids(ids, lengths)
+
+def interpolation_log_likelihood(probabilities, weights):
+    """ Calculates the average log-likelihood of held-out words under interpolation weights.
+
+    Parameters:
+    probabilities (numpy.ndarray): The per-order array of held_out_probabilities.
+    weights (tuple): The weight of each order, from unigrams up.
+
+    Returns:
+    float: The average natural log probability of the words any order can score.
+    """
+    mixed = np.asarray(weights) @ probabilities
+    return float(np.log(mixed[mixed > 0]).mean())
+
+def tune_interpolation_weights(probabilities, iterations=100, tolerance=1e-6, initial=None):
+    """ Finds the interpolation weights maximising the held-out log-likelihood with
+    expectation maximisation.
+
+    Every iteration only reweights the cached per-order probabilities, so no sentence
+    is scored again: each word's share of each order, given the current weights, is
+    averaged into the next weights, until the log-likelihood stops improving. Words
+    that no order can score are left out.
+
+    Parameters:
+    probabilities (numpy.ndarray): The per-order array of held_out_probabilities.
+    iterations (int): The most iterations run.
+    tolerance (float): The log-likelihood improvement under which the tuning stops.
+    initial (tuple): The weights the tuning starts from, all non-zero, equal weights
+    by default.
+
+    Returns:
+    tuple: The tuned weights, to be given to LanguageModel.set_interpolation_weights,
+    and their average log-likelihood.
+    """
+    probabilities = probabilities[:, probabilities.sum(axis=0) > 0]
+    if initial is None:
+        initial = np.full(len(probabilities), 1 / len(probabilities))
+    weights = np.asarray(initial, dtype=float)
+    log_likelihood = -np.inf
+    for _ in range(iterations):
+        weighted = weights[:, None] * probabilities
+        mixed = weighted.sum(axis=0)
+        new_log_likelihood = float(np.log(mixed).mean())
+        weights = (weighted / mixed).mean(axis=1)
+        if new_log_likelihood - log_likelihood < tolerance:
+            break
+        log_likelihood = new_log_likelihood
+
+    weights /= weights.sum()
+    return tuple(weights.tolist()), interpolation_log_likelihood(probabilities, weights)
@@ -0,0 +1,383 @@
+"""
+Implementation of the modified Kneser-Ney language model.
+"""
+import os
+import numpy as np
+from language_model_ABC import LanguageModel
+from dataset_functions import MAX_ORDER
+
+# used for an order whose counts are too few to estimate its discounts from
+DEFAULT_DISCOUNTS = (0.5, 1.0, 1.5)
+
+class KneserNeyLM(LanguageModel):
+    """
+    Language model implementation using interpolated modified Kneser-Ney smoothing.
+
+    Every order subtracts a discount from each count, one discount for n-grams seen once,
+    one for n-grams seen twice and one for the rest, estimated from the order's counts of
+    counts, and gives the mass taken away to the order below. Orders below the highest
+    count each n-gram by the number of different words it follows rather than by how
+    often it occurs, except for n-grams starting a sentence, which follow nothing. The
+    unigrams are interpolated with a uniform distribution over the vocabulary and one
+    unknown word.
+
+    The probability of every seen n-gram, already interpolated with the orders below, and
+    the backoff weight of every context are calculated when the model is built and saved
+    with it, so a lookup is one gather per order: an unseen n-gram gets its context's
+    backoff weight times its probability under the order below.
+
+    Besides count cutoffs, the model can be pruned by relative entropy, as proposed by
+    Stolcke: every n-gram whose removal would change the model's distribution by less
+    than a threshold is pruned, and the backoff weights are renormalised.
+
+    Attributes:
+        backoff (list): The backoff weight of every row of each order below the highest,
+            as a context, index 0 holding the weight of the unigrams' uniform distribution.
+        entropy_threshold (float): The relative entropy below which n-grams are pruned, or
+            None if the model is not pruned by relative entropy.
+    """
+    def __init__(self, lazy=False, cache_blocks=256, interpolation_weights=None,
+                 max_order=MAX_ORDER, min_counts=None, shared_stores=None,
+                 entropy_threshold=None, quantize_bits=None):
+        """
+        Initializes the Kneser-Ney model.
+
+        The probabilities depend on whole tables, through the continuation counts and the
+        discounts, so they are always calculated up front. In lazy mode the model only
+        skips building its successor index.
+
+        Args:
+            lazy (bool): Whether to skip building the successor index.
+            cache_blocks (int): Unused, the probabilities are never cached lazily.
+            interpolation_weights (tuple): The linear interpolation weight of each order.
+            max_order (int): The highest n-gram order, at least 3.
+            min_counts (int or tuple): The minimum count of the n-grams kept, from bigrams up.
+            shared_stores (dict): The stores shared between models, keyed by counts directory.
+            entropy_threshold (float): The relative entropy below which n-grams are pruned,
+                None keeping every n-gram that passes the count cutoffs.
+            quantize_bits (int): The size of the codes to quantize the probabilities to, 8
+                or 16 bits, None keeping them exact. The backoff weights stay exact.
+        """
+        self.backoff = None
+        self.entropy_threshold = entropy_threshold
+        super().__init__(lazy, cache_blocks, interpolation_weights, max_order, min_counts,
+                         shared_stores, quantize_bits)
+
+    @property
+    def pruned(self):
+        return super().pruned or self.entropy_threshold is not None
+
+    @property
+    def model_path(self):
+        """
+        The path of the binary model file, named after the entropy threshold as well for
+        models pruned by relative entropy.
+        """
+        path = super().model_path
+        if self.entropy_threshold is None:
+            return path
+        root, extension = os.path.splitext(path)
+        return f'{root}_entropy{self.entropy_threshold:g}{extension}'
+
+    def model_arguments(self):
+        return dict(super().model_arguments(), entropy_threshold=self.entropy_threshold)
+
+    def _default_uni_value(self):
+        return float(self.backoff[0][0] / (len(self.store.vocabulary) + 1))
+
+    def _prune_counts(self):
+        """
+        Keeps the store built from the counts whole, to be pruned by
+        _generate_probabilities once the model is estimated on the full counts.
+        """
+
+    def _generate_probabilities(self):
+        """
+        Calculates the probabilities and backoff weights of every order.
+
+        A pruned model is estimated on the full store built by _get_counts, so pruning
+        leaves the continuation counts and the discounts unchanged. The store is pruned
+        afterwards, by count and then by relative entropy, and its backoff weights
+        renormalised after each step.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if not self.pruned:
+            self._estimate()
+            return
+
+        self._estimate()
+        if self.min_counts is not None:
+            self.store = self.store.prune(self.min_counts)
+            self._renormalise_backoff()
+        if self.entropy_threshold is not None:
+            self.store = self.store.prune_rows([entropies >= self.entropy_threshold
+                                                for entropies in self.pruning_entropies()])
+            self._renormalise_backoff()
+
+    def pruning_entropies(self):
+        """
+        Returns the relative entropy between the model and the model without each of its
+        n-grams, from bigrams up, as estimated by Stolcke.
+
+        Pruning an n-gram backs it off to the order below and renormalises its context's
+        backoff weight, which changes the probability of the pruned word and of every word
+        the context already backs off for. The changes are weighted by the probability of
+        the context, the product of the probabilities along its path in the trie. An
+        n-gram that is the context of others is given the largest entropy of its
+        continuations, since it can only be pruned with all of them.
+
+        Returns:
+            list: The relative entropy of every n-gram, one array per order from bigrams up.
+        """
+        store = self.store
+        tiny = np.finfo(float).tiny
+        entropies = []
+        history = np.asarray(store.probabilities[0])
+        for order in range(2, store.max_order + 1):
+            parents = store.parent_rows(order)
+            contexts = len(store.keys[order - 2])
+            probabilities = np.asarray(store.probabilities[order - 1])
+            lower = self._lower_probabilities(order, self._suffix_rows(order))
+
+            # the mass left to the words each context backs off for, and the mass the
+            # order below gives them
+            left = np.maximum(1 - np.bincount(parents, weights=probabilities,
+                                              minlength=contexts), 0)[parents]
+            lower_left = np.maximum(1 - np.bincount(parents, weights=lower,
+                                                    minlength=contexts), 0)[parents]
+            weights = self.backoff[order - 1][parents]
+            pruned_weights = (left + probabilities) / np.maximum(lower_left + lower, tiny)
+
+            log_pruned_weights = np.log(np.maximum(pruned_weights, tiny))
+            change = (probabilities * (np.log(np.maximum(lower, tiny)) + log_pruned_weights
+                                       - np.log(np.maximum(probabilities, tiny)))
+                      + left * (log_pruned_weights - np.log(np.maximum(weights, tiny))))
+            entropies.append(-history[parents] * change)
+            history = history[parents] * probabilities
+
+        for order in range(store.max_order, 2, -1):
+            np.maximum.at(entropies[order - 3], store.parent_rows(order), entropies[order - 2])
+        return entropies
+
+    def _estimate(self):
+        """
+        Calculates the probabilities and backoff weights of every order, from unigrams up.
+        """
+        store = self.store
+        suffixes = {order: self._suffix_rows(order) for order in range(2, store.max_order + 1)}
+        self.backoff = []
+        store.probabilities = list(store.probabilities)
+
+        for order in range(1, store.max_order + 1):
+            counts = self._kneser_ney_counts(order, suffixes.get(order + 1))
+            discounts = np.asarray(self._discounts(counts))
+            discounted = np.where(counts > 0, discounts[np.clip(counts, 1, 3) - 1], 0.0)
+
+            if order == 1:
+                total = counts.sum()
+                weight = discounted.sum() / total
+                self.backoff.append(np.array([weight]))
+                store.probabilities[0] = ((counts - discounted) / total
+                                          + weight / (len(store.vocabulary) + 1))
+                continue
+
+            parents = store.parent_rows(order)
+            contexts = len(store.keys[order - 2])
+            totals = np.bincount(parents, weights=counts, minlength=contexts)
+            mass = np.bincount(parents, weights=discounted, minlength=contexts)
+            weights = np.divide(mass, totals, out=np.ones(contexts), where=totals > 0)
+            self.backoff.append(weights)
+            # in pruned models a context can be left with no continuation counts at all
+            own = np.divide(counts - discounted, totals[parents], out=np.zeros(len(counts)),
+                            where=totals[parents] > 0)
+            store.probabilities[order - 1] = (own + weights[parents]
+                                              * self._lower_probabilities(order, suffixes[order]))
+
+    def _renormalise_backoff(self):
+        """
+        Recalculates the backoff weights after pruning, so the probabilities following
+        every context still sum to 1.
+
+        The probabilities of the n-grams left are kept, and the mass of the pruned ones,
+        now backed off, is shared out by the order below: each context's weight is the
+        mass its n-grams left leave over, divided by the mass the order below leaves over
+        for the same words.
+        """
+        store = self.store
+        for order in range(2, store.max_order + 1):
+            parents = store.parent_rows(order)
+            contexts = len(store.keys[order - 2])
+            lower = self._lower_probabilities(order, self._suffix_rows(order))
+            kept = np.bincount(parents, weights=store.probabilities[order - 1], minlength=contexts)
+            kept_lower = np.bincount(parents, weights=lower, minlength=contexts)
+            self.backoff[order - 1] = np.divide(np.maximum(1 - kept, 0), 1 - kept_lower,
+                                                out=np.ones(contexts), where=kept_lower < 1)
+
+    def _kneser_ney_counts(self, order, suffixes):
+        """
+        Returns the counts an order is estimated from.
+
+        Args:
+            order (int): The order of the table.
+            suffixes (numpy.ndarray): The row in this order of the suffix of every n-gram of
+                the order above, None for the highest order.
+
+        Returns:
+            numpy.ndarray: The count of each n-gram for the highest order, otherwise the
+            number of different words it follows, or its count if it starts a sentence.
+        """
+        counts = np.asarray(self.store.counts[order - 1])
+        if suffixes is None:
+            return counts
+
+        continuation = np.bincount(suffixes[suffixes >= 0], minlength=len(counts))
+        first_ids = self._row_ids(order, np.arange(len(counts)))[:, 0]
+        return np.where(first_ids == self.store.vocabulary.get_id("<s>"), counts, continuation)
+
+    def _discounts(self, counts):
+        """
+        Estimates the discounts of n-grams counted once, twice and three times or more
+        from the numbers of n-grams counted one to four times.
+
+        Args:
+            counts (numpy.ndarray): The counts of one order.
+
+        Returns:
+            tuple: The three discounts.
+        """
+        n1, n2, n3, n4 = (np.count_nonzero(counts == count) for count in range(1, 5))
+        if min(n1, n2, n3, n4) == 0:
+            return DEFAULT_DISCOUNTS
+
+        y = n1 / (n1 + 2 * n2)
+        discounts = (1 - 2 * y * n2 / n1, 2 - 3 * y * n3 / n2, 3 - 4 * y * n4 / n3)
+        return tuple(float(np.clip(discount, 0, limit))
+                     for discount, limit in zip(discounts, (1, 2, 3)))
+
+    def _suffix_rows(self, order):
+        """
+        Returns the row in the order below of the suffix of every n-gram of an order,
+        the n-gram without its first word, or -1 if the suffix was pruned.
+        """
+        ids = self._row_ids(order, np.arange(len(self.store.keys[order - 1])))
+        return self.store.find_rows(ids[:, 1:])
+
+    def _lower_probabilities(self, order, suffixes):
+        """
+        Returns the probability of the last word of every n-gram of an order under the
+        order below, reading it from the suffix's row, or backing off for pruned suffixes.
+        """
+        lower = self.store.probabilities[order - 2]
+        probabilities = np.zeros(len(suffixes))
+        found = suffixes >= 0
+        probabilities[found] = lower[suffixes[found]]
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            windows = self._row_ids(order, missing)[:, 1:]
+            positions = np.arange(len(missing)) * (order - 1) + order - 2
+            probabilities[missing] = self._order_probabilities(windows.ravel(), positions,
+                                                               order - 1)[0][-1]
+        return probabilities
+
+    def _unseen_probs(self, order, context_rows, lower_probabilities):
+        """
+        Backs unseen n-grams off to the order below, weighted by their context's backoff
+        weight, or by 1 if the context itself was not seen.
+        """
+        weights = self.backoff[order - 1]
+        found = context_rows >= 0
+        return np.where(found, weights[np.where(found, context_rows, 0)], 1.0) * lower_probabilities
+
+    def _refresh_probabilities(self, changed_rows):
+        # the backoff weights no longer match the counts, in lazy mode too
+        self.backoff = None
+        super()._refresh_probabilities(changed_rows)
+
+    def _update_probabilities(self, changed_rows):
+        """
+        Recalculates every probability, since any count change moves the continuation
+        counts and the discounts of whole orders.
+        """
+        self._generate_probabilities()
+
+    def _attach_probability_caches(self, cache_blocks):
+        """
+        Calculates the probabilities up front when they were not loaded from the model file,
+        instead of attaching lazy caches.
+        """
+        self.successor_index = {}
+        if self.backoff is None:
+            self._generate_probabilities()
+
+    def _quantize_tables(self):
+        """
+        Quantizes the probability tables, and renormalises every distribution around the
+        quantized probabilities, so each context's probabilities still sum to 1.
+
+        The codebooks keep the mass of each table, give or take the lowest code, and so
+        of the unigrams, whose uniform share is set to the mass the quantized unigrams
+        leave. The mass of the contexts of higher orders moves a little either way. In a
+        context that gained mass, the n-grams rounded up the most are rounded down until
+        it holds no more than its exact mass, so the words it backs off for never lose
+        probability, and the backoff weights, which stay exact, are recalculated for the
+        mass left.
+        """
+        if self.quantize_bits is None:
+            return
+        exact = self.store.probabilities
+        super()._quantize_tables()
+        store = self.store
+
+        vocabulary_size = len(store.vocabulary)
+        left = max(1 - float(np.sum(np.asarray(store.probabilities[0]))), 0.0)
+        self.backoff[0] = np.array([left * (vocabulary_size + 1)
+                                    / (vocabulary_size + 1 - len(store.keys[0]))])
+        for order in range(2, store.max_order + 1):
+            self._round_down_gains(store.probabilities[order - 1], np.asarray(exact[order - 1]),
+                                   store.parent_rows(order), len(store.keys[order - 2]))
+        self._renormalise_backoff()
+
+    @staticmethod
+    def _round_down_gains(table, values, parents, contexts):
+        """
+        Rounds down the rows of a quantized table, in each context that gained mass, the
+        rows losing the most first, until the context holds no more than its exact mass.
+
+        Args:
+            table (QuantizedTable): The quantized probabilities of one order.
+            values (numpy.ndarray): The exact probabilities.
+            parents (numpy.ndarray): The context row of every n-gram.
+            contexts (int): The number of contexts.
+
+        Returns:
+            None
+        """
+        quantized = table[:]
+        gains = np.bincount(parents, weights=quantized - values, minlength=contexts)
+        rows = np.flatnonzero((gains[parents] > 0) & (quantized > values))
+        floors = table.floor_codes(values[rows])
+        reductions = quantized[rows] - table.codebook[floors]
+
+        order = np.lexsort((-reductions, parents[rows]))
+        rows, floors, reductions = rows[order], floors[order], reductions[order]
+        groups = parents[rows]
+        starts = np.flatnonzero(np.diff(groups, prepend=-1))
+        reduced = np.cumsum(reductions) - reductions
+        reduced -= np.repeat(reduced[starts], np.diff(np.append(starts, len(rows))))
+        needed = reduced < gains[groups]
+        table.codes[rows[needed]] = floors[needed]
+
+    def _extra_tables(self):
+        return {f'backoff_{order}': weights for order, weights in enumerate(self.backoff)}
+
+    def _load_extra_tables(self, extras):
+        names = [f'backoff_{order}' for order in range(self.max_order)]
+        if not all(name in extras for name in names):
+            return False
+        self.backoff = [extras[name] for name in names]
+        return True
@@ -3,14 +3,13 @@ Implements an abstract base class for language models
 """
 import string
 import random
-import xml.etree.ElementTree as ET
-from collections import defaultdict
-import json
 import os
 from abc import ABC, abstractmethod
+from functools import partial
 import numpy as np
-from dataset_functions import handle_sentence
-import sys
+from dataset_functions import (MAX_ORDER, generate_training_counts, load_counts, write_counts,
+                               counts_path)
+from ngram_store import NGramStore, ProbabilityCache, QuantizedTable
 
 class LanguageModel(ABC):
     """
@@ -20,38 +19,134 @@ class LanguageModel(ABC):
     Subclasses must implement the abstract methods to provide specific functionality.
 
     Attributes:
-        uni_count (defaultdict): A dictionary to store the counts of unigrams.
-        bi_count (defaultdict): A dictionary to store the counts of bigrams.
-        tri_count (defaultdict): A dictionary to store the counts of trigrams.
-        uni_probabilities (defaultdict): A dictionary to store the probabilities of unigrams.
-        bi_probabilities (defaultdict): A dictionary to store the probabilities of bigrams.
-        tri_probabilities (defaultdict): A dictionary to store the probabilities of trigrams.
+        counts_directory (str): The directory the n-gram count JSON files are stored in.
+        max_order (int): The highest n-gram order of the model.
+        min_counts (tuple): The minimum count of each order from bigrams up, or None if the
+            model is not pruned.
+        store (NGramStore): The vocabulary and the counts and probabilities of every order,
+            held in sorted arrays keyed by word ids.
+        successor_index (dict): The cumulative successor distributions of each n-gram choice,
+            empty in lazy mode and for quantized models.
+        interpolated (numpy.ndarray): The interpolated probability of every n-gram of the
+            highest order, None in lazy mode.
+        interpolation_weights (tuple): The linear interpolation weight of each order, from
+            unigrams up.
+        lazy (bool): Whether probabilities are computed on first access instead of up front.
+        cache_blocks (int): The most probability blocks cached per order in lazy mode.
+        shared_stores (dict): The stores shared with other models, keyed by counts directory,
+            the model's store being a view over one of them, or None if it has its own.
+        quantize_bits (int): The size of the codes the probability tables are quantized to,
+            8 or 16 bits, or None if they hold the exact probabilities.
 
     Methods:
-        __init__(): Initializes the language model and calculates the counts and probabilities.
+        __init__(lazy, cache_blocks, interpolation_weights, max_order, min_counts,
+            shared_stores, quantize_bits): Initializes
+            the language model, loading it from its binary model file or calculating the
+            counts and probabilities.
         __str__(): Returns a string representation of the language model.
         _get_counts(): Loads or generates the n-gram counts.
-        _generate_unigram_probs(): Calculates the unigram probabilities.
-        _generate_bigram_probs(): Calculates the bigram probabilities.
-        _generate_trigram_probs(): Calculates the trigram probabilities.
+        _unigram_formula(counts): Calculates unigram probabilities from their counts.
+        _ngram_formula(counts, context_counts): Calculates the probabilities of higher orders.
+        _generate_probabilities(): Calculates the probabilities of every order up front.
+        apply_count_delta(delta_counts): Updates the counts and the probabilities they affect.
+        _build_interpolation_table(): Precomputes the interpolated highest order probabilities.
+        set_interpolation_weights(weights): Changes the linear interpolation weights.
+        _build_successor_index(choices): Builds the successor distributions used for generation.
         _remove_punctuation(text): Removes punctuation from the given text.
+        token_probabilities(words, choice): Scores every word of a sentence.
+        sentence_log_probability(words, choice): Scores a sentence in log space.
+        batch_log_probabilities(sentences): Scores many sentences at once in log space.
+        batch_log_probabilities_from_ids(ids, lengths): Scores many sentences given as ids.
+        vocabulary_map(words): Maps the words of another vocabulary to the model's ids.
         text_generator(phrase): Generates text based on a given phrase using the language model.
+        generate_words(sentence, choice): Completes a phrase and returns its words.
+        batch_successors(context_ids, choice): Returns the successor distributions of many
+            contexts at once.
     """
-    def __init__(self):
+    counts_directory = 'n_grams/vanilla_laplace'
+    interpolation_weights = (0.1, 0.3, 0.6)
+    max_order = MAX_ORDER
+    min_counts = None
+    quantize_bits = None
+
+    def __init__(self, lazy=False, cache_blocks=256, interpolation_weights=None,
+                 max_order=MAX_ORDER, min_counts=None, shared_stores=None, quantize_bits=None):
         """
-        Initializes the language model and calculates the counts and probabilities.
+        Initializes the language model, memory-mapping it from its binary model file if an
+        up-to-date one exists, otherwise calculating the counts and probabilities and saving
+        them to a new model file.
+
+        In lazy mode only the counts are loaded, preferably from the memory-mapped model file,
+        and probabilities are derived from them on first access, block by block, and kept in
+        a bounded LRU cache per order. Startup time and memory then grow with the queries
+        served rather than with the size of the tables.
+
+        Models of a higher order than trigrams keep their counts in their own directory,
+        and pruned models their own model file, named after their minimum counts.
+
+        Models given shared stores share the vocabulary, keys and counts of their counts
+        directory with the other models built from it, loading them once from the
+        directory's counts.bin file. Their own model file, named <class>_view.bin, only
+        holds their probabilities and extra tables.
+
+        Quantized models store every probability table, the interpolation table and any
+        extra table as 8 or 16-bit codes into a codebook per table, fitted when the model
+        is built, and read them back through the codebook. Their tables take a fraction of
+        the memory and disk space, for a small change of perplexity, and they have their
+        own model file, named after the size of the codes.
+
+        Args:
+            lazy (bool): Whether to compute probabilities on demand.
+            cache_blocks (int): The most probability blocks cached per order in lazy mode.
+            interpolation_weights (tuple): The linear interpolation weight of each order, the
+                class's interpolation_weights by default for trigram models and equal weights
+                for other orders.
+            max_order (int): The highest n-gram order, at least 3.
+            min_counts (int or tuple): The minimum count of the n-grams kept, for every
+                order from bigrams up or one per order, None keeping every n-gram.
+            shared_stores (dict): The stores shared between models, keyed by counts
+                directory and filled in by the first model of each directory.
+            quantize_bits (int): The size of the codes to quantize the tables to, 8 or 16
+                bits, None keeping the exact probabilities.
         """
-        self.uni_count = defaultdict(int)
-        self.bi_count = defaultdict(int)
-        self.tri_count = defaultdict(int)
-        self.uni_probabilities = defaultdict(self._default_uni_value)
-        self.bi_probabilities = defaultdict(float)
-        self.tri_probabilities = defaultdict(float)
+        if max_order < 3:
+            raise ValueError(f"max_order must be at least 3, got {max_order}")
+        self.store = None
+        self.shared_stores = shared_stores
+        self.successor_index = {}
+        self.interpolated = None
+        self.lazy = lazy
+        self.cache_blocks = cache_blocks
+        self._total_tokens = None
+        if max_order != self.max_order:
+            self.max_order = max_order
+            self.counts_directory = counts_path(self.counts_directory, max_order)
+            if interpolation_weights is None:
+                interpolation_weights = (1 / max_order,) * max_order
+        if min_counts is not None:
+            self.min_counts = self._check_min_counts(min_counts)
+        if shared_stores is not None and self.pruned:
+            raise ValueError("pruned models cannot share their counts with other models")
+        if quantize_bits is not None:
+            if quantize_bits not in (8, 16):
+                raise ValueError(f"quantize_bits must be 8 or 16, got {quantize_bits}")
+            if lazy:
+                raise ValueError("quantized models are built up front, they cannot be lazy")
+            self.quantize_bits = quantize_bits
+        if interpolation_weights is not None:
+            self.interpolation_weights = self._check_weights(interpolation_weights)
 
-        self._get_counts()
-        self._generate_unigram_probs()
-        self._generate_bigram_probs()
-        self._generate_trigram_probs()
+        if lazy:
+            if not self._load_model():
+                self._get_counts()
+            self._attach_probability_caches(cache_blocks)
+        elif not self._load_model():
+            self._get_counts()
+            self._generate_probabilities()
+            self._quantize_tables()
+            self._build_interpolation_table()
+            self._build_successor_index()
+            self._save_model()
 
     def __str__(self):
         """
@@ -60,23 +155,150 @@ class LanguageModel(ABC):
         Returns:
             str: A string representation of the language model.
         """
-        ret_str =  (f"uni_count has {len(self.uni_count.keys())} tokens\n"
-                + f"bi_count has {len(self.bi_count.keys())} tokens\n"
-                + f"tri_count has {len(self.tri_count.keys())} tokens\n")
+        names = ['uni', 'bi', 'tri'] + [f'{order}_gram' for order in range(4, self.max_order + 1)]
+        ret_str = "".join(f"{name}_count has {len(counts)} tokens\n"
+                          for name, counts in zip(names, self.store.counts))
         return ret_str
 
     @abstractmethod
     def _default_uni_value(self):
         """"""
 
+    @property
+    def pruned(self):
+        """
+        Whether the model has pruned some of its n-grams.
+        """
+        return self.min_counts is not None
+
+    @property
+    def model_path(self):
+        """
+        The path of the binary model file, stored next to the model's count files.
+        """
+        name = self.__class__.__name__
+        if self.min_counts is not None:
+            name += '_min' + '-'.join(str(min_count) for min_count in self.min_counts)
+        if self.quantize_bits is not None:
+            name += f'_q{self.quantize_bits}'
+        if self.shared_stores is not None:
+            name += '_view'
+        return os.path.join(self.counts_directory, f'{name}.bin')
+
+    def _is_current(self, path, sources=()):
+        """
+        Checks that a file built from the count files exists and is newer than all of them
+        and than the other given source files.
+        """
+        if not os.path.exists(path):
+            return False
+
+        built = os.path.getmtime(path)
+        count_paths = [os.path.join(self.counts_directory, f'{number_of_words}_gram_counts.json')
+                       for number_of_words in range(1, self.max_order + 1)]
+        return all(not os.path.exists(source) or os.path.getmtime(source) <= built
+                   for source in count_paths + list(sources))
+
+    def _shared_store(self):
+        """
+        Returns the store shared by the models of the counts directory, memory-mapping it
+        from the directory's counts.bin file, or building it from the counts and saving
+        it there, the first time a model of the directory asks for it.
+        """
+        store = self.shared_stores.get(self.counts_directory)
+        if store is None:
+            path = os.path.join(self.counts_directory, 'counts.bin')
+            try:
+                store = NGramStore.load(path)[0] if self._is_current(path) else None
+            except ValueError:
+                store = None
+            if store is None or store.max_order != self.max_order:
+                store = NGramStore.from_counts(self._load_counts())
+                store.save(path, probabilities=False)
+            self.shared_stores[self.counts_directory] = store
+        return store
+
+    def _load_model(self):
+        """
+        Memory-maps the model's tables and successor index from its binary model file.
+
+        The file is only used if it has the current format version and is newer than all
+        of the count files it was built from, and for a view, than the shared counts file.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if the model was loaded, False if it has to be built.
+        """
+        base, sources = None, ()
+        if self.shared_stores is not None:
+            sources = (os.path.join(self.counts_directory, 'counts.bin'),)
+        if not self._is_current(self.model_path, sources):
+            return False
+
+        try:
+            if self.shared_stores is not None:
+                base = self._shared_store()
+            store, extras = NGramStore.load(self.model_path, base)
+        except ValueError:
+            return False
+        if store.max_order != self.max_order or not self._load_extra_tables(extras):
+            return False
+
+        self.store = store
+
+        self.successor_index = {name[len('successors_'):]: array
+                                for name, array in extras.items()
+                                if name.startswith('successors_')}
+
+        # the interpolation table and its successors are only valid for the saved weights
+        saved_weights = tuple(extras['interpolation_weights'].tolist())
+        if saved_weights == tuple(self.interpolation_weights):
+            # quantized models have no interpolation table
+            self.interpolated = extras.get('interpolated')
+        elif not self.lazy:
+            self._build_interpolation_table()
+            self._build_successor_index(('4',))
+        return True
+
+    def _save_model(self):
+        """
+        Saves the model's tables and successor index to its binary model file.
+        """
+        extras = {f'successors_{choice}': cumulative
+                  for choice, cumulative in self.successor_index.items()}
+        if self.interpolated is not None:
+            extras['interpolated'] = self.interpolated
+        extras['interpolation_weights'] = np.array(self.interpolation_weights)
+        extras.update(self._extra_tables())
+        self.store.save(self.model_path, extras, counts=self.shared_stores is None)
+
+    def _extra_tables(self):
+        """
+        Returns the arrays of a model's own to be saved in its model file, none by default.
+        """
+        return {}
+
+    def _load_extra_tables(self, extras):
+        """
+        Restores the arrays saved by _extra_tables from the extra arrays of the model file.
+
+        Returns:
+            bool: False if the model file lacks them and the model has to be built.
+        """
+        return True
+
     def _get_counts(self):
         """
         Loads the n-gram counts from JSON files if they exist, otherwise generates the counts.
 
-        If the JSON files for 1-gram, 2-gram, and 3-gram counts exist in the 
-        'n_grams/vanilla_laplace' directory, this method loads the counts from 
-        the files and assigns them to the corresponding instance variables. 
-        If the files do not exist, it calls the '_generate_counts' method to generate the counts.
+        If the JSON files for the counts of every order up to max_order exist in the
+        counts_directory directory, this method loads the counts from the files and
+        builds the model's n-gram store from them. If the files do not exist, it calls
+        the '_generate_counts' method to generate the counts and saves them there.
+        The counts are saved in full, and a pruned model prunes its store after building it.
+        A model sharing its counts takes a view over the shared store instead.
 
         Args:
             None
@@ -84,68 +306,274 @@ class LanguageModel(ABC):
         Returns:
             None
         """
-        if not (os.path.exists('n_grams/vanilla_laplace/1_gram_counts.json')
-                and os.path.exists('n_grams/vanilla_laplace/2_gram_counts.json')
-                and os.path.exists('n_grams/vanilla_laplace/3_gram_counts.json')):
-            self._generate_counts()
+        if self.shared_stores is not None:
+            self.store = self._shared_store().view()
+            return
+
+        self.store = NGramStore.from_counts(self._load_counts())
+        self._prune_counts()
 
-        with open("n_grams/vanilla_laplace/1_gram_counts.json", 'r', encoding='utf-8') as fp:
-            self.uni_count = json.load(fp)
-        with open("n_grams/vanilla_laplace/2_gram_counts.json", 'r', encoding='utf-8') as fp:
-            self.bi_count = json.load(fp)
-        with open("n_grams/vanilla_laplace/3_gram_counts.json", 'r', encoding='utf-8') as fp:
-            self.tri_count = json.load(fp)
+    def _prune_counts(self):
+        """
+        Prunes the store just built from the counts to the n-grams passing min_counts, if
+        the model is pruned.
+        """
+        if self.min_counts is not None:
+            self.store = self.store.prune(self.min_counts)
+
+    def _load_counts(self):
+        """
+        Loads the count dictionaries of the counts directory, generating and saving them
+        first if they do not exist.
+        """
+        counts = load_counts(self.counts_directory, self.max_order)
+        if counts is None:
+            counts = self._generate_counts()
+            write_counts(counts, self.counts_directory)
+        return counts
 
     def _generate_counts(self):
         """
-        Generate n-gram counts and save them to JSON files.
+        Generate the n-gram counts of the training set.
 
-        This function iterates over a range of word counts (1 to 3) and generates n-gram counts
-        based on the sentences in the training_set.xml file. The n-gram counts are then saved
-        to separate JSON files for each word count.
+        The counts of every order up to max_order are computed together in a single pass
+        over the pre-tokenized training sentences.
 
         Args:
             self: The instance of the language model.
 
         Returns:
-            None
+            list: The n-gram counts per order.
         """
-        for number_of_words in range(1, 4):
-            n_gram_counts = defaultdict(int)
-            tree = ET.parse('../data/training_set.xml')
-            root = tree.getroot()
-            for child in root:
-                handle_sentence(child, number_of_words, n_gram_counts)
+        return generate_training_counts(self.max_order)
 
-            with open(f'n_grams/vanilla_laplace/{number_of_words}_gram_counts.json',
-                    'w', encoding='utf-8') as fp:
-                json.dump(n_gram_counts, fp, indent=4)
+    @property
+    def total_tokens(self):
+        """
+        The number of tokens counted in training, the sum of the unigram counts.
+        """
+        if self._total_tokens is None:
+            self._total_tokens = float(self.store.counts[0].sum())
+        return self._total_tokens
 
-    @abstractmethod
-    def _generate_unigram_probs(self):
+    def _unigram_formula(self, counts):
         """
         Calculates unigram probabilities.
 
-        The function calculates the probability of each unigram based on the total token count.
+        The function calculates the probability of each unigram based on its count and the
+        total token count, the maximum likelihood estimate unless a model smooths it.
+
+        Args:
+            counts (numpy.ndarray): The unigram counts.
+
+        Returns:
+            numpy.ndarray: The unigram probabilities.
         """
+        return counts / self.total_tokens
 
-    @abstractmethod
-    def _generate_bigram_probs(self):
+    def _ngram_formula(self, counts, context_counts):
         """
-        Calculates bigram probabilities.
+        Calculates the probabilities of bigrams and higher orders.
 
-        The function calculates the probability of each bigram based on the bigram counts and
-        corresponding unigram counts.
+        The function calculates the probability of each n-gram based on its count and the
+        count of its context, the n-gram of the order below formed by its first words,
+        the maximum likelihood estimate unless a model smooths it.
+
+        Args:
+            counts (numpy.ndarray): The n-gram counts.
+            context_counts (numpy.ndarray): The count of the context of each n-gram.
+
+        Returns:
+            numpy.ndarray: The n-gram probabilities.
         """
+        return counts / context_counts
 
-    @abstractmethod
-    def _generate_trigram_probs(self):
+    def _compute_probabilities(self, order, rows):
+        """
+        Calculates the probabilities of some rows of one order's table.
+
+        Args:
+            order (int): The order of the table.
+            rows (slice or numpy.ndarray): The rows to be calculated.
+
+        Returns:
+            numpy.ndarray: The probability of each row.
+        """
+        counts = np.asarray(self.store.counts[order - 1][rows])
+        if order == 1:
+            return self._unigram_formula(counts)
+
+        parents = self.store.keys[order - 1][rows] // len(self.store.vocabulary)
+        return self._ngram_formula(counts, self.store.counts[order - 2][parents])
+
+    def _generate_probabilities(self):
+        """
+        Calculates the probabilities of every n-gram of every order up front and stores
+        them in store.probabilities.
+        """
+        for order in range(1, self.store.max_order + 1):
+            self.store.probabilities[order - 1] = self._compute_probabilities(order, slice(None))
+
+    def apply_count_delta(self, delta_counts):
+        """
+        Updates the model with count changes, such as those returned by
+        dataset_functions.update_training_counts, without rebuilding it from scratch.
+
+        When the changes only touch n-grams the model already has, the counts are updated
+        in place and only the probabilities depending on them are recomputed: the changed
+        rows, the rows whose context changed and the unigrams, whose total changed. New or
+        vanished n-grams change the layout of the tables, so the store is then rebuilt
+        from the updated counts, still without reading the training data again. The
+        successor index is rebuilt and the model file saved in both cases.
+
+        The saved count files are left to the caller, since the training counts are
+        shared between models. Pruned models no longer hold the counts of the n-grams
+        they pruned, so they are rebuilt from the updated count files instead, and models
+        sharing their counts are updated together by their ModelSet.
+
+        Args:
+            delta_counts (list): The change of each n-gram count per order.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the model is pruned or shares its counts.
+        """
+        if self.pruned:
+            raise ValueError("pruned models cannot apply count changes, "
+                             "they have to be built again from the updated counts")
+        if self.shared_stores is not None:
+            raise ValueError("models sharing their counts apply count changes through "
+                             "their ModelSet")
+        delta_counts = self._map_count_delta(delta_counts)
+        changed_rows = self.store.apply_delta(delta_counts)
+        if changed_rows is None:
+            self.store = NGramStore.from_counts(self._updated_counts(delta_counts))
+        self._save_counts()
+        self._refresh_probabilities(changed_rows)
+
+    def _refresh_probabilities(self, changed_rows):
+        """
+        Brings the probabilities, the interpolation table and the successor index up to
+        date with changed counts, saving the model file unless the model is lazy.
+
+        Args:
+            changed_rows (list): The rows whose count changed, per order, or None if the
+                store was rebuilt.
+
+        Returns:
+            None
+        """
+        self._total_tokens = None
+        if self.lazy:
+            self.interpolated = None
+            self._attach_probability_caches(self.cache_blocks)
+            return
+
+        # quantized tables are recalculated in full, so their codebooks fit the new counts
+        if changed_rows is None or self.quantize_bits is not None:
+            self._generate_probabilities()
+        else:
+            self._update_probabilities(changed_rows)
+        self._quantize_tables()
+        self._build_interpolation_table()
+        self._build_successor_index()
+        self._save_model()
+
+    def _map_count_delta(self, delta_counts):
+        """
+        Maps count changes onto the n-grams of the model, unchanged by default.
         """
-        Calculates trigram probabilities.
+        return delta_counts
 
-        The function calculates the probability of each trigram based on the trigram counts and
-        corresponding bigram counts.
+    def _save_counts(self):
         """
+        Saves the model's updated counts to its count files. The shared training counts are
+        saved by the caller, so nothing is saved by default.
+        """
+
+    def _count_tables(self):
+        """
+        Returns the model's counts as dictionaries keyed by space separated n-grams.
+        """
+        return [dict(zip(self.store.n_grams(order), self.store.counts[order - 1].tolist()))
+                for order in range(1, self.store.max_order + 1)]
+
+    def _updated_counts(self, delta_counts):
+        """
+        Returns the model's count dictionaries with count changes added.
+        """
+        counts = self._count_tables()
+        for n_gram_counts, n_gram_delta in zip(counts, delta_counts):
+            for n_gram, count in n_gram_delta.items():
+                n_gram_counts[n_gram] = n_gram_counts.get(n_gram, 0) + count
+                if n_gram_counts[n_gram] == 0:
+                    del n_gram_counts[n_gram]
+        return counts
+
+    def _update_probabilities(self, changed_rows):
+        """
+        Recomputes the probabilities that depend on the given changed count rows.
+
+        Args:
+            changed_rows (list): The rows whose count changed, per order.
+
+        Returns:
+            None
+        """
+        probabilities = [np.array(table) for table in self.store.probabilities]
+        probabilities[0] = self._compute_probabilities(1, slice(None))
+        for order in range(2, self.store.max_order + 1):
+            affected = np.isin(self.store.parent_rows(order), changed_rows[order - 2])
+            affected[changed_rows[order - 1]] = True
+            rows = np.flatnonzero(affected)
+            probabilities[order - 1][rows] = self._compute_probabilities(order, rows)
+        self.store.probabilities = probabilities
+
+    def _quantize_tables(self):
+        """
+        Quantizes the probability tables of every order, when the model is quantized.
+        """
+        if self.quantize_bits is not None:
+            self.store.probabilities = [QuantizedTable.quantize(table, self.quantize_bits)
+                                        for table in self.store.probabilities]
+
+    def _attach_probability_caches(self, cache_blocks):
+        """
+        Replaces the probability tables with caches computing them from the counts on demand.
+        """
+        self.successor_index = {}
+        self.store.probabilities = [
+            ProbabilityCache(partial(self._compute_probabilities, order),
+                             len(self.store.counts[order - 1]), max_blocks=cache_blocks)
+            for order in range(1, self.store.max_order + 1)]
+
+    def model_arguments(self):
+        """
+        Returns the keyword arguments that rebuild an equivalent model, for example in a
+        worker process, lazy if the model is lazy. A model sharing its counts is rebuilt
+        sharing them too, so it maps the same counts and view files.
+        """
+        arguments = {'lazy': self.lazy, 'cache_blocks': self.cache_blocks,
+                     'interpolation_weights': self.interpolation_weights,
+                     'max_order': self.max_order, 'min_counts': self.min_counts,
+                     'quantize_bits': self.quantize_bits}
+        if self.shared_stores is not None:
+            arguments['shared_stores'] = {}
+        return arguments
+
+    def cache_statistics(self):
+        """
+        Returns the hit and miss statistics of each order's probability cache.
+
+        Returns:
+            list: One dictionary of statistics per order, empty if the model is not lazy.
+        """
+        if not self.lazy:
+            return []
+        return [cache.statistics() for cache in self.store.probabilities
+                if isinstance(cache, ProbabilityCache)]
 
     def _remove_punctuation(self, text):
         """
@@ -162,19 +590,281 @@ class LanguageModel(ABC):
 
         return text_without_punctuation
 
-    @abstractmethod
+    def _unseen_bigram_probs(self, first_ids):
+        """
+        Returns the probability of unseen bigrams starting with the given word ids, 0
+        unless a model smooths them.
+        """
+        return np.zeros(len(first_ids))
+
+    def _unseen_trigram_probs(self, context_rows):
+        """
+        Returns the probability of unseen trigrams following the given bigram rows, 0
+        unless a model smooths them.
+        """
+        return np.zeros(len(context_rows))
+
+    def _unseen_probs(self, order, context_rows, lower_probabilities):
+        """
+        Returns the probability of unseen n-grams of an order following the given context
+        rows, given the probability of their words under the order below, for models that
+        back off. N-grams above trigrams are smoothed as unseen trigrams are.
+        """
+        if order == 2:
+            return self._unseen_bigram_probs(context_rows)
+        return self._unseen_trigram_probs(context_rows)
+
+    def _to_ids(self, words):
+        """
+        Maps a list of words to vocabulary ids, unknown words mapping to -1.
+        """
+        return self.store.vocabulary.to_ids(words)
+
+    def _unigram_probs(self, word_ids):
+        """
+        Looks up the probability of each word id, unknown words getting _default_uni_value.
+        """
+        return self._gather(self.store.probabilities[0], word_ids,
+                            lambda missing: self._default_uni_value())
+
+    def _order_probabilities(self, ids, positions, max_order=None):
+        """
+        Looks up the probability of the words at some positions of a word id sequence
+        under every order, each word given the words before it.
+
+        The n-grams of every order are found with a single walk over the sequence, by
+        NGramStore.n_gram_rows, and each order's probabilities with one gather.
+
+        Args:
+            ids (numpy.ndarray): The word ids of the sequence, holding enough context
+                before each position for the orders wanted.
+            positions (numpy.ndarray): The positions of the words to be scored.
+            max_order (int): The highest order to be looked up, the model's by default.
+
+        Returns:
+            tuple: A (max_order, number of positions) array of the probability of each
+            word under each order, and the row of each word's n-gram of the highest order.
+        """
+        rows = self.store.n_gram_rows(ids, max_order)
+        probabilities = np.empty((len(rows), len(positions)))
+        probabilities[0] = self._unigram_probs(ids[positions])
+        for order in range(2, len(rows) + 1):
+            context_rows = np.where(positions > 0, rows[order - 2][positions - 1], -1)
+            probabilities[order - 1] = self._gather(
+                self.store.probabilities[order - 1], rows[order - 1][positions],
+                lambda missing: self._unseen_probs(order, context_rows[missing],
+                                                   probabilities[order - 2][missing]))
+        return probabilities, rows[-1][positions]
+
+    def _n_gram_probabilities(self, n_gram, max_order=None):
+        """
+        Looks up the probability of the last word of an n-gram under every order.
+        """
+        ids = self._to_ids(n_gram)
+        return self._order_probabilities(ids, np.array([len(ids) - 1]), max_order)
+
+    def _interpolated(self, probabilities, rows):
+        """
+        Linearly interpolates the per-order probabilities of some words.
+
+        The words whose n-gram of the highest order is seen are read from the precomputed
+        interpolation table, when there is one, and only the others are interpolated.
+
+        Args:
+            probabilities (numpy.ndarray): The (max_order, number of words) probabilities.
+            rows (numpy.ndarray): The row of each word's n-gram of the highest order.
+
+        Returns:
+            numpy.ndarray: The interpolated probability of each word.
+        """
+        if self.interpolated is None:
+            return self._interpolate(probabilities)
+        return self._gather(self.interpolated, rows,
+                            lambda missing: self._interpolate(probabilities[:, missing]))
+
+    def _interpolated_rows(self, rows):
+        """
+        Linearly interpolates the n-grams of some rows of the highest order's table.
+        """
+        order = self.max_order
+        windows = self._row_ids(order, rows)
+        positions = np.arange(len(rows)) * order + order - 1
+        return self._interpolate(self._order_probabilities(windows.ravel(), positions)[0])
+
+    def _build_interpolation_table(self, block_size=65536):
+        """
+        Precomputes the interpolated probability of every n-gram of the highest order for
+        the current interpolation weights, saved with the model. The rows are interpolated
+        a block at a time, so the memory needed does not grow with the table.
+
+        Quantized models keep no table, which would be quantized a second time, and
+        interpolate their quantized orders as they score instead.
+        """
+        if self.quantize_bits is not None:
+            self.interpolated = None
+            return
+        size = len(self.store.keys[self.max_order - 1])
+        self.interpolated = np.empty(size)
+        for start in range(0, size, block_size):
+            end = min(start + block_size, size)
+            self.interpolated[start:end] = self._interpolated_rows(np.arange(start, end))
+
+    def set_interpolation_weights(self, weights):
+        """
+        Changes the linear interpolation weights, such as to the ones found by
+        evaluation.tune_interpolation_weights, rebuilding the interpolation table and the
+        interpolated successor distributions.
+
+        Args:
+            weights (tuple): The linear interpolation weight of each order.
+
+        Returns:
+            None
+        """
+        self.interpolation_weights = self._check_weights(weights)
+        if self.lazy:
+            self.interpolated = None
+        else:
+            self._build_interpolation_table()
+            self._build_successor_index(('4',))
+
+    def _check_weights(self, weights):
+        """
+        Validates interpolation weights: one non-negative number per order, summing to 1.
+        """
+        weights = tuple(float(weight) for weight in weights)
+        if len(weights) != self.max_order or min(weights) < 0 or abs(sum(weights) - 1) > 1e-9:
+            raise ValueError(f"interpolation weights must be {self.max_order} non-negative "
+                             f"numbers summing to 1, got {weights}")
+        return weights
+
+    def _check_min_counts(self, min_counts):
+        """
+        Validates minimum counts, expanding a single count to every order from bigrams up.
+        """
+        if isinstance(min_counts, int):
+            min_counts = (min_counts,) * (self.max_order - 1)
+        min_counts = tuple(int(min_count) for min_count in min_counts)
+        if len(min_counts) != self.max_order - 1 or min(min_counts) < 1:
+            raise ValueError(f"min_counts must be {self.max_order - 1} positive counts, "
+                             f"one per order from bigrams up, got {min_counts}")
+        return min_counts
+
+    def _interpolate(self, probabilities):
+        """
+        Combines the probabilities of every order, from unigrams up, with the
+        interpolation weights.
+        """
+        weights = self.interpolation_weights
+        result = weights[0] * probabilities[0]
+        for weight, order_probabilities in zip(weights[1:], probabilities[1:]):
+            result = result + weight * order_probabilities
+        return result
+
+    def _gather(self, probabilities, rows, unseen):
+        """
+        Reads the probabilities of the given rows, filling rows of -1 from unseen.
+
+        Args:
+            probabilities (numpy.ndarray): The probabilities of one order's table.
+            rows (numpy.ndarray): The rows to be read, -1 for n-grams not in the table.
+            unseen (callable): Given the mask of missing rows, returns their probabilities.
+
+        Returns:
+            numpy.ndarray: The probability of each row.
+        """
+        found = rows >= 0
+        result = np.zeros(len(rows))
+        result[found] = probabilities[rows[found]]
+        missing = ~found
+        if missing.any():
+            result[missing] = unseen(missing)
+        return result
+
     def _get_bigram_probability(self, bigram):
-        """"""
+        return float(self._n_gram_probabilities(bigram, 2)[0][1, 0])
 
-    @abstractmethod
     def _get_trigram_probability(self, trigram):
-        """"""
+        return float(self._n_gram_probabilities(trigram, 3)[0][2, 0])
+
+    def _linear_interpolation(self, n_gram):
+        return float(self._interpolated(*self._n_gram_probabilities(n_gram))[0])
+
+    def _build_successor_index(self, choices=('1', '2', '3', '4')):
+        """
+        Precomputes the successor distributions used by text_generator.
+
+        The successors of a context are a contiguous range of rows in the next order's
+        table, so for every n-gram choice it is enough to store, row by row, the cumulative
+        probability normalised within each context's range. A generation step is then a
+        binary search for the context's range followed by a binary search over it. The
+        linear interpolation distributions are built from the interpolation table.
 
-    def _linear_interpolation(self, trigram):
-        uni_prob = 0.1 * self.uni_probabilities[trigram[-1]]
-        bi_prob = 0.3 * self._get_bigram_probability(trigram[-2:])
-        tri_prob = 0.6 * self._get_trigram_probability(trigram)
-        return uni_prob + bi_prob + tri_prob
+        Quantized models build no index, which would hold a float per row again, and
+        compute the distribution of a context's range when generating from it.
+
+        Args:
+            choices (tuple): The n-gram choices to be rebuilt, all of them by default.
+
+        Returns:
+            None
+        """
+        if self.quantize_bits is not None:
+            return
+        store = self.store
+        tables = {
+            '1': (store.probabilities[0], 1, np.zeros(len(store.vocabulary), dtype=np.int64)),
+            '2': (store.probabilities[1], 2, None),
+            '3': (store.probabilities[2], 3, None),
+            '4': (self.interpolated, self.max_order, None),
+        }
+        for choice in choices:
+            probabilities, order, parents = tables[choice]
+            self.successor_index[choice] = self._cumulative_successors(
+                probabilities, store.word_ids(order),
+                store.parent_rows(order) if parents is None else parents)
+
+    def _row_ids(self, order, rows):
+        """
+        Returns the word ids of the n-grams of some rows of an order's table, as a
+        (number of rows, order) array, by walking up the trie from each row.
+        """
+        ids = np.empty((len(rows), order), dtype=np.int64)
+        for column in range(order - 1, -1, -1):
+            ids[:, column] = self.store.word_ids(column + 1, rows)
+            if column > 0:
+                rows = self.store.parent_rows(column + 1, rows)
+        return ids
+
+    def _cumulative_successors(self, probabilities, word_ids, parents):
+        """
+        Computes the cumulative probability of each row within its context's range.
+
+        The sentence start token is never generated, so it gets no probability mass.
+        Contexts left with no mass at all end their range on a cumulative value of 0.
+
+        Args:
+            probabilities (numpy.ndarray): The probability of each row.
+            word_ids (numpy.ndarray): The id of the last word of each row.
+            parents (numpy.ndarray): The non-decreasing context row of each row.
+
+        Returns:
+            numpy.ndarray: The cumulative probabilities, ending in 1 for every context.
+        """
+        weights = np.where(word_ids == self.store.vocabulary.get_id("<s>"), 0.0, probabilities)
+        if len(weights) == 0:
+            return weights
+
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(parents)) + 1))
+        lengths = np.diff(np.append(starts, len(weights)))
+        totals = np.repeat(np.add.reduceat(weights, starts), lengths)
+        normalised = np.divide(weights, totals, out=np.zeros(len(weights)), where=totals > 0)
+
+        cumulative = np.cumsum(normalised)
+        offsets = cumulative[starts] - normalised[starts]
+        cumulative -= np.repeat(offsets, lengths)
+        cumulative[totals <= 0] = 0.0
+        return cumulative
 
     def text_generator(self, sentence, choice):
         """
@@ -182,106 +872,351 @@ class LanguageModel(ABC):
 
         Args:
             phrase (str): The input phrase to generate text from.
+
+        Returns:
+            str: The completed sentence, between start and end markers.
+        """
+        return " ".join(self.generate_words(sentence, choice))
+
+    def generate_words(self, sentence, choice):
+        """
+        Completes a phrase word by word, sampling each word from the successors of the
+        last words, until the sentence end marker or 100 generated words. The context of
+        linear interpolation is the last max_order - 1 words, padded with start markers.
+
+        Args:
+            sentence (str or list): The phrase to be completed, or its words.
+            choice (str): '1' unigram, '2' bigram, '3' trigram or '4' linear interpolation.
+
+        Returns:
+            list: The words of the completed sentence, between start and end markers.
         """
         words = sentence
         if not isinstance(words, list):
-            words = self._remove_punctuation(words)
-            words = words.lower().split()
+            words = self._tokenize(words)
 
         words.insert(0, "<s>")
         if len(words) > 1:
-            context = tuple(words[-2:])
+            context = tuple((["<s>"] * (self.max_order - 3) + words)[-(self.max_order - 1):])
             loop_prevention_counter = 0
 
             while context[-1] not in ["</s>", ""] and loop_prevention_counter < 100:
-                token_probabilities = self._get_probable_tokens(context, choice)
+                successors = self._get_successors(context, choice)
 
-                if not token_probabilities:
+                if successors is None:
                     break
 
-                if token_probabilities["<s>"] != 0:
-                    del token_probabilities["<s>"]
+                order, start, end = successors
+                cumulative = self._successor_cumulative(choice, order, start, end)
+                if cumulative[-1] <= 0:
+                    break
 
                 # semi-random selection of next word based on normalised probability
-                prob_sum = sum(token_probabilities.values())
-                random_dec = random.random()
-                running_sum = 0
-                for token, probability in sorted(token_probabilities.items(),
-                                                 key=lambda item: item[1]):
-                    running_sum += np.divide(probability, prob_sum)
-                    if running_sum > random_dec:
-                        word = token
-                        break
+                target = random.random() * cumulative[-1]
+                position = start + np.searchsorted(cumulative, target, side='right')
+                word = self.store.vocabulary.words[self.store.word_ids(order, position)]
 
                 words.append(word)
-                context = (context[-1], word)
+                context = context[1:] + (word,)
                 loop_prevention_counter += 1
 
         if words[-1] != "</s>":
             words.append("</s>")
 
-        print(" ".join(words))
+        return words
+
+    def _get_successors(self, context, choice):
+        """
+        Finds the rows holding the successors of a context for the given n-gram choice.
+
+        Args:
+            context (tuple): The last max_order - 1 words generated so far.
+            choice (str): '1' unigram, '2' bigram, '3' trigram or '4' linear interpolation.
 
-    def _get_probable_tokens(self, context, choice):
-        token_probabilities = defaultdict(float)
+        Returns:
+            tuple: The order of the successor table and the first and one past the last
+            row of the successors, or None if the context has no successors.
+        """
+        if choice not in ('1', '2', '3', '4'):
+            return None
 
         if choice == '1':
-            for key, value in self.uni_probabilities.items():
-                token_probabilities[key] = value
-        elif choice == '2':
-            for key, value in self.bi_probabilities.items():
-                if key[0] == context[-1]:
-                    token_probabilities[key[-1]] = value
-        elif choice == '3':
-            for key, value in self.tri_probabilities.items():
-                if key[:2] == context:
-                    token_probabilities[key[-1]] = value
-        elif choice == '4':
-            for key in self.tri_probabilities:
-                if key[0:2] == context:
-                    token_probabilities[key[-1]] = self._linear_interpolation(key)
-
-        return token_probabilities
+            order, start, end = 1, 0, len(self.store.vocabulary)
+        else:
+            order = self.max_order if choice == '4' else int(choice)
+            parent_row = self.store.find_rows(self._to_ids(context[-(order - 1):])[None, :])[0]
+            if parent_row < 0:
+                return None
+            start, end = self.store.successor_range(order, parent_row)
 
-    def uni_sentence_probability(self, words):
-        if not isinstance(words, list):
-            words = self._remove_punctuation(words.lower())
-            words = words.split()
+        if start == end:
+            return None
+        return order, start, end
 
-        sentence_probability = 1
-        for unigram in words:
-            prob = self.uni_probabilities[unigram]
-            if prob == 0:
-                prob = self.uni_probabilities["<UNK>"]
-            sentence_probability *= prob
+    def _successor_cumulative(self, choice, order, start, end):
+        """
+        Returns the cumulative successor distribution over a range of rows of one order.
 
-        return sentence_probability
+        The distribution is read from the successor index when it was built, otherwise it is
+        computed for the range alone, with the sentence start marker never chosen.
 
-    def bi_sentence_probability(self, words):
-        if not isinstance(words, list):
-            words = self._remove_punctuation(words.lower())
-            words = ["<s>"] + words.split() + ["</s>"]
+        Args:
+            choice (str): '1' unigram, '2' bigram, '3' trigram or '4' linear interpolation.
+            order (int): The order of the successor table.
+            start (int): The first successor row.
+            end (int): One past the last successor row.
 
-        sentence_probability = 1
-        for index in range(len(words) - 2):
-            bigram = tuple(words[index : index+2])
-            prob = self._get_bigram_probability(bigram)
-            sentence_probability *= prob
+        Returns:
+            numpy.ndarray: The unnormalised cumulative probabilities of the successors.
+        """
+        if choice in self.successor_index:
+            return self.successor_index[choice][start:end]
+        return np.cumsum(self._successor_weights(choice, order, np.arange(start, end)))
 
-        return sentence_probability
+    def _successor_weights(self, choice, order, rows):
+        """
+        Returns the unnormalised probabilities of some successor rows of one order, with
+        the sentence start marker never chosen.
+        """
+        if choice == '4':
+            weights = (self._interpolated_rows(rows) if self.interpolated is None
+                       else self.interpolated[rows])
+        else:
+            weights = self.store.probabilities[order - 1][rows]
+        return np.where(self.store.word_ids(order, rows) == self.store.vocabulary.get_id('<s>'),
+                        0.0, weights)
 
-    def tri_sentence_probability(self, words):
+    def batch_successors(self, context_ids, choice):
+        """
+        Returns the successor distributions of many contexts at once, as used by the
+        decoders of decoding.Decoder.
+
+        The successors of every context are found with one vectorized walk down the trie
+        and one pair of binary searches, and returned flattened, grouped by context.
+
+        Args:
+            context_ids (numpy.ndarray): The ids of the last max_order - 1 words of each
+                context, as a (number of contexts, max_order - 1) array padded with the
+                sentence start marker.
+            choice (str): '1' unigram, '2' bigram, '3' trigram or '4' linear interpolation.
+
+        Returns:
+            tuple: The context index, word id and probability of every successor, in
+            context order. The probabilities are normalised within each context, and
+            contexts without successors or probability mass have none.
+        """
+        store = self.store
+        order = self.max_order if choice == '4' else int(choice)
+        if order == 1:
+            starts = np.zeros(len(context_ids), dtype=np.int64)
+            ends = np.full(len(context_ids), len(store.vocabulary), dtype=np.int64)
+        else:
+            size = len(store.vocabulary)
+            parents = store.find_rows(context_ids[:, context_ids.shape[1] - order + 1:])
+            starts = np.searchsorted(store.keys[order - 1], parents * size)
+            ends = np.where(parents >= 0,
+                            np.searchsorted(store.keys[order - 1], (parents + 1) * size), starts)
+
+        lengths = ends - starts
+        contexts = np.repeat(np.arange(len(context_ids)), lengths)
+        rows = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        weights = self._successor_weights(choice, order, rows)
+        totals = np.bincount(contexts, weights=weights, minlength=len(context_ids))
+
+        kept = weights > 0
+        contexts = contexts[kept]
+        return contexts, store.word_ids(order, rows[kept]), weights[kept] / totals[contexts]
+
+    def _tokenize(self, sentence):
+        """
+        Lowercases a sentence, removes its punctuation and splits it into words.
+        """
+        return self._remove_punctuation(sentence.lower()).split()
+
+    def _pad(self, words, choice):
+        """
+        Adds the sentence start and end markers the given n-gram choice is scored with:
+        one start marker fewer than the order scored with, and an end marker.
+        """
+        if choice == '1':
+            return words
+        if choice == '4':
+            return ["<s>"] * (self.max_order - 1) + words + ["</s>"]
+        return ["<s>"] * (int(choice) - 1) + words + ["</s>"]
+
+    def token_probabilities(self, words, choice):
+        """
+        Calculates the probability of every word of a sentence under one n-gram choice.
+
+        Args:
+            words (str or list): The sentence, or its words already padded for the choice.
+            choice (str): '1' unigram, '2' bigram, '3' trigram or '4' linear interpolation.
+
+        Returns:
+            numpy.ndarray: The probability of each word of the sentence given its context.
+        """
         if not isinstance(words, list):
-            words = self._remove_punctuation(words.lower())
-            words = ["<s>", "<s>"] + words.split() + ["</s>"]
+            words = self._pad(self._tokenize(words), choice)
 
-        sentence_probability = 1
-        for index in range(len(words) - 3):
-            trigram = tuple(words[index : index+3])
-            prob = self._get_trigram_probability(trigram)
-            sentence_probability *= prob
+        if choice not in ('1', '2', '3', '4'):
+            raise ValueError(f"unknown n-gram choice {choice!r}")
 
-        return sentence_probability
+        ids = self._to_ids(words)
+        if choice == '1':
+            probabilities = self._unigram_probs(ids)
+            unknown_probability = self._unigram_probs(self._to_ids(["<UNK>"]))[0]
+            probabilities[probabilities == 0] = unknown_probability
+            return probabilities
+
+        # every word after the start markers is scored, the end marker is not
+        order = self.max_order if choice == '4' else int(choice)
+        probabilities, rows = self._order_probabilities(ids, np.arange(order - 1, len(ids) - 1),
+                                                        order)
+        if choice == '4':
+            return self._interpolated(probabilities, rows)
+        return probabilities[-1]
+
+    def sentence_log_probability(self, words, choice='4'):
+        """
+        Scores a sentence in log space, so long sentences do not underflow.
+
+        Args:
+            words (str or list): The sentence, or its words already padded for the choice.
+            choice (str): '1' unigram, '2' bigram, '3' trigram or '4' linear interpolation.
+
+        Returns:
+            tuple: The natural log probability of each word, and their sum as the log
+            probability of the sentence. Words the model gives no probability score -inf.
+        """
+        with np.errstate(divide='ignore'):
+            token_log_probabilities = np.log(self.token_probabilities(words, choice))
+        return token_log_probabilities, float(token_log_probabilities.sum())
+
+    def batch_token_probabilities(self, sentences):
+        """
+        Looks up the probability of every word of many sentences under every order.
+
+        All the sentences are tokenized once and mapped to one flat id array, so every
+        order is looked up with a single vectorized gather over the whole batch.
+
+        Args:
+            sentences (list): The sentences to be scored.
+
+        Returns:
+            tuple: A (max_order, number of words) array holding the probability of each
+            word under each order, from unigrams up, sentence after sentence, and the
+            number of words of each sentence.
+        """
+        words = []
+        lengths = np.zeros(len(sentences), dtype=np.int64)
+        for index, sentence in enumerate(sentences):
+            tokens = self._tokenize(sentence)
+            lengths[index] = len(tokens)
+            words += tokens
+
+        return self.batch_token_probabilities_from_ids(self._to_ids(words), lengths), lengths
+
+    def batch_token_probabilities_from_ids(self, ids, lengths):
+        """
+        Looks up the probability of every word of many sentences already mapped to the
+        model's word ids under every order.
+
+        Each sentence is padded with max_order - 1 start markers in one flat id array,
+        the n-grams of every order are found with one walk over it, and every order is
+        looked up with a single vectorized gather.
+
+        Args:
+            ids (numpy.ndarray): The ids of the words of every sentence, one after the
+                other, -1 for words the model does not know.
+            lengths (numpy.ndarray): The number of words of each sentence.
+
+        Returns:
+            numpy.ndarray: A (max_order, number of words) array holding the probability of
+            each word under each order, from unigrams up.
+        """
+        pads = self.max_order - 1
+        sentence_ids = np.repeat(np.arange(len(lengths)), lengths)
+        positions = np.arange(len(ids)) + pads * (sentence_ids + 1)
+        padded = np.full(len(ids) + pads * len(lengths), self.store.vocabulary.get_id("<s>"),
+                         dtype=np.int64)
+        padded[positions] = ids
+        return self._order_probabilities(padded, positions)[0]
+
+    def batch_log_probabilities(self, sentences):
+        """
+        Scores many sentences at once under all four n-gram choices in log space.
+
+        Args:
+            sentences (list): The sentences to be scored.
+
+        Returns:
+            tuple: A (4, number of sentences) array of unigram, bigram, trigram and linear
+            interpolation sentence log probabilities, and the number of words scored in
+            each sentence.
+        """
+        probabilities, lengths = self.batch_token_probabilities(sentences)
+        return self._sentence_log_probabilities(probabilities, lengths), lengths
+
+    def batch_log_probabilities_from_ids(self, ids, lengths):
+        """
+        Scores many sentences already mapped to the model's word ids, as
+        batch_log_probabilities does.
+
+        Args:
+            ids (numpy.ndarray): The ids of the words of every sentence, one after the other.
+            lengths (numpy.ndarray): The number of words of each sentence.
+
+        Returns:
+            numpy.ndarray: A (4, number of sentences) array of unigram, bigram, trigram and
+            linear interpolation sentence log probabilities.
+        """
+        return self._sentence_log_probabilities(
+            self.batch_token_probabilities_from_ids(ids, lengths), lengths)
+
+    def _sentence_log_probabilities(self, probabilities, lengths):
+        """
+        Sums the per-word log probabilities of every sentence under the four n-gram choices,
+        linear interpolation combining every order.
+        """
+        uni_probs, bi_probs, tri_probs = probabilities[:3]
+        unknown_probability = self._unigram_probs(self._to_ids(["<UNK>"]))[0]
+        scores = np.vstack((np.where(uni_probs == 0, unknown_probability, uni_probs),
+                            bi_probs, tri_probs, self._interpolate(probabilities)))
+        with np.errstate(divide='ignore'):
+            log_scores = np.log(scores)
+
+        sentence_ids = np.repeat(np.arange(len(lengths)), lengths)
+        return np.vstack([np.bincount(sentence_ids, weights=row, minlength=len(lengths))
+                          for row in log_scores])
+
+    def vocabulary_map(self, words):
+        """
+        Maps the words of another vocabulary, such as a SentenceStore's, to the model's ids.
+
+        Each word is tokenized as it would be within a sentence. Removing punctuation never
+        splits a word, so every word becomes a single token, or none if it was only
+        punctuation.
+
+        Args:
+            words (list): The words to be mapped.
+
+        Returns:
+            numpy.ndarray: The model id of each word's token, -1 if the model does not know
+            the token, or -2 if the word has none.
+        """
+        tokens = [self._tokenize(word) for word in words]
+        ids = self._to_ids([word_tokens[0] if word_tokens else "" for word_tokens in tokens])
+        ids[[not word_tokens for word_tokens in tokens]] = -2
+        return ids
+
+    def uni_sentence_probability(self, words):
+        return self._product(self.token_probabilities(words, '1'))
+
+    def bi_sentence_probability(self, words):
+        return self._product(self.token_probabilities(words, '2'))
+
+    def tri_sentence_probability(self, words):
+        return self._product(self.token_probabilities(words, '3'))
 
     def sentence_probability(self, words):
         """
@@ -293,47 +1228,21 @@ class LanguageModel(ABC):
         Returns:
             float: The probability of the given sentence according to the language model.
         """
-        if not isinstance(words, list):
-            words = self._remove_punctuation(words.lower())
-            words = ["<s>", "<s>"] + words.split() + ["</s>"]
+        return self._product(self.token_probabilities(words, '4'))
 
+    def _product(self, probabilities):
+        """
+        Multiplies the n-gram probabilities of a sentence together, left to right.
+        """
         sentence_probability = 1
-        for index in range(len(words) - 3):
-            trigram = tuple(words[index : index+3])
-            prob = self._linear_interpolation(trigram)
+        for prob in probabilities.tolist():
             sentence_probability *= prob
 
         return sentence_probability
 
     def calculate_space_needed(self):
-        size = sys.getsizeof(self.uni_count)        
-        for key, value in self.uni_count.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-
-        size += sys.getsizeof(self.bi_count)
-        for key, value in self.bi_count.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-        
-        size += sys.getsizeof(self.tri_count)
-        for key, value in self.tri_count.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-        
-        size += sys.getsizeof(self.uni_probabilities)
-        for key, value in self.uni_probabilities.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-
-        size += sys.getsizeof(self.bi_probabilities)
-        for key, value in self.bi_probabilities.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-        
-        size += sys.getsizeof(self.tri_probabilities)
-        for key, value in self.tri_probabilities.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-            
-        print(size)
+        """
+        Returns:
+            int: The number of bytes held by the model's n-gram store.
+        """
+        return self.store.nbytes()
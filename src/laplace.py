@@ -2,40 +2,26 @@
 Implementation of the laplace (add 1) language model.
 """
 import sys
-from language_model_abc import LanguageModel
+import numpy as np
+from language_model_ABC import LanguageModel
 
 class LaplaceLM(LanguageModel):
     def _default_uni_value(self):
-        return float(1 / sum(self.uni_count.values()) + len(self.uni_count))
-
-    def _generate_unigram_probs(self):
-        total_tokens = float(sum(self.uni_count.values()))
-        for key in self.uni_count:
-            self.uni_probabilities[key] = ((self.uni_count[key] + 1)
-                                           / (total_tokens + len(self.uni_count)))
-
-    def _generate_bigram_probs(self):
-        for key in self.bi_count:
-            words = tuple(key.split())
-            self.bi_probabilities[words] = ((self.bi_count[key] + 1)
-                                            / (self.uni_count[words[0]] + len(self.uni_count)))
-
-    def _generate_trigram_probs(self):
-        for key in self.tri_count:
-            words = tuple(key.split())
-            bi_gram_key = words[0] + " " + words[1]
-            self.tri_probabilities[words] = ((self.tri_count[key] + 1)
-                                             / (self.bi_count[bi_gram_key] + len(self.uni_count)))
-
-    def _get_bigram_probability(self, bigram):
-        return self.bi_probabilities.get(bigram,
-                                         1 / (self.uni_count.get(bigram[0], 1)
-                                              + len(self.uni_count)))
-
-    def _get_trigram_probability(self, trigram):
-        return self.tri_probabilities.get(trigram,
-                                          1 / (self.bi_count.get(trigram[:2], 1)
-                                               + len(self.uni_count)))
+        return float(1 / self.store.counts[0].sum() + len(self.store.vocabulary))
+
+    def _unigram_formula(self, counts):
+        return (counts + 1) / (self.total_tokens + len(self.store.vocabulary))
+
+    def _ngram_formula(self, counts, context_counts):
+        return (counts + 1) / (context_counts + len(self.store.vocabulary))
+
+    def _unseen_bigram_probs(self, first_ids):
+        first_counts = np.where(first_ids >= 0, self.store.counts[0][first_ids], 1)
+        return 1 / (first_counts + len(self.store.vocabulary))
+
+    def _unseen_trigram_probs(self, context_rows):
+        # unseen trigrams are smoothed as if their context had been seen once
+        return np.full(len(context_rows), 1 / (1 + len(self.store.vocabulary)))
 
     def uni_sentence_probability(self, words):
         return max(super().uni_sentence_probability(words), sys.float_info.min)
@@ -1,23 +1,13 @@
-import xml.etree.ElementTree as ET
+import argparse
 import json
 import os
-from dataset_functions import (retrieve_text, model_perplexity,
-                               generate_corpus_counts, splitting_datasets)
-from vanilla import VanillaLM
-from laplace import LaplaceLM
-from unk import UnkLM
+from dataset_functions import (CORPUS_COUNTS_PATH, counts_exist, generate_corpus_counts,
+                               splitting_datasets, split_exists)
+from evaluation import evaluate_perplexities
+from model_set import ModelSet
 
-def calculate_perplexities(models):
-    test_sentences = []
-    test_tree = ET.parse("../data/test_set.xml")
-    root = test_tree.getroot()
-    for child in root:
-        test_sentences.append(retrieve_text(child))
-
-    perplexities = {}
-
-    for model in models:
-        perplexities[model.__class__.__name__] = model_perplexity(model, test_sentences)
+def calculate_perplexities(models, workers=1):
+    perplexities = evaluate_perplexities(models, 'test', workers)
 
     with open('../documentation/perplexity.json', 'w', encoding='utf-8') as fp:
         json.dump(perplexities, fp, indent=4)
@@ -50,11 +40,11 @@ def text_generation(models):
 
         sentence = input("Input a phrase to be finished by your selected model\n")
         if model_choice == '1':
-            models[0].text_generator(sentence, ngram_choice)
+            print(models[0].text_generator(sentence, ngram_choice))
         elif model_choice == '2':
-            models[1].text_generator(sentence, ngram_choice)
+            print(models[1].text_generator(sentence, ngram_choice))
         elif model_choice == '3':
-            models[2].text_generator(sentence, ngram_choice)
+            print(models[2].text_generator(sentence, ngram_choice))
 
 def sentence_probability_calculator(models):
     print("starting up sentence probability calculator")
@@ -81,24 +71,27 @@ def sentence_probability_calculator(models):
             print(f"The probability of your sentence is: {models[2].sentence_probability(sentence)}")
 
 if __name__ == "__main__":
-    if not (os.path.exists("n_grams/corpus/1_gram_counts.json")
-            and os.path.exists("n_grams/corpus/2_gram_counts.json")
-            and os.path.exists("n_grams/corpus/3_gram_counts.json")):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--update-corpus-counts', action='store_true',
+                        help="count the corpus files added or changed since the last update")
+    arguments = parser.parse_args()
+
+    if arguments.update_corpus_counts:
+        print("Updating corpus counts...")
+        generate_corpus_counts(workers=os.cpu_count(), incremental=True)
+    elif not counts_exist(CORPUS_COUNTS_PATH):
         print("Generating corpus counts...")
-        generate_corpus_counts()
+        generate_corpus_counts(workers=os.cpu_count())
 
-    if not (os.path.exists('../data/training_set.xml')
-            and os.path.exists('../data/test_set.xml')):
+    if not split_exists():
         print("Splitting the data sets...")
         splitting_datasets()
 
     print("Training the models...")
-    vanilla = VanillaLM()
-    laplace = LaplaceLM()
-    unk = UnkLM()
-    lms = [vanilla, laplace, unk]
+    # the vanilla and laplace models share one copy of the training counts
+    lms = list(ModelSet(('vanilla', 'laplace', 'unk')))
 
-    # calculate_perplexities(lms)
+    # calculate_perplexities(lms, workers=os.cpu_count())
 
     while True:
         function_choice = input("Please choose a function:\n"
@@ -0,0 +1,105 @@
+"""
+Implements a container of language models sharing their count tables.
+"""
+import os
+from dataset_functions import MAX_ORDER
+from ngram_store import NGramStore
+from vanilla import VanillaLM
+from laplace import LaplaceLM
+from unk import UnkLM
+from kneser_ney import KneserNeyLM
+
+MODEL_CLASSES = {'vanilla': VanillaLM, 'laplace': LaplaceLM, 'unk': UnkLM,
+                 'kneser_ney': KneserNeyLM}
+
+class ModelSet:
+    """
+    A set of language models loading each count table once.
+
+    The models built from the same counts, such as the vanilla, Laplace and Kneser-Ney
+    models, are views over one shared store: its vocabulary, keys and counts are
+    memory-mapped once from the counts directory's counts.bin file, and each model only
+    adds its own probabilities and tables, or in lazy mode, its bounded probability caches.
+
+    Attributes:
+        stores (dict): The shared store of each counts directory.
+        models (dict): The language models, keyed by name.
+    """
+    def __init__(self, names=('vanilla', 'laplace', 'unk'), lazy=False, cache_blocks=256,
+                 max_order=MAX_ORDER):
+        """
+        Loads the named models, building the shared stores and the models' tables the
+        first time.
+
+        Args:
+            names (tuple): The names of the models, keys of MODEL_CLASSES.
+            lazy (bool): Whether the models compute their probabilities on demand.
+            cache_blocks (int): The most probability blocks cached per order in lazy mode.
+            max_order (int): The highest n-gram order of the models.
+        """
+        self.stores = {}
+        self.models = {name: MODEL_CLASSES[name](lazy=lazy, cache_blocks=cache_blocks,
+                                                 max_order=max_order, shared_stores=self.stores)
+                       for name in names}
+
+    def __getitem__(self, name):
+        return self.models[name]
+
+    def __iter__(self):
+        return iter(self.models.values())
+
+    def __len__(self):
+        return len(self.models)
+
+    def apply_count_delta(self, delta_counts):
+        """
+        Updates every model with count changes, applying them once to each shared store.
+
+        Each store is updated as LanguageModel.apply_count_delta updates a model's own,
+        in place when only known n-grams change and otherwise rebuilt from the updated
+        counts, and saved to its counts.bin file. Each model then refreshes the
+        probabilities depending on the changed counts.
+
+        Args:
+            delta_counts (list): The change of each n-gram count per order.
+
+        Returns:
+            None
+        """
+        for directory, store in list(self.stores.items()):
+            models = [model for model in self if model.counts_directory == directory]
+            if not models:
+                continue
+
+            mapped = models[0]._map_count_delta(delta_counts)
+            changed_rows = store.apply_delta(mapped)
+            if changed_rows is None:
+                store = NGramStore.from_counts(models[0]._updated_counts(mapped))
+            self.stores[directory] = store
+            store.save(os.path.join(directory, 'counts.bin'), probabilities=False)
+
+            for model in models:
+                model.store = store.view(None if changed_rows is None
+                                         else model.store.probabilities)
+            models[0]._save_counts()
+            for model in models:
+                model._refresh_probabilities(changed_rows)
+
+    def nbytes(self):
+        """
+        Estimates the memory used by the models, counting each shared store once.
+
+        Returns:
+            int: The size of the shared stores plus each model's own tables.
+        """
+        size = 0
+        for store in self.stores.values():
+            # the probability tables of a shared store are never filled in
+            size += store.nbytes() - sum(table.nbytes for table in store.probabilities)
+        for model in self:
+            size += sum(table.nbytes for table in model.store.probabilities)
+            if model.interpolated is not None:
+                size += model.interpolated.nbytes
+            size += sum(array.nbytes for array in model.successor_index.values())
+            size += sum(array.nbytes for array in model._extra_tables().values())
+        return size
@@ -0,0 +1,682 @@
+"""
+Implements the compact, array backed n-gram storage shared by the language models.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from collections import OrderedDict
+import numpy as np
+
+MAGIC = b'NGRAMLM\0'
+# bumped whenever the contents of a model file change, so older files are rebuilt: 2 added
+# the interpolation table, 3 the view files and the rows header, 4 the quantized tables, 5
+# dropped the quantized interpolation table and backoff weights
+FORMAT_VERSION = 5
+ALIGNMENT = 64
+HEADER_OFFSET = len(MAGIC) + 8
+
+
+class Vocabulary:
+    """
+    Maps words to contiguous integer ids and back.
+
+    Attributes:
+        words (list): The word of each id.
+        ids (dict): The id of each word.
+    """
+    def __init__(self, words=()):
+        self.words = list(words)
+        self.ids = {word: index for index, word in enumerate(self.words)}
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self.ids
+
+    def add(self, word):
+        """
+        Returns the id of a word, adding the word to the vocabulary if it is new.
+
+        Args:
+            word (str): The word to be added.
+
+        Returns:
+            int: The id of the word.
+        """
+        word_id = self.ids.get(word)
+        if word_id is None:
+            word_id = len(self.words)
+            self.ids[word] = word_id
+            self.words.append(word)
+        return word_id
+
+    def get_id(self, word):
+        """
+        Returns the id of a word, or -1 if the word is not in the vocabulary.
+        """
+        return self.ids.get(word, -1)
+
+    def to_ids(self, words):
+        """
+        Maps a list of words to an array of ids, unknown words mapping to -1.
+
+        Args:
+            words (list): The words to be mapped.
+
+        Returns:
+            numpy.ndarray: The int64 id of each word.
+        """
+        return np.fromiter((self.ids.get(word, -1) for word in words),
+                           dtype=np.int64, count=len(words))
+
+
+class NGramStore:
+    """
+    Stores the n-gram counts and probabilities of every order in sorted NumPy arrays.
+
+    The n-grams form a trie. Unigram rows are the word ids themselves, and an n-gram of a
+    higher order is identified by the packed key parent_row * V + word_id, where parent_row
+    is the row of its first n - 1 words in the table of the order below and V is the size of
+    the vocabulary. Each table keeps its keys sorted, so an n-gram is found by one binary
+    search per order and all the successors of a context occupy a contiguous range of rows.
+
+    Attributes:
+        vocabulary (Vocabulary): The words of the n-grams and their ids.
+        keys (list): The sorted int64 packed keys of each order.
+        counts (list): The int64 count of each n-gram, parallel to keys.
+        probabilities (list): The float64 probability of each n-gram, parallel to keys,
+            filled in by the language model.
+    """
+    def __init__(self, vocabulary, keys, counts):
+        self.vocabulary = vocabulary
+        self.keys = keys
+        self.counts = counts
+        self.probabilities = [np.zeros(len(n_gram_counts)) for n_gram_counts in counts]
+
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        Builds the store from count dictionaries keyed by space separated n-grams.
+
+        Every (n - 1)-word prefix of an n-gram must itself be counted in the order below,
+        which always holds for counts produced by dataset_functions.count_id_sentences.
+
+        Args:
+            counts (list): The n-gram counts per order, index 0 holding the unigrams.
+
+        Returns:
+            NGramStore: The store holding the counts.
+        """
+        vocabulary = Vocabulary(counts[0])
+        n_gram_ids = []
+        for order, n_gram_counts in enumerate(counts[1:], start=2):
+            ids = [vocabulary.add(word) for n_gram in n_gram_counts for word in n_gram.split()]
+            n_gram_ids.append(np.array(ids, dtype=np.int64).reshape(-1, order))
+
+        unigram_counts = np.zeros(len(vocabulary), dtype=np.int64)
+        unigram_counts[:len(counts[0])] = list(counts[0].values())
+        store = cls(vocabulary, [np.arange(len(vocabulary), dtype=np.int64)], [unigram_counts])
+
+        for ids, n_gram_counts in zip(n_gram_ids, counts[1:]):
+            parent_rows = store.find_rows(ids[:, :-1])
+            if np.any(parent_rows < 0):
+                raise ValueError(f"{ids.shape[1]}-gram counts contain n-grams whose prefix "
+                                 "is not counted in the order below")
+            packed = parent_rows * len(vocabulary) + ids[:, -1]
+            order = np.argsort(packed, kind='stable')
+            values = np.fromiter(n_gram_counts.values(), dtype=np.int64, count=len(packed))
+            store.keys.append(packed[order])
+            store.counts.append(values[order])
+            store.probabilities.append(np.zeros(len(packed)))
+
+        return store
+
+    def view(self, probabilities=None):
+        """
+        Returns a store sharing this store's vocabulary, keys and counts without copying
+        them, with probability tables of its own.
+
+        Args:
+            probabilities (list): The probability tables of the view, zeros by default.
+
+        Returns:
+            NGramStore: The view.
+        """
+        store = NGramStore(self.vocabulary, list(self.keys), list(self.counts))
+        if probabilities is not None:
+            store.probabilities = list(probabilities)
+        return store
+
+    def save(self, path, extras=None, counts=True, probabilities=True):
+        """
+        Saves the store to a versioned binary file that load can memory-map.
+
+        The file starts with a magic number, the format version and a JSON header
+        describing every array, followed by the arrays themselves at aligned offsets:
+        the newline separated vocabulary, then the keys, counts and probabilities of
+        each order, then any extra arrays. The file is written next to its final path
+        and moved into place, so processes mapping an older file keep a valid copy.
+
+        A file without the counts holds a view: only its probabilities and extra arrays,
+        the vocabulary, keys and counts being those of a base store given to load.
+        Quantized tables are saved as their codes followed by their codebook.
+
+        Args:
+            path (str): The path of the model file.
+            extras (dict): Additional named arrays to be stored with the model.
+            counts (bool): Whether to save the vocabulary, keys and counts.
+            probabilities (bool): Whether to save the probabilities.
+
+        Returns:
+            None
+        """
+        arrays = []
+        if counts:
+            arrays.append(('vocabulary', np.frombuffer(
+                "\n".join(self.vocabulary.words).encode('utf-8'), dtype=np.uint8)))
+        for order in range(1, self.max_order + 1):
+            if counts:
+                arrays.append((f'keys_{order}', self.keys[order - 1]))
+                arrays.append((f'counts_{order}', self.counts[order - 1]))
+            if probabilities:
+                arrays += self._file_arrays(f'probabilities_{order}', self.probabilities[order - 1])
+        for name, array in (extras or {}).items():
+            arrays += self._file_arrays(f'extra_{name}', array)
+
+        entries = []
+        offset = 0
+        for name, array in arrays:
+            entries.append({'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape),
+                            'offset': offset})
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+        header = json.dumps({'max_order': self.max_order,
+                             'rows': [len(keys) for keys in self.keys],
+                             'arrays': entries}).encode('utf-8')
+        data_start = -(-(HEADER_OFFSET + len(header)) // ALIGNMENT) * ALIGNMENT
+
+        temporary_path = f'{path}.tmp{os.getpid()}'
+        with open(temporary_path, 'wb') as fp:
+            fp.write(MAGIC + struct.pack('<II', FORMAT_VERSION, len(header)) + header)
+            for entry, (_, array) in zip(entries, arrays):
+                fp.seek(data_start + entry['offset'])
+                fp.write(array.tobytes())
+            fp.truncate(data_start + offset)
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def _file_arrays(name, array):
+        """
+        Returns the named arrays a table is saved as, its codes and codebook if quantized.
+        """
+        if isinstance(array, QuantizedTable):
+            return [(name, array.codes), (f'{name}_codebook', array.codebook)]
+        return [(name, np.ascontiguousarray(array))]
+
+    @classmethod
+    def load(cls, path, base=None):
+        """
+        Memory-maps a model file written by save.
+
+        Every array is a read-only view of the mapped file, so loading does not copy the
+        tables and processes loading the same file share its pages. Probabilities missing
+        from the file are zeros, and tables saved with a codebook are QuantizedTables.
+
+        Args:
+            path (str): The path of the model file.
+            base (NGramStore): The store a file saved without its counts is a view over.
+
+        Returns:
+            tuple: The NGramStore and a dictionary of its extra arrays.
+
+        Raises:
+            ValueError: If the file is not a model file of the current format version, or
+                a view over a store other than base.
+        """
+        with open(path, 'rb') as fp:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_length = struct.unpack_from('<8sII', mapped)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} n-gram model file")
+
+        header = json.loads(mapped[HEADER_OFFSET:HEADER_OFFSET + header_length].decode('utf-8'))
+        data_start = -(-(HEADER_OFFSET + header_length) // ALIGNMENT) * ALIGNMENT
+        arrays = {}
+        for entry in header['arrays']:
+            dtype = np.dtype(entry['dtype'])
+            count = int(np.prod(entry['shape']))
+            arrays[entry['name']] = np.frombuffer(mapped, dtype=dtype, count=count,
+                                                  offset=data_start + entry['offset']
+                                                  ).reshape(entry['shape'])
+        for name in [name for name in arrays if name.endswith('_codebook')]:
+            table = name[:-len('_codebook')]
+            arrays[table] = QuantizedTable(arrays[table], arrays.pop(name))
+
+        orders = range(1, header['max_order'] + 1)
+        if 'vocabulary' in arrays:
+            words = arrays['vocabulary'].tobytes().decode('utf-8')
+            vocabulary = Vocabulary(words.split("\n") if words else [])
+            store = cls(vocabulary, [arrays[f'keys_{order}'] for order in orders],
+                        [arrays[f'counts_{order}'] for order in orders])
+        elif base is not None and [len(keys) for keys in base.keys] == header['rows']:
+            store = base.view()
+        else:
+            raise ValueError(f"{path} is a view over another store")
+        store.probabilities = [arrays.get(f'probabilities_{order}', probabilities)
+                               for order, probabilities in zip(orders, store.probabilities)]
+        extras = {name[len('extra_'):]: array for name, array in arrays.items()
+                  if name.startswith('extra_')}
+        return store, extras
+
+    @property
+    def max_order(self):
+        """
+        The highest n-gram order held by the store.
+        """
+        return len(self.keys)
+
+    def child_rows(self, order, parent_rows, word_ids):
+        """
+        Finds the n-grams formed by extending each parent row with a word.
+
+        Args:
+            order (int): The order of the n-grams to be found, at least 2.
+            parent_rows (numpy.ndarray): The rows of the contexts in the order below.
+            word_ids (numpy.ndarray): The id of the word following each context.
+
+        Returns:
+            numpy.ndarray: The row of each n-gram in the given order's table, or -1 where
+            the context, the word or the n-gram itself is not in the store.
+        """
+        keys = self.keys[order - 1]
+        valid = (parent_rows >= 0) & (word_ids >= 0)
+        if len(keys) == 0:
+            return np.full(len(valid), -1, dtype=np.int64)
+
+        packed = np.where(valid, parent_rows * len(self.vocabulary) + word_ids, 0)
+        positions = np.minimum(np.searchsorted(keys, packed), len(keys) - 1)
+        return np.where(valid & (keys[positions] == packed), positions, -1)
+
+    def find_rows(self, ids):
+        """
+        Finds n-grams given as rows of word ids by walking down the trie.
+
+        Args:
+            ids (numpy.ndarray): A (number of n-grams, n) array of word ids.
+
+        Returns:
+            numpy.ndarray: The row of each n-gram in the order n table, or -1 if absent.
+        """
+        rows = ids[:, 0]
+        for column in range(1, ids.shape[1]):
+            rows = self.child_rows(column + 1, rows, ids[:, column])
+        return rows
+
+    def n_gram_rows(self, ids, max_order=None):
+        """
+        Finds the n-grams of every order ending at every position of a word id sequence.
+
+        The n-gram of order n ending at a position extends the n-gram of order n - 1
+        ending at the position before it by one word, so every order is found from the
+        rows of the order below with a single binary search per position. All the orders
+        of every context then come from one walk over the sequence, instead of walking
+        down the trie again for each n-gram.
+
+        Args:
+            ids (numpy.ndarray): The word ids of the sequence, -1 for unknown words.
+            max_order (int): The highest order to be found, the store's by default.
+
+        Returns:
+            list: The rows of the n-grams ending at each position, per order, index 0
+            holding the unigrams. Rows are -1 where the n-gram is not in the store or
+            would start before the sequence.
+        """
+        rows = [ids]
+        for order in range(2, (max_order or self.max_order) + 1):
+            context_rows = np.full(len(ids), -1, dtype=np.int64)
+            context_rows[1:] = rows[-1][:-1]
+            rows.append(self.child_rows(order, context_rows, ids))
+        return rows
+
+    def prune(self, min_counts):
+        """
+        Returns a copy of the store without the n-grams counted fewer times than the
+        minimum of their order.
+
+        Args:
+            min_counts (tuple): The minimum count of each order from bigrams up to
+                max_order.
+
+        Returns:
+            NGramStore: The pruned store, keeping the probabilities of the n-grams left.
+        """
+        return self.prune_rows([np.asarray(self.counts[order - 1]) >= min_count
+                                for order, min_count in enumerate(min_counts, start=2)])
+
+    def prune_rows(self, kept_rows):
+        """
+        Returns a copy of the store keeping only the given n-grams from bigrams up.
+
+        Unigrams are always kept, since they make up the vocabulary. An n-gram whose
+        context is pruned goes with it, so the trie stays consistent, and the rows left
+        are renumbered in order, which keeps every table sorted.
+
+        Args:
+            kept_rows (list): A boolean mask of the rows kept, for each order from bigrams
+                up to max_order.
+
+        Returns:
+            NGramStore: The pruned store, keeping the probabilities of the n-grams left.
+        """
+        size = len(self.vocabulary)
+        store = NGramStore(self.vocabulary, [self.keys[0]], [self.counts[0]])
+        store.probabilities = [np.asarray(self.probabilities[0])]
+        kept = np.ones(len(self.keys[0]), dtype=bool)
+        new_rows = np.arange(len(self.keys[0]), dtype=np.int64)
+        for order, order_kept in enumerate(kept_rows, start=2):
+            parents = self.parent_rows(order)
+            kept = kept[parents] & order_kept
+            store.keys.append(new_rows[parents[kept]] * size + self.word_ids(order)[kept])
+            store.counts.append(np.asarray(self.counts[order - 1])[kept])
+            store.probabilities.append(np.asarray(self.probabilities[order - 1])[kept])
+            new_rows = np.cumsum(kept) - 1
+        return store
+
+    def apply_delta(self, delta_counts):
+        """
+        Adds count changes to the counts of n-grams already in the store, in place.
+
+        Args:
+            delta_counts (list): The change of each n-gram count per order, keyed by
+                space separated n-grams.
+
+        Returns:
+            list: The rows whose count changed, per order, or None, leaving the store
+            untouched, if a change adds an n-gram or removes one, which needs the store
+            to be rebuilt.
+        """
+        changes = []
+        for order, n_gram_delta in enumerate(delta_counts, start=1):
+            n_grams = [n_gram for n_gram, count in n_gram_delta.items() if count != 0]
+            ids = np.array([self.vocabulary.get_id(word) for n_gram in n_grams
+                            for word in n_gram.split()], dtype=np.int64).reshape(-1, order)
+            rows = self.find_rows(ids) if len(ids) else np.zeros(0, dtype=np.int64)
+            values = np.fromiter((n_gram_delta[n_gram] for n_gram in n_grams), dtype=np.int64,
+                                 count=len(n_grams))
+            if np.any(rows < 0) or np.any(self.counts[order - 1][rows] + values <= 0):
+                return None
+            changes.append((rows, values))
+
+        for order, (rows, values) in enumerate(changes, start=1):
+            counts = np.array(self.counts[order - 1])
+            np.add.at(counts, rows, values)
+            self.counts[order - 1] = counts
+        return [rows for rows, _ in changes]
+
+    def n_grams(self, order):
+        """
+        Returns the space separated n-grams of an order, in row order.
+        """
+        words = self.vocabulary.words
+        if order == 1:
+            return list(words)
+
+        n_grams = [words[word_id] for word_id in self.word_ids(order).tolist()]
+        rows = self.parent_rows(order)
+        for lower in range(order - 1, 0, -1):
+            word_ids = self.word_ids(lower, rows).tolist()
+            n_grams = [f'{words[word_id]} {n_gram}' for word_id, n_gram in zip(word_ids, n_grams)]
+            if lower > 1:
+                rows = self.parent_rows(lower)[rows]
+        return n_grams
+
+    def parent_rows(self, order, rows=None):
+        """
+        Returns the row of each n-gram's context in the table of the order below, for
+        the given rows or all rows when None.
+        """
+        keys = self.keys[order - 1] if rows is None else self.keys[order - 1][rows]
+        return keys // len(self.vocabulary)
+
+    def word_ids(self, order, rows=None):
+        """
+        Returns the id of the last word of the n-grams of the given order.
+
+        Args:
+            order (int): The order of the n-grams.
+            rows (numpy.ndarray): The rows to be read, all rows when None.
+
+        Returns:
+            numpy.ndarray: The word id of each row.
+        """
+        keys = self.keys[order - 1] if rows is None else self.keys[order - 1][rows]
+        if order == 1:
+            return keys
+        return keys % len(self.vocabulary)
+
+    def successor_range(self, order, parent_row):
+        """
+        Returns the range of rows of the order table whose context is parent_row.
+
+        Args:
+            order (int): The order of the successor n-grams, at least 2.
+            parent_row (int): The row of the context in the order below.
+
+        Returns:
+            tuple: The first row and one past the last row of the successors.
+        """
+        keys = self.keys[order - 1]
+        size = len(self.vocabulary)
+        start, end = np.searchsorted(keys, [parent_row * size, (parent_row + 1) * size])
+        return int(start), int(end)
+
+    def nbytes(self):
+        """
+        Estimates the memory used by the store in bytes.
+
+        Returns:
+            int: The size of the arrays plus the size of the vocabulary.
+        """
+        size = sys.getsizeof(self.vocabulary.ids) + sys.getsizeof(self.vocabulary.words)
+        for word in self.vocabulary.words:
+            size += sys.getsizeof(word)
+        for arrays in (self.keys, self.counts, self.probabilities):
+            size += sum(array.nbytes for array in arrays)
+        return size
+
+
+class ProbabilityCache:
+    """
+    Computes the probabilities of one n-gram table on demand, keeping them in a bounded
+    LRU cache.
+
+    Rows are computed a block at a time with one vectorized call, so a lookup only costs
+    the blocks it touches for the first time, and memory grows with the blocks in use up
+    to max_blocks, after which the least recently used block is dropped. The cache is
+    indexed like the probability array it stands in for.
+
+    Attributes:
+        compute (callable): Given a slice of rows, returns the probabilities of the rows.
+        size (int): The number of rows of the table.
+        block_size (int): The number of rows computed and cached together.
+        max_blocks (int): The most blocks kept in the cache.
+        blocks (OrderedDict): The cached blocks, from least to most recently used.
+        hits (int): The number of block lookups answered from the cache.
+        misses (int): The number of block lookups that had to be computed.
+    """
+    def __init__(self, compute, size, block_size=4096, max_blocks=256):
+        self.compute = compute
+        self.size = size
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, rows):
+        """
+        Returns the probabilities of the given rows, computing any uncached blocks.
+
+        Args:
+            rows (numpy.ndarray or slice): The rows to be read.
+
+        Returns:
+            numpy.ndarray: The probability of each row.
+        """
+        if isinstance(rows, slice):
+            rows = np.arange(self.size)[rows]
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.empty(rows.shape)
+        if rows.size == 0:
+            return result
+
+        block_ids = rows // self.block_size
+        order = np.argsort(block_ids, kind='stable')
+        groups = np.split(order, np.flatnonzero(np.diff(block_ids[order])) + 1)
+        for group in groups:
+            block = int(block_ids[group[0]])
+            result[group] = self._get_block(block)[rows[group] - block * self.block_size]
+        return result
+
+    def _get_block(self, block):
+        """
+        Returns the probabilities of one block, from the cache or freshly computed.
+        """
+        values = self.blocks.get(block)
+        if values is not None:
+            self.hits += 1
+            self.blocks.move_to_end(block)
+            return values
+
+        self.misses += 1
+        start = block * self.block_size
+        values = self.compute(slice(start, min(start + self.block_size, self.size)))
+        self.blocks[block] = values
+        if len(self.blocks) > self.max_blocks:
+            self.blocks.popitem(last=False)
+        return values
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the cached probabilities in bytes.
+        """
+        return sum(values.nbytes for values in self.blocks.values())
+
+    def statistics(self):
+        """
+        Returns the hit, miss and occupancy statistics of the cache.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'cached_blocks': len(self.blocks),
+                'max_blocks': self.max_blocks, 'block_size': self.block_size}
+
+
+class QuantizedTable:
+    """
+    Holds a probability table as 8 or 16-bit codes into a small table of values.
+
+    The codebook is built with quantize when the model is built, and a lookup
+    dequantizes the rows it reads with one gather through it. The table is indexed like
+    the probability array it stands in for.
+
+    Attributes:
+        codes (numpy.ndarray): The uint8 or uint16 code of each row.
+        codebook (numpy.ndarray): The value of each code.
+    """
+    def __init__(self, codes, codebook):
+        self.codes = codes
+        self.codebook = codebook
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        """
+        Returns the dequantized values of the given rows.
+
+        Args:
+            rows (numpy.ndarray, slice or int): The rows to be read.
+
+        Returns:
+            numpy.ndarray: The value of each row.
+        """
+        return self.codebook[self.codes[rows]]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.codebook[self.codes].astype(dtype or self.codebook.dtype, copy=False)
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the codes and the codebook in bytes.
+        """
+        return self.codes.nbytes + self.codebook.nbytes
+
+    @classmethod
+    def quantize(cls, values, bits=8, iterations=20):
+        """
+        Quantizes a table of probabilities to at most 2**bits distinct values, keeping its
+        total probability mass.
+
+        A table with no more distinct values than codes is stored exactly. Otherwise the
+        positive values are split into cells along their logarithms, so the error on a
+        value is relative to its size, as its effect on perplexity is, and every code
+        stands for the arithmetic mean of its cell, so the rows of a code add up to the
+        mass they held before. The cells start out at the quantiles of the logarithms and
+        are refined with Lloyd's algorithm, the boundaries moving to the midpoints of the
+        logarithms of the codebook values. The lowest code stands for the smallest value
+        instead, losing a little mass, so that floor_codes can round any value down, and
+        zeros keep a code of their own.
+
+        Args:
+            values (numpy.ndarray): The non-negative values of the table.
+            bits (int): The size of a code, 8 or 16 bits.
+            iterations (int): The number of Lloyd iterations.
+
+        Returns:
+            QuantizedTable: The quantized table.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        dtype = {8: np.uint8, 16: np.uint16}[bits]
+        distinct = np.unique(values)
+        if len(distinct) <= 1 << bits:
+            return cls(np.searchsorted(distinct, values).astype(dtype), distinct)
+
+        positive = values > 0
+        zero_code = int(not positive.all())
+        logs = np.log(values[positive])
+        levels = (1 << bits) - zero_code
+        boundaries = np.unique(np.quantile(logs, np.arange(1, levels) / levels))
+        # one pass more than the iterations, so the codebook ends on the means of the cells
+        for _ in range(iterations + 1):
+            assigned = np.searchsorted(boundaries, logs, side='right')
+            _, assigned = np.unique(assigned, return_inverse=True)
+            codebook = (np.bincount(assigned, weights=values[positive])
+                        / np.bincount(assigned))
+            boundaries = (np.log(codebook[1:]) + np.log(codebook[:-1])) / 2
+
+        # the lowest code stands for the smallest value, so any value can be rounded down
+        codebook[0] = values[positive].min()
+        codes = np.zeros(len(values), dtype=dtype)
+        codes[positive] = assigned + zero_code
+        return cls(codes, np.concatenate(([0.0] * zero_code, codebook)))
+
+    def floor_codes(self, values):
+        """
+        Returns the code of the largest codebook value not above each value, which every
+        positive value of the quantized table has.
+
+        Args:
+            values (numpy.ndarray): Exact values of the table.
+
+        Returns:
+            numpy.ndarray: The code of each value.
+        """
+        return (np.searchsorted(self.codebook, values, side='right') - 1).astype(self.codes.dtype)
@@ -0,0 +1,132 @@
+"""
+Prunes the Kneser-Ney model, by count cutoffs or by relative entropy, down to a target
+size, or quantizes its tables, and reports the size of the smaller models against their
+perplexity on the test set.
+
+Examples:
+    python pruning.py --min-counts 2 3 --thresholds 1e-8 1e-7 1e-6
+    python pruning.py --quantize-bits 8 16
+    python pruning.py --target-bytes 2000000 1000000 --output ../documentation/pruning.json
+"""
+import argparse
+import json
+import os
+import numpy as np
+from dataset_functions import MAX_ORDER, splitting_datasets, split_exists
+from evaluation import held_out_probabilities
+from kneser_ney import KneserNeyLM
+
+def entropy_threshold_for_size(model, target_bytes):
+    """ Finds the relative entropy threshold pruning a model to about target_bytes.
+
+    The n-grams are kept in order of their relative entropy, as many as fit in the target
+    at the full model's average model file bytes per n-gram, so the pruned model file
+    comes out close to the target rather than exactly on it.
+
+    Parameters:
+    model (KneserNeyLM): The full, unpruned model.
+    target_bytes (int): The size of the pruned model file aimed at.
+
+    Returns:
+    float: The threshold, 0 if the full model already fits and infinity if only the
+    unigrams do.
+    """
+    entropies = np.concatenate(model.pruning_entropies())
+    rows = len(model.store.keys[0]) + len(entropies)
+    kept = int(target_bytes / (os.path.getsize(model.model_path) / rows)) - len(model.store.keys[0])
+    if kept >= len(entropies):
+        return 0.0
+    if kept <= 0:
+        return float('inf')
+    return float(np.partition(entropies, len(entropies) - kept)[len(entropies) - kept])
+
+def model_bytes(model):
+    """ Estimates the memory used by a model's tables.
+
+    Parameters:
+    model (LanguageModel): The model.
+
+    Returns:
+    int: The size of its store, interpolation table and extra tables.
+    """
+    size = model.store.nbytes() + sum(array.nbytes for array in model._extra_tables().values())
+    if model.interpolated is not None:
+        size += model.interpolated.nbytes
+    return size
+
+def pruning_report(min_counts=(), thresholds=(), target_bytes=(), quantize_bits=(),
+                   max_order=MAX_ORDER, split='test'):
+    """ Builds pruned and quantized Kneser-Ney models and reports their size against their
+    perplexity.
+
+    The perplexity is the per-word perplexity of the highest order, over every word of
+    the split, so it is comparable between models whatever their number of n-grams.
+
+    Parameters:
+    min_counts (list): The count cutoffs to prune with, each an int or one per order.
+    thresholds (list): The relative entropy thresholds to prune with.
+    target_bytes (list): The model file sizes to prune to by relative entropy.
+    quantize_bits (list): The code sizes to quantize the unpruned model's tables to.
+    max_order (int): The highest n-gram order of the models.
+    split (str): The side of the split perplexity is measured on.
+
+    Returns:
+    list: One dictionary per model, the full model first, holding how it was pruned and
+    quantized, its number of n-grams per order, its model file size, the memory used by
+    its tables and its perplexity.
+    """
+    full_model = KneserNeyLM(max_order=max_order)
+    models = [('none', full_model)]
+    models += [(f'quantize_bits={bits}', KneserNeyLM(max_order=max_order, quantize_bits=bits))
+               for bits in quantize_bits]
+    models += [(f'min_counts={counts}', KneserNeyLM(max_order=max_order, min_counts=counts))
+               for counts in min_counts]
+    thresholds = list(thresholds) + [entropy_threshold_for_size(full_model, target)
+                                     for target in target_bytes]
+    models += [(f'entropy_threshold={threshold:g}',
+                KneserNeyLM(max_order=max_order, entropy_threshold=threshold))
+               for threshold in thresholds]
+
+    report = []
+    for pruning, model in models:
+        probabilities = held_out_probabilities(model, split)[-1]
+        report.append({
+            'pruning': pruning,
+            'n_grams': [len(keys) for keys in model.store.keys],
+            'bytes': os.path.getsize(model.model_path),
+            'memory_bytes': model_bytes(model),
+            'perplexity': float(np.exp(-np.log(probabilities).mean())),
+        })
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--min-counts', type=int, nargs='*', default=[],
+                        help="count cutoffs, each applied to every order from bigrams up")
+    parser.add_argument('--thresholds', type=float, nargs='*', default=[],
+                        help="relative entropy thresholds")
+    parser.add_argument('--target-bytes', type=int, nargs='*', default=[],
+                        help="model file sizes to prune to by relative entropy")
+    parser.add_argument('--quantize-bits', type=int, nargs='*', default=[], choices=(8, 16),
+                        help="code sizes to quantize the probability tables to")
+    parser.add_argument('--max-order', type=int, default=MAX_ORDER)
+    parser.add_argument('--output', default='../documentation/pruning.json')
+    arguments = parser.parse_args()
+
+    if not split_exists():
+        print("Splitting the data sets...")
+        splitting_datasets()
+
+    results = pruning_report(arguments.min_counts, arguments.thresholds, arguments.target_bytes,
+                             arguments.quantize_bits, arguments.max_order)
+    full_size, full_perplexity = results[0]['bytes'], results[0]['perplexity']
+    for result in results:
+        print(f"{result['pruning']:>28}: {result['bytes'] / 1e6:8.2f} MB "
+              f"({result['bytes'] / full_size:6.1%}), "
+              f"{result['memory_bytes'] / 1e6:8.2f} MB in memory, "
+              f"perplexity {result['perplexity']:9.2f} "
+              f"({result['perplexity'] / full_perplexity - 1:+.1%})")
+
+    with open(arguments.output, 'w', encoding='utf-8') as fp:
+        json.dump(results, fp, indent=4)
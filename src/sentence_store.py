@@ -0,0 +1,244 @@
+"""
+Implements the pre-tokenized, array backed sentence storage of the corpus.
+"""
+import os
+from array import array
+import numpy as np
+from ngram_store import Vocabulary
+
+
+class SentenceStore:
+    """
+    Stores sentences as one flat array of word ids with the offset each sentence starts at.
+
+    Sentence i is made of the ids tokens[offsets[i]:offsets[i + 1]], so a store of any size
+    is two arrays and a vocabulary, and a saved store is memory-mapped back without being
+    parsed.
+
+    Attributes:
+        vocabulary (Vocabulary): The word of each id.
+        tokens (numpy.ndarray): The int32 word ids of every sentence, one after the other.
+        offsets (numpy.ndarray): The int64 start of every sentence, plus the total length.
+    """
+    def __init__(self, vocabulary=None, tokens=None, offsets=None):
+        self.vocabulary = vocabulary if vocabulary is not None else Vocabulary()
+        self.tokens = tokens if tokens is not None else array('i')
+        self.offsets = offsets if offsets is not None else array('q', [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def add(self, words):
+        """
+        Appends a sentence to a store being built.
+
+        Args:
+            words (list): The words of the sentence.
+
+        Returns:
+            int: The index of the sentence.
+        """
+        self.tokens.extend(self.vocabulary.add(word) for word in words)
+        self.offsets.append(len(self.tokens))
+        return len(self) - 1
+
+    def sentence_ids(self, index):
+        """
+        Returns the word ids of one sentence.
+        """
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]]
+
+    def words(self, index):
+        """
+        Returns the words of one sentence.
+        """
+        return [self.vocabulary.words[word_id] for word_id in self.sentence_ids(index)]
+
+    def iter_words(self, indices=None):
+        """
+        Yields the words of the given sentences, all of them by default.
+
+        Args:
+            indices (iterable): The indices of the sentences, in the order wanted.
+
+        Returns:
+            generator: The list of words of each sentence.
+        """
+        for index in range(len(self)) if indices is None else indices:
+            yield self.words(index)
+
+    def save(self, directory):
+        """
+        Saves the store as tokens.npy, offsets.npy and vocabulary.txt in a directory.
+
+        Args:
+            directory (str): The directory to write to, created if needed.
+
+        Returns:
+            None
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'tokens.npy'), np.asarray(self.tokens, dtype=np.int32))
+        np.save(os.path.join(directory, 'offsets.npy'), np.asarray(self.offsets, dtype=np.int64))
+        with open(os.path.join(directory, 'vocabulary.txt'), 'w', encoding='utf-8') as fp:
+            fp.write("\n".join(self.vocabulary.words))
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Memory-maps a store saved by save.
+
+        Args:
+            directory (str): The directory holding the store.
+
+        Returns:
+            SentenceStore: The store, its arrays mapped read-only.
+        """
+        with open(os.path.join(directory, 'vocabulary.txt'), 'r', encoding='utf-8') as fp:
+            text = fp.read()
+        vocabulary = Vocabulary(text.split("\n") if text else ())
+        tokens = np.load(os.path.join(directory, 'tokens.npy'), mmap_mode='r')
+        offsets = np.load(os.path.join(directory, 'offsets.npy'), mmap_mode='r')
+        return cls(vocabulary, tokens, offsets)
+
+    @staticmethod
+    def exists(directory):
+        """
+        Returns whether a store has been saved in a directory.
+        """
+        return all(os.path.exists(os.path.join(directory, name))
+                   for name in ('tokens.npy', 'offsets.npy', 'vocabulary.txt'))
+
+
+class SentenceStoreWriter:
+    """
+    Builds a sentence store straight into its directory, for stores too large to be held
+    in memory while they are built.
+
+    Sentences are added as to a SentenceStore, and their ids and offsets appended to the
+    store's files whenever buffer_size tokens have gathered, so only the vocabulary and
+    one buffer are kept in memory. The store can be loaded with SentenceStore.load once
+    the writer is closed.
+
+    Attributes:
+        directory (str): The directory the store is written to.
+        vocabulary (Vocabulary): The word of each id.
+        buffer_size (int): The number of tokens gathered before they are written.
+    """
+    def __init__(self, directory, buffer_size=1 << 20):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.vocabulary = Vocabulary()
+        self.buffer_size = buffer_size
+        self.token_file = ArrayWriter(os.path.join(directory, 'tokens.npy'), np.int32)
+        self.offset_file = ArrayWriter(os.path.join(directory, 'offsets.npy'), np.int64)
+        self.tokens = array('i')
+        self.offsets = array('q', [0])
+        self.written_tokens = 0
+        self.sentences = 0
+
+    def __len__(self):
+        return self.sentences
+
+    def add(self, words):
+        """
+        Appends a sentence to the store.
+
+        Args:
+            words (list): The words of the sentence.
+
+        Returns:
+            int: The index of the sentence.
+        """
+        self.tokens.extend(self.vocabulary.add(word) for word in words)
+        self.offsets.append(self.written_tokens + len(self.tokens))
+        self.sentences += 1
+        if len(self.tokens) >= self.buffer_size:
+            self._flush()
+        return self.sentences - 1
+
+    def _flush(self):
+        """
+        Appends the buffered tokens and offsets to the store's files.
+        """
+        self.token_file.append(self.tokens)
+        self.offset_file.append(self.offsets)
+        self.written_tokens += len(self.tokens)
+        self.tokens = array('i')
+        self.offsets = array('q')
+
+    def close(self):
+        """
+        Writes the last buffered sentences and the vocabulary, completing the store.
+
+        Returns:
+            None
+        """
+        self._flush()
+        self.token_file.close()
+        self.offset_file.close()
+        with open(os.path.join(self.directory, 'vocabulary.txt'), 'w', encoding='utf-8') as fp:
+            fp.write("\n".join(self.vocabulary.words))
+
+
+class ArrayWriter:
+    """
+    Writes a NumPy .npy file piece by piece, for arrays produced in parts and too large to
+    be gathered in memory first.
+
+    The pieces are appended to a raw .part file next to the .npy file, which close turns
+    into the .npy file, copying it a block at a time once the shape is known.
+
+    Attributes:
+        path (str): The path of the .npy file.
+        dtype (numpy.dtype): The type of the values.
+        columns (int): The number of values of each row, None for a flat array.
+        size (int): The number of values written so far.
+    """
+    def __init__(self, path, dtype, columns=None):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.columns = columns
+        self.size = 0
+        self.file = open(path + '.part', 'wb')
+
+    def append(self, values):
+        """
+        Appends values, or rows of values, to the array.
+
+        Args:
+            values (array_like): The values, converted to the array's type.
+
+        Returns:
+            None
+        """
+        values = np.asarray(values, dtype=self.dtype)
+        values.tofile(self.file)
+        self.size += values.size
+
+    def close(self, block_size=1 << 24):
+        """
+        Completes the .npy file and removes the raw file.
+
+        Args:
+            block_size (int): The number of values copied at a time.
+
+        Returns:
+            None
+        """
+        self.file.close()
+        shape = (self.size,) if self.columns is None else (self.size // self.columns,
+                                                           self.columns)
+        if self.size == 0:
+            np.save(self.path, np.zeros(shape, dtype=self.dtype))
+        else:
+            saved = np.lib.format.open_memmap(self.path, mode='w+', dtype=self.dtype,
+                                              shape=shape)
+            values = saved.reshape(-1)
+            with open(self.file.name, 'rb') as fp:
+                for start in range(0, self.size, block_size):
+                    block = np.fromfile(fp, dtype=self.dtype, count=block_size)
+                    values[start:start + len(block)] = block
+            saved.flush()
+            del saved, values
+        os.remove(self.file.name)
@@ -0,0 +1,371 @@
+"""
+Serves the language models over HTTP, on a TCP port or a Unix socket.
+
+The models are loaded once when the server starts, and every request is answered from
+memory. Sentence scoring requests arriving together are micro-batched: each model has a
+queue whose requests are collected for up to max_wait seconds, or until max_batch_size
+sentences are waiting, and then scored with a single vectorized batch call.
+
+Endpoints, all taking and returning JSON:
+    GET  /health       The names of the loaded models.
+    POST /probability  {"model", "sentence", "choice"}: the sentence's log probability.
+    POST /perplexity   {"model", "sentences"}: the average per-sentence perplexities.
+    POST /generate     {"model", "phrase" or "phrases", "choice", "mode", "seed", ...}: a
+                       completion of the phrase, or of each phrase, decoded together.
+"""
+import argparse
+import asyncio
+import json
+import math
+import sys
+import numpy as np
+from dataset_functions import splitting_datasets, split_exists
+from decoding import Decoder
+from model_set import MODEL_CLASSES, ModelSet
+CHOICES = ('1', '2', '3', '4')
+# the JSON types accepted for each decoding option of a /generate request
+OPTION_TYPES = {'mode': (str,), 'beam_width': (int,), 'top_k': (int,), 'top_p': (int, float),
+                'max_words': (int,), 'seed': (int, type(None)),
+                'length_penalty': (int, float), 'min_words': (int,)}
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error'}
+
+class RequestError(Exception):
+    """
+    An invalid request, answered with the given HTTP status.
+    """
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class MicroBatcher:
+    """
+    Collects the sentences submitted to one model and scores them in batches.
+
+    Attributes:
+        model (LanguageModel): The model scoring the sentences.
+        max_batch_size (int): The most sentences scored by one batch call.
+        max_wait (float): The longest time in seconds a sentence waits for others to join
+            its batch.
+        queue (asyncio.Queue): The sentences waiting to be scored, with their futures.
+        lock (asyncio.Lock): Held while the model runs in the executor, by the batch loop
+            and by generation, as the model's probability caches are not thread-safe.
+    """
+    def __init__(self, model, max_batch_size=64, max_wait=0.005):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.lock = asyncio.Lock()
+
+    async def score(self, sentence):
+        """
+        Scores one sentence as part of the next batch.
+
+        Args:
+            sentence (str): The sentence to be scored.
+
+        Returns:
+            tuple: The unigram, bigram, trigram and linear interpolation log probabilities
+            of the sentence, and its number of scored words.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((sentence, future))
+        return await future
+
+    async def run(self):
+        """
+        Scores the queued sentences batch after batch, for as long as the server runs.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            sentences = [sentence for sentence, _ in batch]
+            try:
+                async with self.lock:
+                    log_probabilities, lengths = await loop.run_in_executor(
+                        None, self.model.batch_log_probabilities, sentences)
+            except Exception as error:  # pylint: disable=broad-except
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            for index, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result((log_probabilities[:, index].tolist(), int(lengths[index])))
+
+class ScoringService:
+    """
+    Answers the scoring, perplexity and generation requests for a set of loaded models.
+
+    Attributes:
+        models (dict): The loaded language models, keyed by name.
+        batchers (dict): The micro-batcher of each model, keyed by name.
+    """
+    def __init__(self, models, max_batch_size=64, max_wait=0.005):
+        self.models = models
+        self.batchers = {name: MicroBatcher(model, max_batch_size, max_wait)
+                         for name, model in models.items()}
+        self.tasks = []
+
+    def start(self):
+        """
+        Starts the batch loop of every model on the running event loop.
+        """
+        self.tasks = [asyncio.ensure_future(batcher.run()) for batcher in self.batchers.values()]
+
+    def _model_name(self, request):
+        name = request.get('model', 'vanilla')
+        if name not in self.models:
+            raise RequestError(f"unknown model {name!r}, expected one of {sorted(self.models)}")
+        return name
+
+    def _choice(self, request):
+        choice = str(request.get('choice', '4'))
+        if choice not in CHOICES:
+            raise RequestError(f"unknown n-gram choice {choice!r}, expected one of {CHOICES}")
+        return choice
+
+    def _options(self, request):
+        options = {key: request[key] for key in OPTION_TYPES if key in request}
+        for key, value in options.items():
+            if isinstance(value, bool) or not isinstance(value, OPTION_TYPES[key]):
+                raise RequestError(f"{key!r} must be of type "
+                                   f"{' or '.join(kind.__name__ for kind in OPTION_TYPES[key])}")
+        return options
+
+    async def probability(self, request):
+        """
+        Scores one sentence.
+
+        Returns:
+            dict: The sentence's natural log probability, its probability and the number of
+            words scored.
+        """
+        name = self._model_name(request)
+        choice = self._choice(request)
+        sentence = request.get('sentence')
+        if not isinstance(sentence, str):
+            raise RequestError("'sentence' must be a string")
+
+        log_probabilities, length = await self.batchers[name].score(sentence)
+        log_probability = log_probabilities[CHOICES.index(choice)]
+        return {'model': name, 'choice': choice,
+                'log_probability': finite_or_none(log_probability),
+                'probability': math.exp(log_probability), 'words': length}
+
+    async def perplexity(self, request):
+        """
+        Calculates the average per-sentence perplexities of a list of sentences, as
+        model_perplexity does.
+
+        Returns:
+            dict: The unigram, bigram, trigram and linear interpolation perplexities, null
+            where a sentence has probability 0 and the perplexity is infinite.
+        """
+        name = self._model_name(request)
+        sentences = request.get('sentences')
+        if (not isinstance(sentences, list) or not sentences
+                or not all(isinstance(sentence, str) for sentence in sentences)):
+            raise RequestError("'sentences' must be a non-empty list of strings")
+
+        scores = await asyncio.gather(*(self.batchers[name].score(sentence)
+                                        for sentence in sentences))
+        sums = np.zeros(len(CHOICES))
+        for log_probabilities, length in scores:
+            if length > 0:
+                sums += np.exp(-np.array(log_probabilities) / length)
+        perplexities = (sums / len(sentences)).tolist()
+        return {'model': name, 'perplexities': [finite_or_none(value) for value in perplexities]}
+
+    async def generate(self, request):
+        """
+        Completes a phrase, or a list of phrases decoded together, with the decoding mode
+        and parameters of decoding.Decoder given in the request.
+
+        Returns:
+            dict: The completed sentence, or the list of completed sentences.
+        """
+        name = self._model_name(request)
+        choice = self._choice(request)
+        phrases = request.get('phrases', [request.get('phrase', '')])
+        if (not isinstance(phrases, list)
+                or not all(isinstance(phrase, str) for phrase in phrases)):
+            raise RequestError("'phrase' must be a string and 'phrases' a list of strings")
+
+        try:
+            decoder = Decoder(self.models[name], choice, **self._options(request))
+        except ValueError as error:
+            raise RequestError(str(error)) from error
+        # decoded off the event loop, under the lock the model's batch loop also holds
+        async with self.batchers[name].lock:
+            completions = await asyncio.get_running_loop().run_in_executor(
+                None, decoder.generate, phrases)
+        texts = [" ".join(words) for words in completions]
+
+        response = {'model': name, 'choice': choice, 'mode': decoder.mode}
+        if 'phrases' in request:
+            response['texts'] = texts
+        else:
+            response['text'] = texts[0]
+        return response
+
+    async def dispatch(self, method, path, body):
+        """
+        Routes one request to its endpoint.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The request path.
+            body (bytes): The request body.
+
+        Returns:
+            dict: The response.
+        """
+        if path == '/health':
+            return {'status': 'ok', 'models': sorted(self.models)}
+
+        endpoints = {'/probability': self.probability, '/perplexity': self.perplexity,
+                     '/generate': self.generate}
+        if path not in endpoints:
+            raise RequestError(f"unknown endpoint {path}", 404)
+        if method != 'POST':
+            raise RequestError(f"{path} only accepts POST", 405)
+
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError as error:
+            raise RequestError(f"invalid JSON: {error}") from error
+        if not isinstance(request, dict):
+            raise RequestError("the request body must be a JSON object")
+        return await endpoints[path](request)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers the HTTP/1.1 requests of one connection, keeping it alive between them.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    break
+                method, path, _ = parts
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    status, response = 200, await self.dispatch(method, path.split('?')[0], body)
+                except RequestError as error:
+                    status, response = error.status, {'error': str(error)}
+                except Exception as error:  # pylint: disable=broad-except
+                    status, response = 500, {'error': str(error)}
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                payload = json.dumps(response).encode('utf-8')
+                writer.write((f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                              "Content-Type: application/json\r\n"
+                              f"Content-Length: {len(payload)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                              "\r\n").encode('latin-1') + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+def finite_or_none(value):
+    """ Returns a float, or None in its place if it is infinite or not a number, which JSON
+    cannot represent.
+    """
+    return value if math.isfinite(value) else None
+
+def load_models(names, lazy=False):
+    """ Loads the named language models once, for the lifetime of the server, the models
+    built from the same counts sharing one copy of them.
+
+    Parameters:
+    names (list): The names of the models to be loaded.
+    lazy (bool): Whether the models compute their probabilities on demand.
+
+    Returns:
+    dict: The loaded models, keyed by name.
+    """
+    if not split_exists():
+        print("Splitting the data sets...", file=sys.stderr)
+        splitting_datasets()
+
+    return ModelSet(names, lazy).models
+
+async def serve(service, host='127.0.0.1', port=8000, unix_socket=None):
+    """ Runs the scoring server until it is cancelled.
+
+    Parameters:
+    service (ScoringService): The service answering the requests.
+    host (str): The address listened on.
+    port (int): The TCP port listened on.
+    unix_socket (str): The path of a Unix socket to listen on instead of a TCP port.
+
+    Returns:
+        None
+    """
+    service.start()
+    if unix_socket:
+        server = await asyncio.start_unix_server(service.handle_connection, path=unix_socket)
+        print(f"Serving on {unix_socket}")
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        print(f"Serving on http://{host}:{port}")
+
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix-socket', help="listen on this Unix socket instead of a port")
+    parser.add_argument('--models', nargs='+', choices=sorted(MODEL_CLASSES),
+                        default=['vanilla', 'laplace', 'unk'])
+    parser.add_argument('--max-batch-size', type=int, default=64,
+                        help="the most sentences scored by one batch call")
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help="how long a sentence waits for others to join its batch")
+    parser.add_argument('--lazy', action='store_true',
+                        help="compute probabilities on demand instead of at startup")
+    arguments = parser.parse_args()
+
+    print("Loading the models...")
+    scoring_service = ScoringService(load_models(arguments.models, arguments.lazy),
+                                     arguments.max_batch_size, arguments.max_wait_ms / 1000)
+    try:
+        asyncio.run(serve(scoring_service, arguments.host, arguments.port,
+                          arguments.unix_socket))
+    except KeyboardInterrupt:
+        pass
@@ -1,183 +1,136 @@
 """
 Implementation of the unk language model.
 """
-import xml.etree.ElementTree as ET
-from collections import defaultdict
-import json
-import os
 import sys
+import numpy as np
 from vanilla import VanillaLM
-from dataset_functions import handle_sentence, handle_sentence_unk
+from dataset_functions import (MAX_ORDER, TRAINING_COUNTS_PATH, counts_files, counts_path,
+                               get_training_counts, remap_unknown_counts, new_counts,
+                               write_counts)
 
 class UnkLM(VanillaLM):
-    def __init__(self):
-        super().__init__()
-        self.vocabulary = set(self.uni_count)
+    counts_directory = 'n_grams/unk'
+    unknown_threshold = 2
 
-    def _defualt_uni_value(self):
-        return float(1 / sum(self.uni_count.values()) + len(self.uni_count))
-
-    def _get_counts(self):
+    def __init__(self, lazy=False, cache_blocks=256, threshold=2, interpolation_weights=None,
+                 max_order=MAX_ORDER, min_counts=None, shared_stores=None, quantize_bits=None):
         """
-        Loads the n-gram counts from JSON files if they exist, otherwise generates the counts.
+        Initializes the <UNK> model for the given unknown word threshold.
 
-        If the JSON files for 1-gram, 2-gram, and 3-gram counts exist in the 'n_grams/unk'
-        directory, this method loads the counts from the files and assigns them to the 
-        corresponding instance variables. If the files do not exist, it calls the 
-        '_generate_counts' method to generate the counts.
+        Models of other thresholds than the default keep their counts and model file in
+        their own n_grams/unk_<threshold> directory, all derived from the same training
+        set counts.
 
         Args:
-            None
+            lazy (bool): Whether to compute probabilities on demand.
+            cache_blocks (int): The most probability blocks cached per order in lazy mode.
+            threshold (int): The highest training count for which a word is <UNK>.
+            interpolation_weights (tuple): The linear interpolation weight of each order.
+            max_order (int): The highest n-gram order, at least 3.
+            min_counts (int or tuple): The minimum count of the n-grams kept, from bigrams up.
+            shared_stores (dict): The stores shared between models, keyed by counts directory.
+            quantize_bits (int): The size of the codes to quantize the tables to, 8 or 16 bits.
+        """
+        if threshold != UnkLM.unknown_threshold:
+            self.unknown_threshold = threshold
+            self.counts_directory = f'n_grams/unk_{threshold}'
+        super().__init__(lazy, cache_blocks, interpolation_weights, max_order, min_counts,
+                         shared_stores, quantize_bits)
+        self.vocabulary = self.store.vocabulary
 
-        Returns:
-            None
+    def model_arguments(self):
+        return dict(super().model_arguments(), threshold=self.unknown_threshold)
+
+    def _is_current(self, path, sources=()):
+        """
+        Checks that a file built from the <UNK> counts is also newer than the training set
+        counts they are derived from.
         """
-        if not (os.path.exists('n_grams/unk/1_gram_counts.json')
-                and os.path.exists('n_grams/unk/2_gram_counts.json')
-                and os.path.exists('n_grams/unk/3_gram_counts.json')):
-            self._generate_counts()
-
-        with open("n_grams/unk/1_gram_counts.json", 'r', encoding='utf-8') as fp:
-            self.uni_count = json.load(fp)
-        with open("n_grams/unk/2_gram_counts.json", 'r', encoding='utf-8') as fp:
-            self.bi_count = json.load(fp)
-        with open("n_grams/unk/3_gram_counts.json", 'r', encoding='utf-8') as fp:
-            self.tri_count = json.load(fp)
+        training_paths = counts_files(counts_path(TRAINING_COUNTS_PATH, self.max_order),
+                                      self.max_order)
+        return super()._is_current(path, list(sources) + training_paths)
+
+    def _load_counts(self):
+        """
+        Loads the <UNK> counts, generating them again first if the training set counts
+        changed since they were saved, as update_training_counts changes them.
+        """
+        count_paths = counts_files(self.counts_directory, self.max_order)
+        if all(self._is_current(path) for path in count_paths):
+            return super()._load_counts()
+        counts = self._generate_counts()
+        write_counts(counts, self.counts_directory)
+        return counts
 
     def _generate_counts(self):
         """
-        Generate n-gram counts and save them to JSON files.
+        Generate the <UNK> n-gram counts of the training set.
 
-        This function iterates over a range of word counts (1 to 3) and generates n-gram counts
-        based on the sentences in the training_set.xml file. The n-gram counts are then saved
-        to separate JSON files for each word count.
+        The counts are derived from the training set counts shared with the vanilla and
+        laplace models, replacing every token seen at most unknown_threshold times with
+        <UNK> through an id remap table, so the training set is not counted again.
 
         Args:
             self: The instance of the language model.
 
         Returns:
-            None
+            list: The n-gram counts per order.
         """
-        n_gram_counts = defaultdict(int)
-        tree = ET.parse('../data/training_set.xml')
-        root = tree.getroot()
-        for child in root:
-            handle_sentence(child, 1, n_gram_counts)
-
-        unknown_tokens = {key for key, count in n_gram_counts.items() if count <= 2}
-
-        # Generate real counts:
-        for number_of_words in range(1, 4):
-            n_gram_counts = defaultdict(int)
-            for child in root:
-                handle_sentence_unk(child, number_of_words, n_gram_counts, unknown_tokens)
-
-            with open(f'n_grams/unk/{number_of_words}_gram_counts.json',
-                    'w', encoding='utf-8') as fp:
-                json.dump(n_gram_counts, fp, indent=4)
-
-    def _generate_unigram_probs(self):
-        total_tokens = float(sum(self.uni_count.values()))
-        for key in self.uni_count:
-            self.uni_probabilities[key] = ((self.uni_count[key] + 1)
-                                           / (total_tokens + len(self.uni_count)))
-
-    def _generate_bigram_probs(self):
-        for key in self.bi_count:
-            words = tuple(key.split())
-            self.bi_probabilities[words] = ((self.bi_count[key] + 1)
-                                            / (self.uni_count[words[0]] + len(self.uni_count)))
-
-    def _generate_trigram_probs(self):
-        for key in self.tri_count:
-            words = tuple(key.split())
-            bi_gram_key = words[0] + " " + words[1]
-            self.tri_probabilities[words] = ((self.tri_count[key] + 1)
-                                             / (self.bi_count[bi_gram_key] + len(self.uni_count)))
-
-    def _get_bigram_probability(self, bigram):
-        return self.bi_probabilities.get(bigram,
-                                         1 / (self.uni_count.get(bigram[0], 1)
-                                              + len(self.uni_count)))
-
-    def _get_trigram_probability(self, trigram):
-        return self.tri_probabilities.get(trigram,
-                                          1 / (self.bi_count.get(trigram[:2], 1)
-                                               + len(self.uni_count)))
-
-    def text_generator(self, sentence, choice):
-        sentence = self._remove_punctuation(sentence)
-        sentence = sentence.lower().split()
-        for index, word in enumerate(sentence):
-            if word not in self.vocabulary:
-                sentence[index] = "<UNK>"
-        return super().text_generator(sentence, choice)
+        return remap_unknown_counts(get_training_counts(self.max_order), self.unknown_threshold)
+
+    def _unigram_formula(self, counts):
+        return (counts + 1) / (self.total_tokens + len(self.store.vocabulary))
+
+    def _ngram_formula(self, counts, context_counts):
+        return (counts + 1) / (context_counts + len(self.store.vocabulary))
+
+    def _unseen_bigram_probs(self, first_ids):
+        first_counts = np.where(first_ids >= 0, self.store.counts[0][first_ids], 1)
+        return 1 / (first_counts + len(self.store.vocabulary))
+
+    def _unseen_trigram_probs(self, context_rows):
+        # unseen trigrams are smoothed as if their context had been seen once
+        return np.full(len(context_rows), 1 / (1 + len(self.store.vocabulary)))
+
+    def _map_count_delta(self, delta_counts):
+        """
+        Maps training count changes onto the <UNK> counts.
+
+        Words outside the model's vocabulary are replaced by <UNK>. Words whose count
+        crosses the unknown threshold keep their current mapping until the counts are
+        regenerated.
+        """
+        mapped = new_counts(len(delta_counts))
+        for n_gram_delta, remapped in zip(delta_counts, mapped):
+            for n_gram, count in n_gram_delta.items():
+                words = [word if word in self.store.vocabulary else "<UNK>"
+                         for word in n_gram.split()]
+                remapped[" ".join(words)] += count
+        return mapped
+
+    def _refresh_probabilities(self, changed_rows):
+        self.vocabulary = self.store.vocabulary
+        super()._refresh_probabilities(changed_rows)
+
+    def _save_counts(self):
+        write_counts(self._count_tables(), self.counts_directory)
+
+    def _to_ids(self, words):
+        """
+        Maps words to vocabulary ids, words outside the vocabulary mapping to <UNK>.
+        """
+        ids = super()._to_ids(words)
+        ids[ids < 0] = self.store.vocabulary.get_id("<UNK>")
+        return ids
 
     def uni_sentence_probability(self, words):
-        words = self._remove_punctuation(words.lower())
-        words = words.split()
-        for index, word in enumerate(words):
-            if word not in self.vocabulary:
-                words[index] = "<UNK>"
         return max(super().uni_sentence_probability(words), sys.float_info.min)
 
     def bi_sentence_probability(self, words):
-        words = self._remove_punctuation(words.lower())
-        words = ["<s>"] + words.split() + ["</s>"]
-        for index, word in enumerate(words):
-            if word not in self.vocabulary:
-                words[index] = "<UNK>"
         return max(super().bi_sentence_probability(words), sys.float_info.min)
 
     def tri_sentence_probability(self, words):
-        words = self._remove_punctuation(words.lower())
-        words = ["<s>", "<s>"] + words.split() + ["</s>"]
-        for index, word in enumerate(words):
-            if word not in self.vocabulary:
-                words[index] = "<UNK>"
         return max(super().tri_sentence_probability(words), sys.float_info.min)
 
     def sentence_probability(self, words):
-        words = self._remove_punctuation(words.lower())
-        words = ["<s>", "<s>"] + words.split() + ["</s>"]
-        for index, word in enumerate(words):
-            if word not in self.vocabulary:
-                words[index] = "<UNK>"
         return max(super().sentence_probability(words), sys.float_info.min)
-
-    def calculate_space_needed(self):
-        size = sys.getsizeof(self.uni_count)        
-        for key, value in self.uni_count.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-
-        size += sys.getsizeof(self.bi_count)
-        for key, value in self.bi_count.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-
-        size += sys.getsizeof(self.tri_count)
-        for key, value in self.tri_count.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-
-        size += sys.getsizeof(self.uni_probabilities)
-        for key, value in self.uni_probabilities.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-
-        size += sys.getsizeof(self.bi_probabilities)
-        for key, value in self.bi_probabilities.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-
-        size += sys.getsizeof(self.tri_probabilities)
-        for key, value in self.tri_probabilities.items():
-            size += sys.getsizeof(key)
-            size += sys.getsizeof(value)
-
-        size += sys.getsizeof(self.vocabulary)
-        for key in self.vocabulary:
-            size += sys.getsizeof(key)
-            
-        print(size)
\ No newline at end of file
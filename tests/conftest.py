@@ -0,0 +1,68 @@
+"""
+Shared fixtures of the test suite.
+
+The models read and write their data relative to the src directory, as the scripts run
+from it, so every test runs from the src directory of a temporary copy of the data
+layout, holding a small synthetic corpus instead of the real one.
+"""
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+WORDS = ("the a man woman dog cat saw heard liked the old young big small house garden "
+         "park street in on near and but quickly slowly very").split()
+RARE_WORDS = "zebra quartz violin".split()
+
+def write_corpus_file(path, sentences):
+    """ Writes sentences to an XML file laid out like the corpus files.
+    """
+    with open(path, 'w', encoding='utf-8') as fp:
+        fp.write('<bncDoc><text><p>')
+        for sentence in sentences:
+            fp.write('<s>' + ''.join(f'<w>{word} </w>' for word in sentence)
+                     + '<c c5="PUN">.</c></s>')
+        fp.write('</p></text></bncDoc>')
+
+def random_sentences(rng, count, words=WORDS):
+    """ Draws sentences of 3 to 9 words, capitalised as corpus sentences are.
+    """
+    sentences = []
+    for _ in range(count):
+        sentence = list(rng.choice(words, size=rng.integers(3, 10)))
+        sentence[0] = sentence[0].capitalize()
+        sentences.append(sentence)
+    return sentences
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """ Creates a corpus of two files per corpus directory and runs the test from the
+    src directory next to it.
+
+    Returns:
+    pathlib.Path: The src directory the test runs from.
+    """
+    rng = np.random.default_rng(0)
+    for directory in ('aca', 'dem', 'fic', 'news'):
+        path = tmp_path / 'data' / 'corpus' / 'Texts' / directory
+        path.mkdir(parents=True)
+        for index in range(2):
+            sentences = random_sentences(rng, 40)
+            sentences.append([str(rng.choice(RARE_WORDS)), 'the', 'dog'])
+            write_corpus_file(path / f'{directory}{index}.xml', sentences)
+
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'documentation').mkdir()
+    monkeypatch.chdir(tmp_path / 'src')
+    return tmp_path / 'src'
+
+@pytest.fixture
+def test_sentences(workspace):
+    """ The test set sentences of the workspace's corpus, plus one with unknown words.
+    """
+    from dataset_functions import split_exists, splitting_datasets, split_texts
+    if not split_exists():
+        splitting_datasets()
+    return split_texts('test') + ["the zebra saw an unknown aardvark", ""]
@@ -0,0 +1,38 @@
+"""
+Tests of the bulk command line tool.
+"""
+import io
+import json
+import cli
+from cli import run
+from decoding import Decoder, generation_pool
+from model_set import ModelSet
+
+def reject_constant(name):
+    raise ValueError(f"{name} is not valid JSON")
+
+def test_scores_are_strict_json(test_sentences):
+    model = ModelSet(('vanilla',)).models['vanilla']
+    output = io.StringIO()
+    run('score', model, 'all', [io.StringIO("the zebra saw an aardvark\nthe dog\n")], output)
+    results = [json.loads(line, parse_constant=reject_constant)
+               for line in output.getvalue().splitlines()]
+    assert results[0]['scores']['3'] == {'log_probability': None, 'perplexity': None}
+    assert all(score['perplexity'] > 0 for score in results[1]['scores'].values()
+               if score['perplexity'] is not None)
+
+def test_generate_opens_its_workers_once(test_sentences, monkeypatch):
+    model = ModelSet(('laplace',)).models['laplace']
+    opened = []
+    monkeypatch.setattr(cli, 'generation_pool',
+                        lambda *arguments: opened.append(arguments) or generation_pool(*arguments))
+    phrases = "the\na man\nthe dog\n"
+    outputs = []
+    for workers in (1, 2):
+        output = io.StringIO()
+        run('generate', model, '3', [io.StringIO(phrases)], output, chunk_size=1,
+            decoder=Decoder(model, '3', seed=0), per_phrase=3, workers=workers)
+        outputs.append(output.getvalue())
+    assert len(opened) == 1
+    assert outputs[0] == outputs[1]
+    assert len(outputs[1].splitlines()) == 9
@@ -0,0 +1,91 @@
+"""
+Tests of corpus counting, serial, parallel and incremental, and of the corpus split.
+"""
+import glob
+import os
+import shutil
+import numpy as np
+import dataset_functions
+from conftest import write_corpus_file
+from dataset_functions import (CORPUS_COUNTS_PATH, MANIFEST_FILE, generate_corpus_counts,
+                               iter_corpus_files, load_counts, splitting_datasets)
+from sentence_store import ArrayWriter, SentenceStore, SentenceStoreWriter
+
+def saved_counts():
+    return [list(n_gram_counts.items()) for n_gram_counts in load_counts(CORPUS_COUNTS_PATH)]
+
+def test_parallel_counts_equal_serial_counts(workspace):
+    generate_corpus_counts(workers=1)
+    serial = saved_counts()
+    shutil.rmtree(CORPUS_COUNTS_PATH)
+    generate_corpus_counts(workers=2)
+    # the same counts in the same key order
+    assert saved_counts() == serial
+
+def test_incremental_counts_equal_a_full_recount(workspace):
+    generate_corpus_counts(incremental=True)
+    files = sorted(iter_corpus_files())
+    write_corpus_file(files[0], [['a', 'changed', 'file']])
+    os.remove(files[1])
+    write_corpus_file(os.path.join(os.path.dirname(files[2]), 'added.xml'),
+                      [['an', 'added', 'file'], ['the', 'dog']])
+
+    generate_corpus_counts(workers=2, incremental=True)
+    incremental = [dict(n_gram_counts) for n_gram_counts in load_counts(CORPUS_COUNTS_PATH)]
+    shutil.rmtree(CORPUS_COUNTS_PATH)
+    generate_corpus_counts()
+    assert incremental == [dict(n_gram_counts) for n_gram_counts in load_counts(CORPUS_COUNTS_PATH)]
+
+def test_per_file_counts_are_only_kept_in_incremental_mode(workspace):
+    generate_corpus_counts(incremental=True)
+    assert os.listdir(os.path.join(CORPUS_COUNTS_PATH, 'files'))
+    generate_corpus_counts()
+    assert not os.path.exists(os.path.join(CORPUS_COUNTS_PATH, 'files'))
+    assert not os.path.exists(os.path.join(CORPUS_COUNTS_PATH, MANIFEST_FILE))
+
+def test_files_unchanged_since_the_split_are_counted_without_parsing(workspace, monkeypatch):
+    generate_corpus_counts()
+    parsed_counts = saved_counts()
+    shutil.rmtree(CORPUS_COUNTS_PATH)
+    splitting_datasets()
+
+    parsed = []
+    tokenize_file = dataset_functions.tokenize_file
+    def tracked_tokenize_file(file_path, store):
+        parsed.append(file_path)
+        return tokenize_file(file_path, store)
+    monkeypatch.setattr(dataset_functions, 'tokenize_file', tracked_tokenize_file)
+
+    generate_corpus_counts()
+    assert not parsed
+    assert saved_counts() == parsed_counts
+    shutil.rmtree(CORPUS_COUNTS_PATH)
+    generate_corpus_counts(workers=2)
+    assert saved_counts() == parsed_counts
+
+    changed = sorted(iter_corpus_files())[0]
+    write_corpus_file(changed, [['a', 'changed', 'file']])
+    generate_corpus_counts()
+    assert parsed == [changed]
+
+def test_written_sentence_store_matches_one_built_in_memory(tmp_path):
+    sentences = [["a", "b", "c"], [], ["b", "d"], ["e"] * 5, ["a"]]
+    store, writer = SentenceStore(), SentenceStoreWriter(str(tmp_path / 'store'), buffer_size=3)
+    for words in sentences:
+        assert store.add(words) == writer.add(words)
+    writer.close()
+    written = SentenceStore.load(str(tmp_path / 'store'))
+    assert list(written.iter_words()) == sentences
+    np.testing.assert_array_equal(written.tokens, store.tokens)
+    np.testing.assert_array_equal(written.offsets, store.offsets)
+    assert not glob.glob(str(tmp_path / 'store' / '*.part'))
+
+def test_array_writer_saves_rows_and_empty_arrays(tmp_path):
+    rows = ArrayWriter(str(tmp_path / 'rows.npy'), np.int32, columns=2)
+    rows.append([[0, 1], [0, 2]])
+    rows.append(np.array([[1, 0]]))
+    rows.close(block_size=4)
+    np.testing.assert_array_equal(np.load(tmp_path / 'rows.npy'), [[0, 1], [0, 2], [1, 0]])
+    empty = ArrayWriter(str(tmp_path / 'empty.npy'), np.int32, columns=2)
+    empty.close()
+    assert np.load(tmp_path / 'empty.npy').shape == (0, 2)
@@ -0,0 +1,34 @@
+"""
+Tests of the batched decoders.
+"""
+from itertools import islice
+import pytest
+from dataset_functions import iter_split_sentences
+from decoding import MODES, Decoder
+from laplace import LaplaceLM
+
+def continuations(decoder):
+    """ Completes the first two words of some training sentences, and an empty phrase, and
+    returns the words generated for each, without the end marker.
+    """
+    prompts = [words[:2] for words in islice(iter_split_sentences('train'), 6)] + [[]]
+    return [words[len(prompt) + 1:-1]
+            for prompt, words in zip(prompts, decoder.generate(prompts))]
+
+def test_beam_search_continuations_depend_on_the_prompt(test_sentences):
+    decoder = Decoder(LaplaceLM(), '3', mode='beam', max_words=8)
+    beams = continuations(decoder)
+    assert len({tuple(words) for words in beams}) > 1
+    assert all(words for words in beams)
+
+def test_length_penalty_favours_longer_beams(test_sentences):
+    model = LaplaceLM()
+    unnormalised = continuations(Decoder(model, '3', mode='beam', max_words=8,
+                                         length_penalty=0))
+    normalised = continuations(Decoder(model, '3', mode='beam', max_words=8))
+    assert sum(map(len, normalised)) >= sum(map(len, unnormalised))
+
+@pytest.mark.parametrize('mode', MODES)
+def test_min_words_holds_back_the_end_marker(test_sentences, mode):
+    decoder = Decoder(LaplaceLM(), '2', mode=mode, max_words=20, min_words=5, seed=0)
+    assert all(len(words) >= 5 for words in continuations(decoder))
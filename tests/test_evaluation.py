@@ -0,0 +1,22 @@
+"""
+Tests of perplexity evaluation, serial and in worker processes.
+"""
+import numpy as np
+from dataset_functions import model_perplexity
+from evaluation import evaluate_perplexities
+from model_set import ModelSet
+
+def test_parallel_perplexities_equal_serial_perplexities(test_sentences):
+    models = list(ModelSet(('vanilla', 'laplace', 'unk', 'kneser_ney')))
+    serial = evaluate_perplexities(models, workers=1, shard_size=50)
+    parallel = evaluate_perplexities(models, workers=2, shard_size=50)
+    assert serial.keys() == parallel.keys()
+    for name, perplexities in serial.items():
+        np.testing.assert_allclose(parallel[name], perplexities, rtol=1e-12)
+
+def test_store_perplexities_equal_string_perplexities(test_sentences):
+    models = list(ModelSet(('laplace', 'kneser_ney')))
+    perplexities = evaluate_perplexities(models)
+    for model in models:
+        np.testing.assert_allclose(perplexities[model.__class__.__name__],
+                                   model_perplexity(model, test_sentences[:-2]), rtol=1e-9)
@@ -0,0 +1,35 @@
+"""
+Tests of the Kneser-Ney model's distributions, exact and pruned.
+"""
+import numpy as np
+import pytest
+from kneser_ney import KneserNeyLM
+
+def context_sums(model, order):
+    """ Sums the probability of every word of the vocabulary, and of an unknown word,
+    following each context of an order, the n-grams of the order below.
+    """
+    store = model.store
+    contexts = (np.zeros((1, 0), dtype=np.int64) if order == 1
+                else model._row_ids(order - 1, np.arange(len(store.keys[order - 2]))))
+    words = np.append(np.arange(len(store.vocabulary)), -1)
+    windows = np.hstack((np.repeat(contexts, len(words), axis=0),
+                         np.tile(words, len(contexts))[:, None]))
+    positions = np.arange(len(windows)) * order + order - 1
+    probabilities = model._order_probabilities(windows.ravel(), positions, order)[0][-1]
+    return probabilities.reshape(len(contexts), len(words)).sum(axis=1)
+
+@pytest.mark.parametrize('arguments', [{}, {'max_order': 4}, {'min_counts': 2},
+                                       {'entropy_threshold': 1e-4}, {'quantize_bits': 8},
+                                       {'quantize_bits': 16},
+                                       {'quantize_bits': 8, 'min_counts': 2}])
+def test_every_context_sums_to_one(workspace, arguments):
+    model = KneserNeyLM(**arguments)
+    for order in range(1, model.max_order + 1):
+        np.testing.assert_allclose(context_sums(model, order), 1.0, rtol=1e-9)
+
+def test_entropy_pruning_removes_n_grams(workspace):
+    full = KneserNeyLM()
+    pruned = KneserNeyLM(entropy_threshold=1e-4)
+    assert len(pruned.store.keys[2]) < len(full.store.keys[2])
+    assert len(pruned.store.keys[0]) == len(full.store.keys[0])
@@ -0,0 +1,150 @@
+"""
+Tests of the vanilla, Laplace and <UNK> models against a dictionary implementation of
+their formulas, and of the batch, lazy, file backed and incremental ways of scoring.
+"""
+import glob
+import os
+import shutil
+import numpy as np
+import pytest
+from conftest import write_corpus_file
+from dataset_functions import load_counts, iter_split_sentences, update_training_counts
+from kneser_ney import KneserNeyLM
+from laplace import LaplaceLM
+from unk import UnkLM
+from vanilla import VanillaLM
+
+CHOICES = ('1', '2', '3', '4')
+
+def reference_probabilities(counts, words, choice, smoothing, default_unigram):
+    """ Scores the words of a sentence from the count dictionaries, as the models did
+    before their counts were kept in arrays.
+    """
+    unigrams, bigrams, trigrams = counts
+    total, size = sum(unigrams.values()), len(unigrams)
+
+    def unigram(word):
+        if word not in unigrams:
+            return default_unigram
+        return (unigrams[word] + smoothing) / (total + smoothing * size)
+
+    def bigram(first, word):
+        if f'{first} {word}' in bigrams:
+            return (bigrams[f'{first} {word}'] + smoothing) / (unigrams[first] + smoothing * size)
+        return smoothing / (unigrams.get(first, 1) + size)
+
+    def trigram(first, second, word):
+        if f'{first} {second} {word}' in trigrams:
+            return ((trigrams[f'{first} {second} {word}'] + smoothing)
+                    / (bigrams[f'{first} {second}'] + smoothing * size))
+        return smoothing / (1 + size)
+
+    if choice == '1':
+        return [unigram(word) or unigram('<UNK>') for word in words]
+    padded = ['<s>', '<s>'] + words
+    scores = []
+    for index, word in enumerate(words, start=2):
+        first, second = padded[index - 2], padded[index - 1]
+        scores.append({'2': bigram(second, word), '3': trigram(first, second, word),
+                       '4': 0.1 * unigram(word) + 0.3 * bigram(second, word)
+                            + 0.6 * trigram(first, second, word)}[choice])
+    return scores
+
+@pytest.mark.parametrize('model_class, smoothing', [(VanillaLM, 0), (LaplaceLM, 1), (UnkLM, 1)])
+def test_scores_match_the_dictionary_implementation(test_sentences, model_class, smoothing):
+    model = model_class()
+    counts = load_counts(model.counts_directory)
+    default_unigram = model._default_uni_value()
+    for sentence in test_sentences:
+        words = model._tokenize(sentence)
+        if model_class is UnkLM:
+            words = [word if word in model.vocabulary else '<UNK>' for word in words]
+        for choice in CHOICES:
+            np.testing.assert_allclose(
+                model.token_probabilities(sentence, choice),
+                reference_probabilities(counts, words, choice, smoothing, default_unigram),
+                rtol=1e-12)
+
+@pytest.mark.parametrize('model_class', [VanillaLM, LaplaceLM, UnkLM, KneserNeyLM])
+def test_batch_scores_equal_sentence_scores(test_sentences, model_class):
+    model = model_class()
+    log_probabilities, lengths = model.batch_log_probabilities(test_sentences)
+    for index, sentence in enumerate(test_sentences):
+        assert lengths[index] == len(model._tokenize(sentence))
+        for row, choice in enumerate(CHOICES):
+            np.testing.assert_allclose(log_probabilities[row, index],
+                                       model.sentence_log_probability(sentence, choice)[1],
+                                       rtol=1e-9)
+
+@pytest.mark.parametrize('model_class', [VanillaLM, LaplaceLM, UnkLM])
+def test_lazy_scores_equal_eager_scores(test_sentences, model_class):
+    lazy = model_class(lazy=True, cache_blocks=2)
+    lazy_probabilities = lazy.batch_token_probabilities(test_sentences)[0]
+    assert not glob.glob('n_grams/*/*.bin')
+
+    eager = model_class()
+    np.testing.assert_allclose(lazy_probabilities,
+                               eager.batch_token_probabilities(test_sentences)[0], rtol=1e-12)
+    # a lazy model started after the eager one maps the eager model's file
+    reloaded = model_class(lazy=True)
+    np.testing.assert_allclose(reloaded.batch_token_probabilities(test_sentences)[0],
+                               lazy_probabilities, rtol=1e-12)
+    assert any(statistics['misses'] for statistics in lazy.cache_statistics())
+
+@pytest.mark.parametrize('model_class', [VanillaLM, LaplaceLM, UnkLM, KneserNeyLM])
+def test_model_file_round_trip(test_sentences, monkeypatch, model_class):
+    model = model_class()
+    assert os.path.exists(model.model_path)
+    scores = model.batch_log_probabilities(test_sentences)[0]
+
+    def rebuild(self):
+        raise AssertionError("the model was rebuilt instead of loaded from its file")
+    monkeypatch.setattr(model_class, '_generate_probabilities', rebuild)
+    loaded = model_class()
+    np.testing.assert_array_equal(loaded.batch_log_probabilities(test_sentences)[0], scores)
+    np.testing.assert_array_equal(loaded.interpolated, model.interpolated)
+
+def assert_same_model(model, rebuilt, sentences):
+    for order in range(1, model.max_order + 1):
+        assert model.store.n_grams(order) == rebuilt.store.n_grams(order)
+        np.testing.assert_array_equal(model.store.counts[order - 1],
+                                      rebuilt.store.counts[order - 1])
+        np.testing.assert_allclose(model.store.probabilities[order - 1],
+                                   rebuilt.store.probabilities[order - 1], rtol=1e-12)
+    np.testing.assert_allclose(model.batch_log_probabilities(sentences)[0],
+                               rebuilt.batch_log_probabilities(sentences)[0], rtol=1e-12)
+
+@pytest.mark.parametrize('model_class', [VanillaLM, LaplaceLM, KneserNeyLM])
+@pytest.mark.parametrize('new_words', [False, True])
+def test_count_delta_equals_a_full_rebuild(workspace, test_sentences, model_class, new_words):
+    model = model_class()
+    sentences = [next(iter_split_sentences('train'))] * 3
+    if new_words:
+        sentences.append(['a', 'brand', 'new', 'sentence'])
+    write_corpus_file(workspace / 'extra.xml', sentences)
+
+    model.apply_count_delta(update_training_counts([str(workspace / 'extra.xml')]))
+    for path in glob.glob('n_grams/*/*.bin'):
+        os.remove(path)
+    assert_same_model(model, model_class(), test_sentences)
+
+def test_unk_count_delta_equals_a_full_rebuild(workspace, test_sentences):
+    model = UnkLM()
+    write_corpus_file(workspace / 'extra.xml', [next(iter_split_sentences('train'))] * 2)
+    model.apply_count_delta(update_training_counts([str(workspace / 'extra.xml')]))
+    os.remove(model.model_path)
+    assert_same_model(model, UnkLM(), test_sentences)
+
+def test_unk_counts_follow_training_count_updates(workspace, test_sentences):
+    UnkLM()
+    write_corpus_file(workspace / 'extra.xml', [next(iter_split_sentences('train'))] * 2)
+    update_training_counts([str(workspace / 'extra.xml')])
+    model = UnkLM()
+    assert model.store.counts[0].sum() == VanillaLM().store.counts[0].sum()
+    shutil.rmtree(model.counts_directory)
+    assert_same_model(model, UnkLM(), test_sentences)
+
+def test_model_arguments_rebuild_lazy_models(test_sentences):
+    model = LaplaceLM(lazy=True, cache_blocks=8)
+    rebuilt = LaplaceLM(**model.model_arguments())
+    assert rebuilt.lazy and rebuilt.cache_blocks == 8
@@ -0,0 +1,119 @@
+"""
+Tests of the array backed n-gram store and its model file format.
+"""
+import struct
+import numpy as np
+import pytest
+from dataset_functions import count_id_sentences
+from ngram_store import MAGIC, NGramStore, ProbabilityCache, QuantizedTable
+
+SENTENCES = [['the', 'dog', 'barks'], ['the', 'cat'], ['the', 'cat'], ['the', 'dog']]
+WORDS = ['the', 'dog', 'cat', 'barks']
+COUNTS = count_id_sentences(np.array([WORDS.index(word) for sentence in SENTENCES
+                                      for word in sentence]),
+                            np.array([len(sentence) for sentence in SENTENCES]), WORDS)
+
+def n_gram_ids(store, n_grams):
+    return np.array([store.vocabulary.to_ids(n_gram.split()) for n_gram in n_grams])
+
+def test_from_counts_holds_every_count():
+    store = NGramStore.from_counts(COUNTS)
+    assert store.max_order == 3
+    for order, n_gram_counts in enumerate(COUNTS, start=1):
+        assert dict(zip(store.n_grams(order), store.counts[order - 1].tolist())) == n_gram_counts
+        rows = store.find_rows(n_gram_ids(store, n_gram_counts))
+        assert store.counts[order - 1][rows].tolist() == list(n_gram_counts.values())
+
+def test_find_rows_misses_unseen_n_grams():
+    store = NGramStore.from_counts(COUNTS)
+    assert store.find_rows(n_gram_ids(store, ['cat dog', 'the barks'])).tolist() == [-1, -1]
+    assert store.find_rows(n_gram_ids(store, ['the cat dog'])).tolist() == [-1]
+
+def test_n_gram_rows_match_find_rows():
+    store = NGramStore.from_counts(COUNTS)
+    ids = np.array(store.vocabulary.to_ids("<s> <s> the dog barks </s>".split()))
+    rows = store.n_gram_rows(ids)
+    for order in range(1, 4):
+        for end in range(order - 1, len(ids)):
+            expected = store.find_rows(ids[None, end - order + 1:end + 1])[0]
+            assert rows[order - 1][end] == expected
+
+def test_successor_range_holds_the_successors():
+    store = NGramStore.from_counts(COUNTS)
+    parent = store.find_rows(n_gram_ids(store, ['the']))[0]
+    start, end = store.successor_range(2, parent)
+    word_ids = store.word_ids(2, np.arange(start, end))
+    assert {store.vocabulary.words[word_id] for word_id in word_ids} == {'dog', 'cat'}
+
+def test_save_and_load_round_trip(tmp_path):
+    store = NGramStore.from_counts(COUNTS)
+    store.probabilities = [np.random.default_rng(order).random(len(keys))
+                           for order, keys in enumerate(store.keys)]
+    path = str(tmp_path / 'model.bin')
+    store.save(path, {'weights': np.array([0.2, 0.8])})
+
+    loaded, extras = NGramStore.load(path)
+    assert loaded.vocabulary.words == store.vocabulary.words
+    for arrays, loaded_arrays in ((store.keys, loaded.keys), (store.counts, loaded.counts),
+                                  (store.probabilities, loaded.probabilities)):
+        for array, loaded_array in zip(arrays, loaded_arrays):
+            np.testing.assert_array_equal(array, loaded_array)
+    np.testing.assert_array_equal(extras['weights'], [0.2, 0.8])
+
+def test_view_file_is_loaded_over_its_base(tmp_path):
+    store = NGramStore.from_counts(COUNTS)
+    view = store.view([np.full(len(keys), 0.5) for keys in store.keys])
+    path = str(tmp_path / 'view.bin')
+    view.save(path, counts=False)
+
+    loaded, _ = NGramStore.load(path, store)
+    assert loaded.keys[2] is store.keys[2]
+    np.testing.assert_array_equal(loaded.probabilities[1], 0.5)
+    other = NGramStore.from_counts(COUNTS[:2])
+    with pytest.raises(ValueError):
+        NGramStore.load(path, other)
+    with pytest.raises(ValueError):
+        NGramStore.load(path)
+
+def test_load_rejects_other_format_versions(tmp_path):
+    path = str(tmp_path / 'model.bin')
+    NGramStore.from_counts(COUNTS).save(path)
+    with open(path, 'r+b') as fp:
+        fp.seek(len(MAGIC))
+        fp.write(struct.pack('<I', 0))
+    with pytest.raises(ValueError):
+        NGramStore.load(path)
+
+def test_apply_delta_updates_known_n_grams_only():
+    store = NGramStore.from_counts(COUNTS)
+    changed = store.apply_delta([{'the': 1}, {'the dog': 1}, {'<s> the dog': 1}])
+    assert [len(rows) for rows in changed] == [1, 1, 1]
+    assert store.counts[1][store.find_rows(n_gram_ids(store, ['the dog']))[0]] == 3
+    assert store.apply_delta([{}, {'the dog': -3}, {}]) is None
+    assert store.apply_delta([{}, {'cat dog': 1}, {}]) is None
+
+def test_prune_keeps_prefixes_of_kept_n_grams():
+    store = NGramStore.from_counts(COUNTS).prune((2, 2))
+    kept = set(store.n_grams(3))
+    assert kept == {n_gram for n_gram, count in COUNTS[2].items() if count >= 2}
+    bigrams = set(store.n_grams(2))
+    assert all(" ".join(n_gram.split()[:2]) in bigrams for n_gram in kept)
+
+def test_probability_cache_matches_the_computed_table():
+    values = np.arange(10000) / 10000
+    cache = ProbabilityCache(lambda rows: values[rows], len(values), block_size=100,
+                             max_blocks=4)
+    rows = np.random.default_rng(0).integers(len(values), size=500)
+    np.testing.assert_array_equal(cache[rows], values[rows])
+    assert len(cache.blocks) <= 4
+    assert cache.statistics()['misses'] > 0
+
+def test_quantized_table_keeps_the_mass_and_rounds_down():
+    values = np.random.default_rng(0).dirichlet(np.full(5000, 0.1))
+    values[::7] = 0
+    table = QuantizedTable.quantize(values, 8)
+    assert len(np.unique(table.codes)) <= 256
+    assert np.all(np.diff(table.codebook) > 0)
+    np.testing.assert_array_equal(table[:][values == 0], 0)
+    assert abs(table[:].sum() - values.sum()) < 1e-3
+    assert np.all(table.codebook[table.floor_codes(values)] <= values)
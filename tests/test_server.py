@@ -0,0 +1,47 @@
+"""
+Tests of the scoring server's request handling.
+"""
+import asyncio
+import json
+import pytest
+from model_set import ModelSet
+from server import RequestError, ScoringService
+
+def answer(models, path, request):
+    """ Dispatches one request to a service started on a new event loop, and returns the
+    response as it is sent, encoded as strict JSON.
+    """
+    async def dispatch():
+        service = ScoringService(models)
+        service.start()
+        try:
+            return await service.dispatch('POST', path, json.dumps(request).encode('utf-8'))
+        finally:
+            for task in service.tasks:
+                task.cancel()
+    return json.loads(json.dumps(asyncio.run(dispatch()), allow_nan=False))
+
+@pytest.fixture
+def models(test_sentences):
+    return ModelSet(('vanilla', 'laplace')).models
+
+def test_infinite_perplexities_are_null(models):
+    response = answer(models, '/perplexity',
+                      {'model': 'vanilla', 'sentences': ["the zebra saw an aardvark"]})
+    assert response['perplexities'][0] is None
+    response = answer(models, '/perplexity',
+                      {'model': 'laplace', 'sentences': ["the zebra saw an aardvark"]})
+    assert all(perplexity > 0 for perplexity in response['perplexities'])
+
+@pytest.mark.parametrize('options', [{'max_words': "5"}, {'top_p': "0.5"}, {'mode': 1},
+                                     {'beam_width': True}, {'max_words': 2.5}])
+def test_generate_rejects_options_of_the_wrong_type(models, options):
+    with pytest.raises(RequestError) as error:
+        answer(models, '/generate', dict({'model': 'laplace', 'phrase': "the"}, **options))
+    assert error.value.status == 400
+
+def test_generate_decodes_in_the_executor(models):
+    response = answer(models, '/generate', {'model': 'laplace', 'phrases': ["the", "a"],
+                                            'mode': 'greedy', 'max_words': 5})
+    assert len(response['texts']) == 2
+    assert all(text.startswith("<s>") for text in response['texts'])